@@ -0,0 +1,88 @@
+import argparse
+import importlib
+import json
+import sys
+from pathlib import Path
+
+from .common import collect, measure, summary
+
+# Runs the benchmarks of every module (or of the modules given), prints the
+# median and p95 of each and compares them against a baseline saved by an
+# earlier run:
+#
+#   python -m benchmarks --save benchmarks/baseline.json
+#   python -m benchmarks --compare benchmarks/baseline.json [-k NAME] [programs natural ...]
+#
+# A benchmark is slower when its median is more than --tolerance above the
+# baseline's; the run exits with 1 if any is. Saving keeps the entries of the
+# benchmarks that did not run, so a baseline can be refreshed a module at a time.
+
+
+def modules(names: list[str]) -> list[str]:
+    found = sorted(path.stem[len('bench_'):] for path in Path(__file__).parent.glob('bench_*.py'))
+    unknown = set(names) - set(found)
+    if unknown:
+        raise SystemExit(f'no benchmark modules {", ".join(sorted(unknown))}, there are {", ".join(found)}')
+    return [name for name in found if not names or name in names]
+
+
+def run(args) -> tuple[dict[str, dict], list[str]]:
+    baseline = {}
+    if args.compare is not None:
+        try:
+            baseline = json.loads(Path(args.compare).read_text())
+        except FileNotFoundError:
+            print(f'no baseline at {args.compare}, save one with --save')
+    results = {}
+    slower = []
+    for module in modules(args.modules):
+        benches = collect(vars(importlib.import_module(f'.bench_{module}', __package__)))
+        for name, bench in benches.items():
+            name = f'{module}.{name}'
+            if args.k is not None and args.k not in name:
+                continue
+            try:
+                result = summary(measure(bench(), repeat=args.repeat, max_time=args.max_time))
+            except Exception as exc:
+                # a missing optional dependency (antlr4 for the old parser) or a broken benchmark
+                print(f'{name:40} failed: {type(exc).__name__}: {exc}')
+                continue
+            results[name] = result
+            line = f'{name:40} {result["median"] * 1e3:12.3f} ms  p95 {result["p95"] * 1e3:12.3f} ms'
+            if name in baseline:
+                change = result['median'] / baseline[name]['median'] - 1
+                line += f'  {change:+8.1%}'
+                if change > args.tolerance:
+                    line += '  slower'
+                    slower.append(name)
+            print(line, flush=True)
+    if slower:
+        print(f'{len(slower)} slower than {args.compare}: {", ".join(slower)}')
+    return results, slower
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Run the benchmarks')
+    parser.add_argument('modules', nargs='*', metavar='MODULE',
+                        help='the modules to run, as programs for bench_programs.py (default: all)')
+    parser.add_argument('-k', metavar='NAME', help='only the benchmarks with NAME in module.name')
+    parser.add_argument('--compare', metavar='FILE', help='compare against the baseline in FILE')
+    parser.add_argument('--save', metavar='FILE', help='save the results as the baseline in FILE')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='how much slower a median may be than the baseline (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='repetitions of each benchmark (default: %(default)s)')
+    parser.add_argument('--max-time', type=float, default=2.0, metavar='SECONDS',
+                        help='stop repeating a benchmark after SECONDS, once it ran 3 times (default: %(default)s)')
+    args = parser.parse_args()
+    results, slower = run(args)
+    if args.save is not None:
+        path = Path(args.save)
+        saved = json.loads(path.read_text()) if path.is_file() else {}
+        saved.update(results)
+        path.write_text(json.dumps(saved, indent=2, sort_keys=True) + '\n')
+    sys.exit(1 if slower else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+from rfpl.natural import Natural
+
+from .common import main
+
+# Conversions between the int and list forms of Naturals, at the sizes that
+# stack.rfpl (a length and small entries) and inflist.rfpl produce, and
+# arithmetic on long lists.
+
+
+def stack_list(length: int):
+    return Natural([Natural(length)] + [Natural(i % 7 + 1) for i in range(length)])
+
+
+def tail_list(index: int):
+    # a single entry at a large prime index
+    return Natural([Natural(0)] * index + [Natural(1)])
+
+
+def to_int(nat: Natural):
+    # int(nat) is cached, time the product itself
+    return nat.multiply
+
+
+def factor(nat: Natural):
+    num = int(nat)
+    return lambda : Natural(num).entries()
+
+
+def bench_int_stack_100():
+    return to_int(stack_list(100))
+
+
+def bench_int_stack_2000():
+    return to_int(stack_list(2000))
+
+
+def bench_factor_stack_100():
+    return factor(stack_list(100))
+
+
+def bench_factor_stack_2000():
+    return factor(stack_list(2000))
+
+
+def bench_factor_tail_5000():
+    return factor(tail_list(5000))
+
+
+def bench_factor_power():
+    return factor(Natural([Natural(0), Natural(0), Natural(100000)]))
+
+
+def bench_mixed_get_add():
+    # alternating list access (Get) and arithmetic (Add) on the same values
+    nat = stack_list(500)
+    num = Natural(int(nat))
+    def run():
+        for i in range(20):
+            nat.get_entry(Natural(i)) + (nat + Natural(1))
+            num.get_entry(Natural(i)) + (num + Natural(1))
+    return run
+
+
+def bench_mul_lists_10k():
+    # Mul and Pow as vector operations on the exponents
+    a = Natural([Natural(i % 1000) for i in range(10000)])
+    b = Natural([Natural(i % 999) for i in range(10000)])
+    return lambda : a * b
+
+
+def bench_pow_list_10k():
+    a = Natural([Natural(i % 1000) for i in range(10000)])
+    return lambda : a ** Natural(3)
+
+
+if __name__ == '__main__':
+    main(globals())
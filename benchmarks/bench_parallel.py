@@ -0,0 +1,66 @@
+from rfpl.interpreter import Interpreter
+from rfpl import settings
+
+from .common import main
+
+# Cn with two expensive arguments, evaluated in order and on a pool of two
+# workers (settings.PARALLEL_WORKERS). The threshold is 0, so the parallel runs
+# dispatch at every size and show where the pool starts to pay off; it needs a
+# machine with at least two cores to pay off at all.
+
+SETUP = ['load basics', 'spin = Pr[!0, Cn[Mod, Cn[Add, Cn[Mul, !0, !0], #1], #1000003]]',
+         'both = Cn[Add, Cn[spin, !0, #2], Cn[spin, !0, #3]]']
+
+
+def both(n: int, workers: int):
+    intr = Interpreter()
+    for cmd in SETUP:
+        intr.report(cmd)
+
+    def run():
+        saved = settings.PARALLEL_WORKERS, settings.PARALLEL_THRESHOLD, settings.CACHE
+        # without the cache, as the cache of a worker would answer the repeated runs
+        settings.PARALLEL_WORKERS, settings.PARALLEL_THRESHOLD, settings.CACHE = workers, 0, False
+        try:
+            intr.report(f'both({n})')
+        finally:
+            settings.PARALLEL_WORKERS, settings.PARALLEL_THRESHOLD, settings.CACHE = saved
+    # the first run measures the arguments and starts the pool
+    run()
+    return run
+
+
+def bench_serial_100():
+    return both(100, None)
+
+
+def bench_parallel_100():
+    return both(100, 2)
+
+
+def bench_serial_1k():
+    return both(1000, None)
+
+
+def bench_parallel_1k():
+    return both(1000, 2)
+
+
+def bench_serial_10k():
+    return both(10000, None)
+
+
+def bench_parallel_10k():
+    return both(10000, 2)
+
+
+def bench_serial_100k():
+    return both(100000, None)
+
+
+def bench_parallel_100k():
+    return both(100000, 2)
+
+
+if __name__ == '__main__':
+    main(globals())
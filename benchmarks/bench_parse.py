@@ -0,0 +1,158 @@
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from rfpl import settings, syntax
+from rfpl.interpreter import Interpreter
+
+from .common import main
+
+# Parsing the lines of the library with rfpl.syntax and with the ANTLR parser
+# it replaced (generated from RFPL.g4 by `make build`), the time a fresh
+# interpreter takes to import either of them, and loading modules (generated
+# ones and the library) with and without the module cache.
+
+LIB = Path(__file__).parent.parent / 'rfpl' / 'lib'
+
+
+def library_lines() -> list[str]:
+    # the commands of the library, joined as Interpreter.load_rfpl_module joins them
+    lines = []
+    for path in sorted(LIB.glob('*.rfpl')):
+        cmd = ''
+        for line in path.read_text().splitlines():
+            cmd += line.strip() + ' '
+            try:
+                syntax.parse(cmd)
+            except syntax.ParseError as exc:
+                if exc.at_eof:
+                    continue
+            lines.append(cmd)
+            cmd = ''
+    return lines
+
+
+def bench_parse_library():
+    lines = library_lines()
+
+    def run():
+        for line in lines:
+            syntax.parse(line)
+    return run
+
+
+def bench_parse_library_antlr():
+    from antlr4 import CommonTokenStream, InputStream
+    from rfpl.RFPLLexer import RFPLLexer
+    from rfpl.RFPLParser import RFPLParser
+    lines = library_lines()
+
+    def run():
+        for line in lines:
+            lexer = RFPLLexer(InputStream(line))
+            lexer.removeErrorListeners()
+            parser = RFPLParser(CommonTokenStream(lexer))
+            parser.removeErrorListeners()
+            parser.singleline()
+    return run
+
+
+def cold_import(statement: str):
+    def run():
+        subprocess.run([sys.executable, '-c', statement], check=True)
+    return run
+
+
+def bench_import_python():
+    return cold_import('pass')
+
+
+def bench_import_syntax():
+    return cold_import('import rfpl.syntax')
+
+
+def bench_import_antlr():
+    return cold_import('import rfpl.RFPLLexer, rfpl.RFPLParser')
+
+
+def bench_import_interpreter():
+    return cold_import('import rfpl.interpreter')
+
+
+def load(source: str, cached: bool = False):
+    # with cached, the loads after the first one read the module cache (see rfpl/rfplc.py)
+    path = Path(tempfile.mkdtemp()) / 'generated.rfpl'
+    path.write_text(source)
+
+    def run():
+        settings.MODULE_CACHE = cached
+        try:
+            if not Interpreter().load_rfpl_module(path):
+                raise Exception(f'{path} failed to load')
+        finally:
+            settings.MODULE_CACHE = True
+    return run
+
+
+def definitions(count: int) -> str:
+    # count definitions of three lines each
+    return ''.join(f'; f{i}(x)\nf{i} = Cn[S,\n  !0]\n' for i in range(count))
+
+
+def nested(depth: int) -> str:
+    # one definition of depth lines
+    return 'f = ' + ''.join('Cn[S,\n' for _ in range(depth)) + '!0' + ']' * depth + '\n'
+
+
+def bench_load_definitions_1k():
+    return load(definitions(1000))
+
+
+def bench_load_definitions_10k():
+    return load(definitions(10000))
+
+
+# each definition looks up S and adds its own symbol, linear with an indexed symbol table
+def bench_load_definitions_50k():
+    return load(definitions(50000))
+
+
+def bench_load_nested_100():
+    return load(nested(100))
+
+
+def bench_load_nested_200():
+    return load(nested(200))
+
+
+def bench_load_definitions_1k_cached():
+    return load(definitions(1000), cached=True)
+
+
+def bench_load_nested_100_cached():
+    return load(nested(100), cached=True)
+
+
+def load_library(cached: bool):
+    def run():
+        settings.MODULE_CACHE = cached
+        try:
+            ok, messages = Interpreter().report('load all')
+            if not ok:
+                raise Exception(f'"load all" failed: {[msg.message for msg in messages]}')
+        finally:
+            settings.MODULE_CACHE = True
+    return run
+
+
+def bench_load_library():
+    return load_library(False)
+
+
+def bench_load_library_cached():
+    return load_library(True)
+
+
+if __name__ == '__main__':
+    main(globals())
@@ -0,0 +1,142 @@
+from rfpl.interpreter import Interpreter
+from rfpl import settings
+
+from .common import main
+
+# Whole programs from the library, timed through Interpreter.report.
+
+
+def program(setup: list[str], line: str, recognize: bool = True):
+    # without recognize, the setup defines arithmetic as written (see recognize.py)
+    intr = Interpreter()
+    settings.RECOGNIZE = recognize
+    try:
+        for cmd in setup:
+            ok, messages = intr.report(cmd)
+            if not ok:
+                raise Exception(f'"{cmd}" failed: {[msg.message for msg in messages]}')
+    finally:
+        settings.RECOGNIZE = True
+    intr.cache.clear()
+
+    def run():
+        intr.report(line)
+        intr.cache.clear()
+    return run
+
+
+STACK = ['load stack', 'load logic', 'even = Cn[not, Cn[Mod, !0, #2]]',
+         'xs = Pr[empty, Cn[append, !0, !1]]']
+
+
+def bench_filter_even():
+    return program(STACK, 'filter[even](xs(60))')
+
+
+def bench_map_succ():
+    return program(STACK, 'map[S](xs(60))')
+
+
+# map over 1k and 10k entries, a linear time map takes about ten times longer on the second
+def bench_map_succ_1k():
+    return program(STACK, 'map[S](xs(1000))')
+
+
+def bench_map_succ_10k():
+    return program(STACK, 'map[S](xs(10000))')
+
+
+def bench_filter_even_1k():
+    return program(STACK, 'filter[even](xs(1000))')
+
+
+def bench_concat_100():
+    return program(STACK, 'concat(xs(100), xs(100))')
+
+
+def bench_concat_1k():
+    return program(STACK, 'concat(xs(1000), xs(1000))')
+
+
+# the lazy evaluation example of the README, with mul recognized and as the Pr it is written as
+README = ['add = Pr[!0, Cn[S, !0]]', 'mul = Pr[#0, Cn[add, !2, !0]]']
+
+
+def bench_readme_mul():
+    return program(README, 'mul(1000, 1000)')
+
+
+def bench_readme_mul_pr():
+    return program(README, 'mul(1000, 1000)', recognize=False)
+
+
+def bench_readme_strict():
+    return program(README, 'mul(0, mul(1000, 1000))', recognize=False)
+
+
+def bench_readme_lazy():
+    return program(README, 'mul(0, ~mul(1000, 1000))', recognize=False)
+
+
+def bench_factor_100():
+    return program(['load inflist'], 'factor(100, 1023)')
+
+
+def bench_factor_300():
+    return program(['load inflist'], 'factor(300, 1023)')
+
+
+FIBS = ['load inflist', 'load parsa-fib', 'fibs = imap[get0, fib]']
+
+
+def bench_scanl_fibs_100():
+    return program(FIBS, 'scanl[fibs](100)')
+
+
+def bench_scanl_scanr_fibs_20():
+    return program(FIBS, 'scanl[scanr[fibs]](20)')
+
+
+# fib.rfpl keeps the pair in 2^a 3^b and takes it apart with bounded searches, fib(3) takes seconds
+def bench_fib_pairs_2():
+    return program(['load fib'], 'fib(2)')
+
+
+# filter_even under the profiler, against filter_even its overhead; without it the profiler costs nothing
+def bench_filter_even_profiled():
+    run = program(STACK, 'filter[even](xs(60))')
+    profiler = Interpreter().profiler
+
+    def profiled():
+        profiler.start()
+        try:
+            run()
+        finally:
+            profiler.stop()
+            profiler.reset()
+    return profiled
+
+
+# the same 1000 calls as lines of report and as one call_many
+def bench_report_1k():
+    intr = Interpreter()
+    intr.report('load logic')
+    def run():
+        for n in range(1000):
+            intr.report(f'leq({n}, {1000 - n})')
+        intr.cache.clear()
+    return run
+
+
+def bench_call_many_1k():
+    intr = Interpreter()
+    intr.report('load logic')
+    def run():
+        for _ in intr.call_many('leq', ((n, 1000 - n) for n in range(1000))):
+            pass
+        intr.cache.clear()
+    return run
+
+
+if __name__ == '__main__':
+    main(globals())
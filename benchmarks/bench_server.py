@@ -0,0 +1,99 @@
+import atexit
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from rfpl.client import Client
+
+from .common import main
+
+# The evaluation server (see rfpl/server.py) under load: requests on a warm
+# server over stdio, against starting rfpl for each one, opening forked
+# sessions, and clients connecting to a Unix socket at the same time.
+
+LINE = 'filter[even](xs(20))'
+SETUP = ['even = Cn[not, Cn[Mod, !0, #2]]', 'xs = Pr[empty, Cn[append, !0, !1]]']
+PRELOAD = ['stack', 'logic']
+
+
+def bench_spawn_per_request():
+    script = ''.join(f'load {module}\n' for module in PRELOAD) + ''.join(line + '\n' for line in SETUP) + LINE + '\n'
+
+    def run():
+        subprocess.run([sys.executable, '-m', 'rfpl', '-'], input=script.encode(), stdout=subprocess.DEVNULL, check=True)
+    return run
+
+
+def warm() -> Client:
+    client = Client.spawn(preload=PRELOAD)
+    for line in SETUP:
+        client.define(line)
+    return client
+
+
+def bench_stdio_evaluate_100():
+    client = warm()
+
+    def run():
+        for _ in range(100):
+            client.evaluate(LINE)
+    return run
+
+
+def bench_stdio_call_100():
+    client = warm()
+
+    def run():
+        for n in range(100):
+            client.call('leq', [n, 100 - n])
+    return run
+
+
+def bench_session_open_close():
+    client = warm()
+
+    def run():
+        session = client.open()
+        client.evaluate(LINE, session=session)
+        client.close_session(session)
+    return run
+
+
+def clients(count: int, requests: int):
+    # count clients at once, each on its own connection (a forked copy of the server)
+    path = os.path.join(tempfile.mkdtemp(), 'rfpl.sock')
+    server = subprocess.Popen([sys.executable, '-m', 'rfpl', 'serve', '--socket', path,
+                               *(arg for module in PRELOAD for arg in ('--preload', module))])
+    atexit.register(server.terminate)
+    while not os.path.exists(path):
+        time.sleep(0.01)
+
+    def client():
+        with Client.connect(path) as conn:
+            for line in SETUP:
+                conn.define(line)
+            for _ in range(requests):
+                conn.evaluate(LINE)
+
+    def run():
+        threads = [threading.Thread(target=client) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return run
+
+
+def bench_socket_clients_4x25():
+    return clients(4, 25)
+
+
+def bench_socket_clients_16x25():
+    return clients(16, 25)
+
+
+if __name__ == '__main__':
+    main(globals())
@@ -0,0 +1,59 @@
+import statistics
+import sys
+import time
+
+# A benchmark module defines functions bench_<name>() that do their setup and
+# return the callable to time. Running a module times all of its benchmarks:
+#
+#   python -m benchmarks.bench_natural [name ...]
+#
+# and python -m benchmarks runs every module against a saved baseline (see
+# __main__.py).
+
+
+def measure(fun, repeat: int = 5, min_time: float = 0.05, max_time: float = None) -> list[float]:
+    # seconds per call of each repetition; a repetition calls fun enough times to
+    # take min_time, and repetitions stop early (after at least 3) past max_time
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fun()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    times = [elapsed / number]
+    total = elapsed
+    for _ in range(repeat - 1):
+        if max_time is not None and total >= max_time and len(times) >= 3:
+            break
+        start = time.perf_counter()
+        for _ in range(number):
+            fun()
+        elapsed = time.perf_counter() - start
+        times.append(elapsed / number)
+        total += elapsed
+    return times
+
+
+def summary(times: list[float]) -> dict:
+    # the median and the 95th percentile, in seconds
+    if len(times) < 2:
+        return {'median': times[0], 'p95': times[0]}
+    return {'median': statistics.median(times),
+            'p95': statistics.quantiles(times, n=20, method='inclusive')[18]}
+
+
+def collect(namespace: dict) -> dict:
+    return {name[len('bench_'):]: fun for name, fun in namespace.items()
+            if name.startswith('bench_') and callable(fun)}
+
+
+def main(namespace: dict):
+    names = sys.argv[1:]
+    for name, bench in collect(namespace).items():
+        if names and name not in names:
+            continue
+        result = summary(measure(bench()))
+        print(f'{name:30} {result["median"] * 1e3:12.3f} ms  (p95 {result["p95"] * 1e3:.3f} ms)')
@@ -5,9 +5,7 @@ import random
 import json
 from typing import Union, List
 from pathlib import Path
-from rfpl.interpreter import Interpreter, DEBUG
-from rfpl.RFPLLexer import RFPLLexer
-from rfpl.RFPLParser import RFPLParser
+from rfpl import settings, syntax
 from rfpl.interpreter import Interpreter, Message, MessageType
 from rfpl.natural import Natural, NaturalList
 from rfpl.symbol import SymbolEntry, FunctionType
@@ -19,8 +17,6 @@ from prompt_toolkit.completion import Completer, Completion
 from prompt_toolkit.patch_stdout import patch_stdout
 from prompt_toolkit.lexers import Lexer
 from prompt_toolkit.styles import Style
-import antlr4
-from antlr4.ParserRuleContext import ParserRuleContext
 
 intr, lastTree = None, None
 def check_grammar(cmd, superc=True):
@@ -52,21 +48,17 @@ class CustomLexer(Lexer):
     def lex_document(self, document):
         def get_line(lineno):
             line = document.lines[lineno]
-            input_stream = antlr4.InputStream(line)
-            lexer = RFPLLexer(input_stream)
-            lexer.removeErrorListeners()
             formatted = []
-            while True:
-                tok = lexer.nextToken()
-                if tok.type == antlr4.Token.EOF:
+            for tok in syntax.tokenize(line, hidden=True):
+                if tok.type == syntax.EOF:
                     break
-                if tok.type == RFPLLexer.Unknown:
+                if tok.type == syntax.UNKNOWN:
                     formatted.append(('class:error', tok.text))
-                elif tok.type == RFPLLexer.Comment:
+                elif tok.type == syntax.COMMENT:
                     formatted.append(('class:comment', tok.text))
-                elif tok.type == RFPLLexer.Number or tok.text in ('!', '#', '@'):
+                elif tok.type == syntax.NUMBER or tok.text in ('!', '#', '@'):
                     formatted.append(('class:number', tok.text))
-                elif tok.text in ('Cn', 'Pr', 'Mn', 'S', '#load'):
+                elif tok.text in ('Cn', 'Pr', 'Mn', 'S', 'load'):
                     formatted.append(('class:keyword', tok.text))
                 else:
                     formatted.append(('class:text', tok.text))
@@ -107,7 +99,7 @@ def line_breaker(lines, lim):
     return res
 
 def typewriter(text, highlights=[], end='\n'):
-    t = 0 if DEBUG else 1
+    t = 0 if settings.VERBOSE >= 2 else 1
     lines = text.split('\n')
     lines = line_breaker(lines, shutil.get_terminal_size()[0] - 3)
     fst = True
@@ -336,6 +328,24 @@ assumedFunctions = {
         ftype=FunctionType(narg=2),
     )
 }
+syntaxRules = {
+    syntax.Define: 'define', syntax.Examine: 'examine', syntax.Load: 'load',
+    syntax.Leaf: 'fexprleaf', syntax.Cn: 'builtinCn', syntax.Pr: 'builtinPr', syntax.Mn: 'builtinMn',
+    syntax.Identity: 'identity', syntax.Constant: 'constant', syntax.Bracket: 'bracket', syntax.Call: 'nexpr',
+}
+syntaxChildren = {
+    syntax.Define: lambda tree : [tree.fexpr],
+    syntax.Examine: lambda tree : [tree.nexpr],
+    syntax.Load: lambda tree : [],
+    syntax.Leaf: lambda tree : tree.bases or [],
+    syntax.Cn: lambda tree : [tree.h, *tree.gs],
+    syntax.Pr: lambda tree : [tree.h, tree.g],
+    syntax.Mn: lambda tree : [tree.h],
+    syntax.Identity: lambda tree : [],
+    syntax.Constant: lambda tree : [tree.literal],
+    syntax.Bracket: lambda tree : [],
+    syntax.Call: lambda tree : [tree.fexpr, *tree.args],
+}
 class Challenge(Act):
     def __init__(self, journey, starter: str, prerequisites: List[Act], target: str,
                  tests: list, limits: List[str], have: List[str], hints: List[str], banner: str):
@@ -349,11 +359,17 @@ class Challenge(Act):
         self.banner = banner
 
     def collect_used_rules(self, tree, usedRules):
-        if isinstance(tree, ParserRuleContext):
-            rule_name = tree.parser.ruleNames[tree.getRuleIndex()]
-            usedRules.add(rule_name)
-        for i in range(tree.getChildCount()):
-            child = tree.getChild(i)
+        # the limits are named after the rules of RFPL.g4
+        if tree is None:
+            return
+        if isinstance(tree, syntax.Literal):
+            if isinstance(tree.value, list):
+                usedRules.add('naturallist')
+                for entry in tree.value:
+                    self.collect_used_rules(entry, usedRules)
+            return
+        usedRules.add(syntaxRules[type(tree)])
+        for child in syntaxChildren[type(tree)](tree):
             self.collect_used_rules(child, usedRules)
 
     def crosslimit(self):
@@ -381,13 +397,13 @@ class Challenge(Act):
         if syment.ftype.nbase > 0:
             typewriter(f'\'{syment.symbol}\' is not a finished function.')
             return False
-        for test in self.tests:
+        actuals = intr.call_many(syment.symbol, self.tests)
+        for test, actual in zip(self.tests, actuals):
             args = []
             for numb in test:
                 args.append(Natural(numb))
             args = NaturalList(args)
             expected = challengeFunctions[self.target]['func'](args)
-            actual = syment.call([], args)
             if int(expected) != int(actual):
                 typewriter(f'Oh, it\'s not working with input ({", ".join([str(n) for n in test])})')
                 return False
@@ -1,134 +1,9 @@
-import antlr4
 import argparse
-import os
-import re
-from prompt_toolkit import print_formatted_text as print
-from prompt_toolkit import PromptSession, ANSI
-from prompt_toolkit.lexers import Lexer
-from prompt_toolkit.patch_stdout import patch_stdout
-from prompt_toolkit.styles import Style
+import sys
 from importlib.metadata import version
 
 from . import settings
-from .RFPLLexer import RFPLLexer
-from .interpreter import Interpreter, MessageType
-
-
-def check_grammar(cmd, superc=True):
-    if superc and re.match(r'^\s*(exit|finish|end|list|save\s+[\w/\-]+)\s*$', cmd):
-        return True
-    return intr.parsable(cmd)[0]
-
-
-custom_style = Style.from_dict({
-    'keyword': 'fg:magenta',
-    'text': 'fg:white',
-    'comment': 'fg:green',
-    'error': 'fg:red',
-    'number': 'fg:orange',
-})
-
-
-C_GREEN = '\033[32m'
-C_ORANGE = '\033[33m'
-C_RED = '\033[31m'
-C_RESET = '\033[0m'
-
-
-class CustomLexer(Lexer):
-    def lex_document(self, document):
-        def get_line(lineno):
-            line = document.lines[lineno]
-            input_stream = antlr4.InputStream(line)
-            lexer = RFPLLexer(input_stream)
-            lexer.removeErrorListeners()
-            formatted = []
-            while True:
-                tok = lexer.nextToken()
-                if tok.type == antlr4.Token.EOF:
-                    break
-                if tok.type == RFPLLexer.Unknown:
-                    formatted.append(('class:error', tok.text))
-                elif tok.type == RFPLLexer.Comment:
-                    formatted.append(('class:comment', tok.text))
-                elif tok.type == RFPLLexer.Number or tok.text in ('!', '#', '@'):
-                    formatted.append(('class:number', tok.text))
-                elif tok.text in ('Cn', 'Pr', 'Mn', 'S', 'load'):
-                    formatted.append(('class:keyword', tok.text))
-                else:
-                    formatted.append(('class:text', tok.text))
-            return formatted
-        return get_line
-
-
-session = PromptSession(lexer=CustomLexer(), style=custom_style)
-
-
-def multiline_input():
-    cmd = ''
-    fst = True
-    with patch_stdout():
-        while True:
-            line = session.prompt('>> ' if fst else '>  ').strip()
-            fst = False
-            if not line:
-                break
-            cmd += line + ' '
-            if check_grammar(cmd):
-                break
-    return cmd
-
-
-hist = ''
-def save(filename: str):
-    filename += '.rfpl'
-    if os.path.exists(filename):
-        print(ANSI(f'{C_RED}sorry, this file exists.{C_RESET}\n'))
-    else:
-        with open(filename, 'w') as f:
-            f.write(hist)
-            print(ANSI(f'   {C_GREEN}saved on {filename}{C_RESET}\n'))
-
-def mainloop():
-    global hist, intr
-    while True:
-        try:
-            line = multiline_input()
-        except (EOFError, KeyboardInterrupt):
-            break
-        if not line.strip():
-            continue
-        if re.match(r'^\s*(exit|finish|end)\s*$', line):
-            break
-        if re.match(r'^\s*list\s*$', line):
-            out = []
-            outstr = ''
-            for fun in intr.symbol_table.table[::-1]:
-                if fun.symbol != 'S' and fun.symbol not in out:
-                    outstr = ' ' + fun.symbol + (f'[{fun.ftype.nbase}]' if fun.ftype.nbase else f'({fun.ftype.narg})') + outstr
-                    out.append(fun.symbol)
-            print(ANSI(f'{C_ORANGE}..{outstr}{C_RESET}\n'))
-            continue
-        mtch = re.match(r'^\s*save\s+(?P<FILE>[\w/\-]+)\s*$', line)
-        if mtch:
-            save(mtch.group('FILE'))
-            continue
-        hist += line.strip() + '\n\n'
-        ok, messages = intr.report(line)
-        for msg in messages:
-            if msg.typ == MessageType.NATURAL:
-                print(ANSI(f' {C_GREEN}= {msg.natural}{C_RESET}'))
-            elif msg.typ == MessageType.INFO and settings.VERBOSE >= 1:
-                print(ANSI(f' {C_ORANGE}. {msg.message}{C_RESET}'))
-            elif msg.typ == MessageType.ERROR:
-                print(ANSI(f' {C_RED}! ERROR: {msg.message}{C_RESET}'))
-                if msg.context:
-                    for ctx in msg.context:
-                        print(ANSI(C_RED + ' '*7 + ctx + C_RESET))
-            elif msg.typ == MessageType.EXCEPTION:
-                print(ANSI(f' {C_RED}* EXCEPTION: {msg.message}{C_RESET}'))
-        if settings.VERBOSE >= 1:
-            print()
+from .interpreter import Interpreter
 
 
 def get_version():
@@ -139,12 +14,35 @@ def get_version():
 
 
 def main():
-    global intr
     parser = argparse.ArgumentParser(
         prog='rfpl',
         description='Recursive functional programming language',
         epilog=f'rfpl v{get_version()}',
     )
+    parser.add_argument(
+        'script',
+        nargs='*',
+        metavar='run FILE | - | serve',
+        help='run the commands of FILE (or of the standard input), or answer JSON-RPC requests '
+             '(see rfpl/server.py), instead of the interactive session',
+    )
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='write the messages of each command of a script as a line of JSON',
+    )
+    parser.add_argument(
+        '--socket',
+        metavar='PATH',
+        help='serve on a Unix socket at PATH instead of the standard input and output',
+    )
+    parser.add_argument(
+        '--preload',
+        action='append',
+        default=[],
+        metavar='MODULE',
+        help='load MODULE before serving, for every connection and session',
+    )
     parser.add_argument(
         '-v', '--verbose',
         default=0,
@@ -155,13 +53,121 @@ def main():
         default=0,
         action='count'
     )
+    parser.add_argument(
+        '--engine',
+        choices=('compile', 'walk', 'stack'),
+        default=settings.ENGINE,
+        help='evaluation engine (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='do not memoize calls of rfpl functions',
+    )
+    parser.add_argument(
+        '--no-recognize',
+        action='store_true',
+        help='do not replace recognized arithmetic definitions with native operations',
+    )
+    parser.add_argument(
+        '--mn-limit',
+        type=int,
+        default=settings.MN_LIMIT,
+        metavar='N',
+        help='give up a Mn search (as undefined) after N candidates',
+    )
+    parser.add_argument(
+        '--mn-timeout',
+        type=float,
+        default=settings.MN_TIMEOUT,
+        metavar='SECONDS',
+        help='give up a Mn search (as undefined) after SECONDS seconds',
+    )
+    parser.add_argument(
+        '--mn-monotone',
+        action='store_true',
+        help='assume Mn predicates are monotone and search them by bisection',
+    )
+    parser.add_argument(
+        '--prime-table',
+        default=settings.PRIME_TABLE,
+        metavar='FILE',
+        help='map the primes saved in FILE by `python -m rfpl.primes`',
+    )
+    parser.add_argument(
+        '--parallel',
+        type=int,
+        default=settings.PARALLEL_WORKERS,
+        metavar='N',
+        help='evaluate expensive arguments of Cn on N worker processes',
+    )
+    parser.add_argument(
+        '--parallel-threshold',
+        type=float,
+        default=settings.PARALLEL_THRESHOLD,
+        metavar='SECONDS',
+        help='send an argument of Cn to the workers once it took SECONDS (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--metrics',
+        default=settings.METRICS,
+        metavar='FILE',
+        help='append the metrics of each line to FILE as JSON lines',
+    )
+    parser.add_argument(
+        '--profile',
+        metavar='FILE',
+        help='profile the session, print the profile at exit and save its collapsed stacks to FILE',
+    )
     args = parser.parse_args()
+    if (args.script and args.script not in (['-'], ['run', '-'], ['serve'])
+            and (len(args.script) != 2 or args.script[0] != 'run')):
+        parser.error('expected "run FILE", "-" or "serve"')
+    if args.profile and args.engine != 'compile':
+        parser.error(f'--profile needs --engine compile, not {args.engine}')
     settings.VERBOSE += args.verbose - args.brief
+    settings.ENGINE = args.engine
+    settings.CACHE = not args.no_cache
+    settings.RECOGNIZE = not args.no_recognize
+    settings.MN_LIMIT = args.mn_limit
+    settings.MN_TIMEOUT = args.mn_timeout
+    settings.MN_MONOTONE = args.mn_monotone
+    settings.PRIME_TABLE = args.prime_table
+    settings.PARALLEL_WORKERS = args.parallel
+    settings.PARALLEL_THRESHOLD = args.parallel_threshold
+    settings.METRICS = args.metrics
     intr = Interpreter()
+    if args.profile:
+        intr.profiler.start()
+    ok = True
     try:
-        mainloop()
+        if args.script == ['serve']:
+            from . import server
+            server.preload(intr, args.preload)
+            server.serve(intr, args.socket)
+        elif args.script:
+            # prompt_toolkit is only imported by the interactive session
+            from . import script
+            if args.script[-1] == '-':
+                ok = script.run(intr, sys.stdin, as_json=args.json)
+            else:
+                try:
+                    file = open(args.script[-1])
+                except OSError as e:
+                    parser.exit(1, f'rfpl: unable to open "{args.script[-1]}": {e.strerror}\n')
+                with file:
+                    ok = script.run(intr, file, as_json=args.json)
+        else:
+            from . import repl
+            repl.start(intr)
     except KeyboardInterrupt:
-        print('KeyboardInterrupt')
+        print('KeyboardInterrupt', file=sys.stderr)
+        ok = False
+    if args.profile:
+        intr.profiler.stop()
+        print(intr.profiler.report(), file=sys.stderr if args.script else sys.stdout)
+        intr.profiler.save(args.profile)
+    sys.exit(0 if ok else 1)
 
 
 if __name__ == '__main__':
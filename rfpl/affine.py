@@ -0,0 +1,114 @@
+from .budget import Budget
+from .compiler import CnNode, ConstantNode, IdentityNode, LazyNode, LeafNode, Node
+from .natural import Natural
+
+# Static analysis of the step g of Pr[h, g]. A step is affine when, on defined
+# values, g(acc, i, xs...) = a * acc + b where a and b depend neither on acc
+# (!0) nor on the counter (!1). Then n iterations have a closed form and Pr
+# only needs to evaluate g once more, for the last step, so that the result has
+# exactly the representation the loop would give.
+#
+# The step may be built from !0, loop invariant subexpressions, S and the
+# recognized add and mul (see recognize.py); a product is only affine when one
+# of its operands is invariant. The coefficients are computed at run time from
+# the values of the invariant subexpressions.
+
+
+class Form:
+    def __init__(self, a, b, depends: bool):
+        # a and b map the values of the invariants to ints
+        self.a = a
+        self.b = b
+        self.depends = depends
+
+
+def invariant(node: Node):
+    # does the node ignore both the accumulator and the counter
+    if isinstance(node, LazyNode):
+        return invariant(node.inner)
+    if isinstance(node, IdentityNode):
+        return node.number >= 2
+    if isinstance(node, ConstantNode):
+        return True
+    if isinstance(node, CnNode):
+        return (node.rest is None or node.rest >= 2) and all(invariant(g) for g in node.gs)
+    return False
+
+
+def native_call(node: Node, native: str, narg: int):
+    return (isinstance(node, CnNode) and node.rest is None and len(node.gs) == narg
+            and isinstance(node.h, LeafNode) and node.h.bases is None
+            and (node.h.syment.native == native
+                 or native == 'succ' and node.h.syment.builtin and node.h.syment.symbol == 'S'))
+
+
+def linear(node: Node, invariants: list[Node]):
+    if isinstance(node, IdentityNode) and node.number == 0:
+        return Form(lambda vals : 1, lambda vals : 0, True)
+    if invariant(node):
+        ix = len(invariants)
+        invariants.append(node)
+        return Form(lambda vals : 0, lambda vals : vals[ix], False)
+    if native_call(node, 'succ', 1):
+        inner = linear(node.gs[0], invariants)
+        if inner is None:
+            return None
+        return Form(inner.a, lambda vals : inner.b(vals) + 1, inner.depends)
+    if native_call(node, 'add', 2):
+        x = linear(node.gs[0], invariants)
+        y = linear(node.gs[1], invariants)
+        if x is None or y is None:
+            return None
+        return Form(lambda vals : x.a(vals) + y.a(vals), lambda vals : x.b(vals) + y.b(vals),
+                    x.depends or y.depends)
+    if native_call(node, 'mul', 2):
+        x = linear(node.gs[0], invariants)
+        y = linear(node.gs[1], invariants)
+        if x is None or y is None or (x.depends and y.depends):
+            return None
+        if x.depends:
+            x, y = y, x
+        # x does not depend on the accumulator, so it is the constant x.b
+        return Form(lambda vals : x.b(vals) * y.a(vals), lambda vals : x.b(vals) * y.b(vals),
+                    y.depends)
+    return None
+
+
+class AffineStep:
+    def __init__(self, invariants: list[Node], form: Form):
+        self.invariants = invariants
+        self.form = form
+
+    def skip(self, cur: Natural, steps: int, values: list[Natural]):
+        # the accumulator after `steps` steps starting from cur, or None if the
+        # closed form does not apply and the loop has to run
+        if cur.pending() is not None or not cur.is_defined():
+            return None
+        ints = []
+        for val in values:
+            if val.pending() is not None or not val.is_defined():
+                return None
+            ints.append(int(val))
+        a = self.form.a(ints)
+        b = self.form.b(ints)
+        if a == 1 and b == 0:
+            # the step keeps the value, but maybe not the representation
+            return None
+        v = int(cur)
+        if a == 1:
+            return Natural(v + steps * b)
+        if a == 0:
+            return Natural(b)
+        if Budget.local.active is not None:
+            # as in Natural.__pow__, the size is checked before the power is computed
+            Budget.local.active.bits(a.bit_length() * steps + max(v, b).bit_length() + 1)
+        p = a ** steps
+        return Natural(p * v + b * (p - 1) // (a - 1))
+
+
+def analyze(g: Node):
+    invariants = []
+    form = linear(g, invariants)
+    if form is None:
+        return None
+    return AffineStep(invariants, form)
@@ -0,0 +1,63 @@
+from itertools import repeat
+
+from .natural import Natural, NaturalList
+from . import settings
+
+# Pools of worker processes, for Interpreter.call_many and for the parallel
+# branches of Cn (see parallel.py). Every worker makes its own Interpreter,
+# replays the definitions and loads of the parent (its history) with the same
+# settings, and then evaluates what it is sent with its own cache. Workers do
+# not start pools of their own.
+#
+# call_many's pool takes the whole iterable of calls up front and yields the
+# results in their order.
+
+CHUNK = 16
+
+worker = None
+
+
+def natural(value) -> Natural:
+    # an argument of call_many: a Natural, an int, None or a list of those
+    if isinstance(value, Natural):
+        return value
+    if isinstance(value, list):
+        return Natural([natural(ent) for ent in value])
+    return Natural(value)
+
+
+def start_worker(history: list[str], config: dict):
+    global worker
+    from .interpreter import Interpreter
+    for name, value in config.items():
+        setattr(settings, name, value)
+    settings.PARALLEL_WORKERS = None
+    worker = Interpreter()
+    for line in history:
+        ok, messages = worker.report(line)
+        if not ok:
+            raise Exception(f'"{line}" failed in a worker: {[msg.message for msg in messages]}')
+
+
+def call_in_worker(symbol: str, call: tuple) -> Natural:
+    return next(worker.call_many(symbol, [call]))
+
+
+def branch_in_worker(node_id: tuple, i: int, args: tuple) -> Natural:
+    # argument i of a Cn that the parent registered as node_id
+    root = worker.parallel.nodes[node_id].gs[i].root
+    result = worker.interpret_fexpr(root, None, NaturalList(list(args)))
+    result.normalize()
+    return result
+
+
+def start_pool(history: list[str], workers: int):
+    # imported here, multiprocessing takes a good part of the startup of the interpreter
+    from concurrent.futures import ProcessPoolExecutor
+    config = {name: getattr(settings, name) for name in dir(settings) if name.isupper()}
+    return ProcessPoolExecutor(workers, initializer=start_worker, initargs=(history, config))
+
+
+def call_pool(history: list[str], symbol: str, calls, workers: int):
+    with start_pool(history, workers) as pool:
+        yield from pool.map(call_in_worker, repeat(symbol), calls, chunksize=CHUNK)
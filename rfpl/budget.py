@@ -0,0 +1,81 @@
+import threading
+
+# Limits on the work of a single Interpreter.report call. While a report runs
+# with a budget, the budget is Budget.local.active and the evaluation counts
+# against it:
+#   steps     calls of rfpl functions, iterations of Pr, candidates of Mn and
+#             trial divisions of Natural.factor
+#   naturals  Natural objects created
+#   bits      size of the largest int a Natural may hold, checked before big
+#             powers are computed
+# Running out of any of them, or a cancelled token, raises BudgetExceeded,
+# which report turns into a LIMIT message. The active budget is per thread, so
+# threads may run reports with their own budgets; a token is how another thread
+# stops an evaluation.
+
+
+class CancelToken:
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, resource: str, budget: 'Budget'):
+        self.resource = resource
+        self.budget = budget
+        if resource == 'cancel':
+            super().__init__('Evaluation cancelled')
+        else:
+            super().__init__(f'Evaluation exceeded its budget of {budget.limit(resource)} {resource}')
+
+
+class Local(threading.local):
+    # the budget of the evaluation running on each thread, if any
+    active: 'Budget' = None
+
+
+class Budget:
+    local = Local()
+
+    def __init__(self, steps: int = None, naturals: int = None, bits: int = None,
+                 token: CancelToken = None):
+        self.max_steps = steps
+        self.max_naturals = naturals
+        self.max_bits = bits
+        self.token = token
+        self.steps = 0
+        self.naturals = 0
+        self.peak_bits = 0
+
+    def limit(self, resource: str):
+        return {'steps': self.max_steps, 'naturals': self.max_naturals, 'bits': self.max_bits}[resource]
+
+    def usage(self) -> dict[str, int]:
+        return {'steps': self.steps, 'naturals': self.naturals, 'bits': self.peak_bits}
+
+    def step(self, count: int = 1):
+        self.steps += count
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise BudgetExceeded('steps', self)
+        if self.token is not None and self.token.cancelled:
+            raise BudgetExceeded('cancel', self)
+
+    def allocate(self, natural):
+        self.naturals += 1
+        if self.max_naturals is not None and self.naturals > self.max_naturals:
+            raise BudgetExceeded('naturals', self)
+        if isinstance(natural, int):
+            self.bits(natural.bit_length())
+
+    def bits(self, nbits: int):
+        if self.max_bits is not None and nbits > self.max_bits:
+            raise BudgetExceeded('bits', self)
+        if nbits > self.peak_bits:
+            self.peak_bits = nbits
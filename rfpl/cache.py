@@ -0,0 +1,94 @@
+from collections import OrderedDict
+
+from .natural import Natural, NaturalList
+from .symbol import BaseList, SymbolEntry
+from . import settings
+
+
+class MemoCache:
+    # Memoizes calls of functions defined in rfpl, keyed on the symbol entry and
+    # the structure of the arguments. Calls that carry bases, have unforced lazy
+    # arguments or return Undefined (or something lazy) are not cached. The cache
+    # is an LRU bounded both globally and per function.
+
+    def __init__(self):
+        # key -> (result, arguments); the arguments are kept alive, as the keys of
+        # interned lists are only meaningful while the lists live
+        self.entries: OrderedDict[tuple, tuple[Natural, tuple]] = OrderedDict()
+        self.functions: dict[int, OrderedDict[tuple, None]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self.functions.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.skipped = 0
+
+    def stats(self) -> str:
+        return (f'{len(self.entries)} entries in {len(self.functions)} functions, '
+                f'{self.hits} hits, {self.misses} misses, {self.evictions} evictions, '
+                f'{self.skipped} uncachable calls')
+
+    def cachable(self, fun: SymbolEntry, blist: BaseList):
+        return (settings.CACHE and fun.fexpr is not None and fun.native is None
+                and (blist is None or not len(blist.args)))
+
+    def lookup(self, fun: SymbolEntry, blist: BaseList, args: NaturalList):
+        # returns (key, result); key is None when the call must not be cached
+        if not self.cachable(fun, blist):
+            return None, None
+        key = []
+        for arg in args.content:
+            argkey = arg.key()
+            if argkey is None:
+                self.skipped += 1
+                return None, None
+            key.append(argkey)
+        key = (fun.ix, tuple(key))
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return key, None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        self.functions[fun.ix].move_to_end(key)
+        return key, entry[0]
+
+    def store(self, key: tuple, result: Natural, args: NaturalList):
+        if key is None or result.key() is None or not result.is_defined():
+            return
+        ix = key[0]
+        self.entries[key] = (result, tuple(args.content))
+        keys = self.functions.setdefault(ix, OrderedDict())
+        keys[key] = None
+        if len(keys) > settings.CACHE_FUNCTION_SIZE:
+            self.evict(keys.popitem(last=False)[0])
+        while len(self.entries) > settings.CACHE_SIZE:
+            self.evict(self.entries.popitem(last=False)[0])
+
+    def evict(self, key: tuple):
+        self.evictions += 1
+        self.entries.pop(key, None)
+        keys = self.functions.get(key[0])
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del self.functions[key[0]]
+
+    def call_and_cache(self, fun: SymbolEntry, blist: BaseList, args: NaturalList):
+        key, result = self.lookup(fun, blist, args)
+        if result is not None:
+            return result
+        result = fun.call(blist, args)
+        self.store(key, result, args)
+        return result
@@ -0,0 +1,103 @@
+import json
+import socket
+import subprocess
+import sys
+from typing import Optional
+
+# A client of `rfpl serve` (see server.py), on a server it starts and talks to
+# over the server's standard input and output, or on a Unix socket:
+#
+#   with Client.spawn(preload=['basics']) as client:
+#       session = client.open()
+#       client.define('f = Cn[Add, !0, #2]', session=session)
+#       client.call('f', [3], session=session, budget={'steps': 1000})
+#
+# The methods answer what the server does, {ok, messages} but for open, and
+# raise ClientError for an error response.
+
+
+def value(result: dict) -> Optional[str]:
+    # the natural a result ends with, in the notation of rfpl
+    for msg in reversed(result['messages']):
+        if msg['type'] == 'natural':
+            return msg['natural']
+    return None
+
+
+class ClientError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class Client:
+    def __init__(self, rfile, wfile, process: subprocess.Popen = None, sock: socket.socket = None):
+        self.rfile = rfile
+        self.wfile = wfile
+        self.process = process
+        self.sock = sock
+        self.next_id = 1
+
+    @classmethod
+    def spawn(cls, preload: list[str] = (), args: list[str] = ()) -> 'Client':
+        # args are options of rfpl, as ['--engine', 'stack']
+        command = [sys.executable, '-m', 'rfpl', *args, 'serve']
+        for module in preload:
+            command += ['--preload', module]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return cls(process.stdout, process.stdin, process=process)
+
+    @classmethod
+    def connect(cls, path: str) -> 'Client':
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        return cls(sock.makefile('rb'), sock.makefile('wb'), sock=sock)
+
+    def request(self, method: str, **params) -> dict:
+        ident = self.next_id
+        self.next_id += 1
+        params = {name: value for name, value in params.items() if value is not None}
+        self.wfile.write(json.dumps({'jsonrpc': '2.0', 'id': ident, 'method': method, 'params': params}).encode() + b'\n')
+        self.wfile.flush()
+        line = self.rfile.readline()
+        if not line:
+            raise ClientError(-32603, 'The server closed the connection')
+        response = json.loads(line)
+        if 'error' in response:
+            raise ClientError(response['error']['code'], response['error']['message'])
+        return response['result']
+
+    def report(self, line: str, session: int = None, budget: dict = None) -> dict:
+        return self.request('report', line=line, session=session, budget=budget)
+
+    def define(self, line: str, session: int = None, budget: dict = None) -> dict:
+        return self.request('define', line=line, session=session, budget=budget)
+
+    def evaluate(self, line: str, session: int = None, budget: dict = None) -> dict:
+        return self.request('evaluate', line=line, session=session, budget=budget)
+
+    def load(self, module: str, session: int = None, budget: dict = None) -> dict:
+        return self.request('load', module=module, session=session, budget=budget)
+
+    def call(self, symbol: str, args: list, session: int = None, budget: dict = None) -> dict:
+        return self.request('call', symbol=symbol, args=args, session=session, budget=budget)
+
+    def open(self) -> int:
+        return self.request('open')['session']
+
+    def close_session(self, session: int):
+        self.request('close', session=session)
+
+    def close(self):
+        self.wfile.close()
+        self.rfile.close()
+        if self.sock is not None:
+            self.sock.close()
+        if self.process is not None:
+            self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,199 @@
+from .budget import Budget
+from .natural import Natural, NaturalList
+from .symbol import BaseList, SymbolEntry
+from . import settings, syntax
+
+# The compiler turns a preprocessed fexpr tree into a tree of nodes. Each node
+# keeps the parse tree it came from (`root`) for error reporting only; evaluation
+# never touches the parse tree again.
+
+
+class Node:
+    __slots__ = ('root',)
+
+    def __init__(self, root: syntax.Fexpr):
+        self.root = root
+
+    def evaluate(self, blist: BaseList, args: NaturalList) -> Natural:
+        raise NotImplementedError
+
+
+class LazyNode(Node):
+    __slots__ = ('inner',)
+
+    def __init__(self, root, inner: Node):
+        super().__init__(root)
+        self.inner = inner
+
+    def evaluate(self, blist, args):
+        inner = self.inner
+        return Natural(lambda args=args.copy() : inner.evaluate(blist, args))
+
+
+class LeafNode(Node):
+    __slots__ = ('syment', 'bases', 'chained', 'cache')
+
+    def __init__(self, root, syment: SymbolEntry, bases: list, chained: bool, cache):
+        super().__init__(root)
+        self.syment = syment
+        self.bases = bases
+        # a chained base list refers to the bases of the caller
+        self.chained = chained
+        self.cache = cache
+
+    def evaluate(self, blist, args):
+        bnxt = None
+        if self.bases is not None:
+            bnxt = BaseList(self.bases, blist if self.chained else None)
+        return self.cache.call_and_cache(self.syment, bnxt, args)
+
+
+class BracketNode(Node):
+    __slots__ = ('number',)
+
+    def __init__(self, root, number: int):
+        super().__init__(root)
+        self.number = number
+
+    def evaluate(self, blist, args):
+        return blist.args[self.number].c_node.evaluate(blist.prev, args)
+
+
+class IdentityNode(Node):
+    __slots__ = ('number',)
+
+    def __init__(self, root, number: int):
+        super().__init__(root)
+        self.number = number
+
+    def evaluate(self, blist, args):
+        return args[self.number]
+
+
+class ConstantNode(Node):
+    __slots__ = ('natural',)
+
+    def __init__(self, root, natural: Natural):
+        super().__init__(root)
+        self.natural = natural
+
+    def evaluate(self, blist, args):
+        return self.natural
+
+
+class CnNode(Node):
+    __slots__ = ('h', 'gs', 'rest', 'parallel')
+
+    def __init__(self, root, h: Node, gs: list[Node], rest: int):
+        super().__init__(root)
+        self.h = h
+        self.gs = gs
+        self.rest = rest
+        # Branches when the arguments may be evaluated in parallel (see parallel.py)
+        self.parallel = None
+
+    def evaluate(self, blist, args):
+        if self.parallel is not None and settings.PARALLEL_WORKERS:
+            fargs = self.parallel.pool.arguments(self, blist, args, evaluate_node)
+        else:
+            fargs = [g.evaluate(blist, args) for g in self.gs]
+        if self.rest is not None:
+            fargs.extend(args.content[self.rest:])
+        return self.h.evaluate(blist, NaturalList(fargs))
+
+
+def evaluate_node(node: Node, blist: BaseList, args: NaturalList) -> Natural:
+    return node.evaluate(blist, args)
+
+
+class PrNode(Node):
+    __slots__ = ('h', 'g', 'step')
+
+    def __init__(self, root, h: Node, g: Node, step=None):
+        super().__init__(root)
+        self.h = h
+        self.g = g
+        # an AffineStep when g is affine in the accumulator (see affine.py)
+        self.step = step
+
+    def evaluate(self, blist, args):
+        g = self.g
+        n = int(args[0])
+        args = args.drop(1)
+        cur = self.h.evaluate(blist, args)
+        args = NaturalList([Natural(None), Natural(None)]) + args
+        step = self.step
+        if step is not None and n > 1:
+            values = [inv.evaluate(blist, args) for inv in step.invariants]
+            skipped = step.skip(cur, n - 1, values)
+            if skipped is not None:
+                args[0] = skipped
+                args[1] = Natural(n - 1)
+                return g.evaluate(blist, args)
+        for i in range(n):
+            if Budget.local.active is not None:
+                Budget.local.active.step()
+            args[0] = cur
+            args[1] = Natural(i)
+            prv, cur = cur, g.evaluate(blist, args)
+            if step is not None and (key := cur.key()) is not None and key == prv.key():
+                # g does not look at the counter, so a fixed point stays
+                break
+        return cur
+
+
+class MnNode(Node):
+    __slots__ = ('h', 'search')
+
+    def __init__(self, root, h: Node, search):
+        super().__init__(root)
+        self.h = h
+        self.search = search
+
+    def evaluate(self, blist, args):
+        h = self.h
+        hargs = NaturalList([Natural(None)]) + args
+        def probe(cand):
+            hargs[0] = Natural(cand)
+            return h.evaluate(blist, hargs)
+        return self.search.run(self.root, blist, args, probe)
+
+
+class Compiler:
+    def __init__(self, interpreter):
+        # imported here, as affine.py inspects the node classes of this module
+        from .affine import analyze
+        self.interpreter = interpreter
+        self.analyze = analyze
+
+    def compile(self, root: syntax.Fexpr) -> Node:
+        # expects a tree that passed preprocess without errors
+        tree = root
+        if isinstance(tree, syntax.Leaf):
+            bases = tree.bases
+            chained = False
+            if bases is not None:
+                for bexpr in bases:
+                    self.compile(bexpr)
+                    if bexpr.c_ftype.nbase > 0:
+                        chained = True
+            node = LeafNode(root, tree.c_syment, bases, chained, self.interpreter.cache)
+        elif isinstance(tree, syntax.Bracket):
+            node = BracketNode(root, tree.number)
+        elif isinstance(tree, syntax.Identity):
+            node = IdentityNode(root, tree.number)
+        elif isinstance(tree, syntax.Constant):
+            node = ConstantNode(root, tree.c_natural)
+        elif isinstance(tree, syntax.Cn):
+            node = CnNode(root, self.compile(tree.h), [self.compile(g) for g in tree.gs], tree.rest)
+        elif isinstance(tree, syntax.Pr):
+            g = self.compile(tree.g)
+            node = PrNode(root, self.compile(tree.h), g, self.analyze(g))
+        elif isinstance(tree, syntax.Mn):
+            node = MnNode(root, self.compile(tree.h), self.interpreter.mn_search)
+        else:
+            raise Exception(f'Unknown tree type {type(tree)}')
+        if tree.lazy:
+            node = LazyNode(root, node)
+        root.c_node = node
+        return node
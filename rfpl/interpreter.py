@@ -1,23 +1,30 @@
 import hashlib
 import importlib.util
 import inspect
-import random
 import sys
+import time
 import traceback
-from antlr4 import ParserRuleContext, Token, InputStream, CommonTokenStream
-from antlr4.error.ErrorListener import ErrorListener
 from dataclasses import dataclass
 from enum import Enum
 from importlib.machinery import SourceFileLoader
 from pathlib import Path
-from typing import Union
-
-from .natural import Natural, NaturalList
-from .RFPLLexer import RFPLLexer
-from .RFPLParser import RFPLParser
+from typing import Iterable, Iterator, Optional, Union
+
+from . import batch
+from .budget import Budget, BudgetExceeded
+from .cache import MemoCache
+from .compiler import Compiler
+from .metrics import counters
+from .natural import Natural, NaturalList, conversions, interned
+from .parallel import ParallelPool
+from .profiler import Profiler
+from .recognize import Recognizer
 from .rfpy import RFPYModule
+from .search import MnSearch
+from .stackeval import StackMachine
 from .symbol import BaseList, FunctionType, SymbolEntry
-from . import settings
+from .syntax import ParseError, Token
+from . import metrics, primes, rfplc, settings, syntax
 
 LIB_PATH = Path(__file__).parent / 'lib'
 
@@ -41,23 +48,33 @@ def dict_max_eq(d: dict, k, v):
 
 
 class SymbolTable:
+    # every symbol has a stack of its entries, the latest definition on top
     def __init__(self):
         self.temp_layer = [[]]
-        self.table: list[SymbolEntry] = []
-    
-    def search(self, symbol: str, index: int = -1): 
-        index = len(self.table) - 1
-        while index >= 0 and self.table[index].symbol != symbol:
-            index -= 1
-        if index < 0:
+        self.stacks: dict[str, list[SymbolEntry]] = {}
+        # the live entries by ix, in the order they were added
+        self.entries: dict[int, SymbolEntry] = {}
+        self.next_ix = 0
+
+    @property
+    def table(self) -> list[SymbolEntry]:
+        return list(self.entries.values())
+
+    def search(self, symbol: str):
+        stack = self.stacks.get(symbol)
+        if not stack:
             return None
-        return self.table[index]
+        return stack[-1]
     
     def add_entry(self, entry: SymbolEntry):
-        entry.ix = len(self.table)
-        self.table.append(entry)
+        # ix is never reused, even after temporary symbols are removed
+        entry.ix = self.next_ix
+        self.next_ix += 1
+        self.entries[entry.ix] = entry
+        self.stacks.setdefault(entry.symbol, []).append(entry)
         if entry.symbol[0] == '_':
             self.temp_layer[-1].append(entry)
+        return entry
     
     def add(self, *args, **kwargs):
         return self.add_entry(SymbolEntry(*args, **kwargs))
@@ -66,75 +83,30 @@ class SymbolTable:
         self.temp_layer.append([])
         return len(self.temp_layer)
 
+    def remove(self, entry: SymbolEntry):
+        del self.entries[entry.ix]
+        stack = self.stacks[entry.symbol]
+        if stack[-1] is entry:
+            stack.pop()
+        else:
+            stack.remove(entry)
+        if not stack:
+            del self.stacks[entry.symbol]
+
     def clear_temp_layer(self, key: int):
         while key <= len(self.temp_layer):
-            for ent in self.temp_layer[-1]:
-                self.table.remove(ent)
+            # the latest first, so each is on top of its stack
+            for ent in reversed(self.temp_layer[-1]):
+                self.remove(ent)
             self.temp_layer.pop()
 
 
-class HashCache:
-    def __init__(self, basic_functions):
-        self.basic_functions = basic_functions
-        self.cache = {}
-        self.possibleMatches = {}
-        self.counter = {}
-        self.counter_max = 20
-
-    def hash(self, args: NaturalList):
-        lst = ''
-        started = False
-        for arg in args.content[::-1]:
-            if not arg.is_zero():
-                started = True
-            if started:
-                lst += arg.weird_hash() + '+'
-        return hashlib.md5(lst.encode()).hexdigest()
-
-    def make_mock_natural_list(self, n: int):
-        m = int(n**0.5)
-        a, b, c = random.randint(0,m), random.randint(0,m), random.randint(0,m)
-        return NaturalList([Natural(a), Natural(b), Natural(c), Natural(None), Natural(None)])
-
-    def call_and_cache(self, fun: SymbolEntry, blist: BaseList, args: list[Natural]):
-        if (blist is not None and len(blist.args)) or fun.builtin or not settings.CACHE:
-            return fun.call(blist, args)
-        if fun.ix not in self.possibleMatches:
-            self.possibleMatches[fun.ix] = self.basic_functions.copy()
-            self.counter[fun.ix] = 0
-            self.cache[fun.ix] = {}
-        if self.counter[fun.ix] == self.counter_max:
-            return self.possibleMatches[fun.ix][0].call(blist, args)
-        hsh = self.hash(args)
-        if hsh in self.cache[fun.ix]:
-            return self.cache[fun.ix][hsh]
-        res = fun.call(blist, args)
-        if self.possibleMatches[fun.ix]:
-            reshsh = res.weird_hash()
-            resnat = int(res)
-            for ent in self.possibleMatches[fun.ix]:
-                rel = ent.call(blist, args)
-                if rel.weirdHash() != reshsh and int(rel) != resnat:
-                    self.possibleMatches[fun.ix].remove(ent)
-            mocknatlst = self.make_mock_natural_list(self.counter[fun.ix])
-            rez = fun.call(None, mocknatlst)
-            for ent in self.possibleMatches[fun.ix]:
-                rel = ent.call(None, mocknatlst)
-                if rel.weirdHash() != rez.weird_hash() and int(rel) != int(rez):
-                    self.possibleMatches[fun.ix].remove(ent)
-            if len(self.possibleMatches[fun.ix]):
-                self.counter[fun.ix] += 1
-                if self.counter[fun.ix] == self.counter_max:
-                    debug(f'replacing {fun.symbol} with {self.possibleMatches[fun.ix][0].symbol} ...')
-        self.cache[fun.ix][hsh] = res
-        return res
-
-
 class MessageType(Enum):
     INFO = 0
     NATURAL = 1
     ERROR = 2
     EXCEPTION = 3
+    LIMIT = 4
 
 
 @dataclass
@@ -145,30 +117,43 @@ class Message:
     natural: Natural = None
     start: int = None
     stop: int = None
+    # what the evaluation used of its budget, for LIMIT messages
+    usage: dict[str, int] = None
 
     @classmethod
     def error(cls, message: str, **kwargs):
         return cls(typ=MessageType.ERROR, message=message, **kwargs)
 
     @classmethod
-    def error_context(cls, message: str, ctx: Union[ParserRuleContext, Token]):
+    def error_context(cls, message: str, ctx: Union[syntax.Syntax, Token, ParseError]):
         result = cls.error(message)
-        if isinstance(ctx, ParserRuleContext):
-            result.start = ctx.start.start
-            result.stop = ctx.stop.stop
-        else:
-            result.start = ctx.start
-            result.stop = ctx.stop
+        result.start = ctx.start
+        result.stop = ctx.stop
         return result
     
     @classmethod
     def info(cls, message: str, **kwargs):
-        return cls(typ=MessageType.INFO, message=message, *kwargs)
+        return cls(typ=MessageType.INFO, message=message, **kwargs)
     
+    @classmethod
+    def limit(cls, exc: BudgetExceeded):
+        return cls(typ=MessageType.LIMIT, message=str(exc), usage=exc.budget.usage())
+
     @classmethod
     def natural(cls, nat: Natural, **kwargs):
         return cls(typ=MessageType.NATURAL, natural=nat, **kwargs)
 
+    def asdict(self) -> dict:
+        # the fields that are set, for JSON, with the natural in the notation of rfpl
+        result = {'type': self.typ.name.lower()}
+        for field in ('message', 'context', 'start', 'stop', 'usage'):
+            if (value := getattr(self, field)) is not None:
+                result[field] = value
+        # unset, natural is the class method
+        if isinstance(self.natural, Natural):
+            result['natural'] = str(self.natural)
+        return result
+
     def add_context(self, inp: str):
         if (self.start is None or self.stop is None 
             or inp is None or self.context is not None):
@@ -179,24 +164,6 @@ class Message:
         ]
 
 
-class ReportErrorListener(ErrorListener):
-    def __init__(self, interpreter: 'Interpreter'):
-        self.interpreter = interpreter
-
-    def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
-        self.interpreter.add_message(Message.error_context(msg, offendingSymbol))
-
-
-class QuietErrorListener(ErrorListener):
-    def __init__(self):
-        super().__init__()
-        self.has_unexpected_eof = False
-
-    def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
-        if offendingSymbol and offendingSymbol.type == Token.EOF:
-            self.has_unexpected_eof = True
-
-
 class Interpreter:
     def __init__(self):
         self.symbol_table = SymbolTable()
@@ -205,86 +172,106 @@ class Interpreter:
             call=lambda _blist, args : args[0].succ(), 
             builtin=True,
             ftype=FunctionType(narg=1),
+            strict=(0,),
         )
         self.hash_loaded = set()
         
-        self.cache = HashCache([])  # add the funcions here
+        self.cache = MemoCache()
+        self.compiler = Compiler(self)
+        self.machine = StackMachine(self)
+        self.recognizer = Recognizer(self)
+        self.mn_search = MnSearch(lambda message : self.add_message(Message.info(message)))
+        self.parallel = ParallelPool(self)
+        self.profiler = Profiler(self)
 
         self.messages: list[Message] = []
         self.has_error = False
+        # the lines that defined functions or loaded modules, outside of modules
+        self.history: list[str] = []
+        self.loading = 0
+        # for each module being loaded, the modules it loaded (see rfplc.py)
+        self.dependencies: list[dict[str, str]] = []
 
     def add_message(self, msg: Message):
         self.messages.append(msg)
         if msg.typ in (MessageType.ERROR, MessageType.EXCEPTION):
             self.has_error = True
 
-    def interpret_fexpr(self, root, blist: BaseList, args: NaturalList, strict: bool = False) -> Natural:
-        tree = root.getChild(0)
-        if not strict and tree.getToken(RFPLParser.Lazy, 0) is not None:
-            return Natural(lambda args=args.copy() : self.interpret_fexpr(root, blist, args, strict=True))
-        if isinstance(tree, RFPLParser.FexprleafContext):
+    def interpret_fexpr(self, root, blist: BaseList, args: NaturalList) -> Natural:
+        if Budget.local.active is not None:
+            Budget.local.active.step()
+        if settings.ENGINE == 'walk':
+            return self.walk_fexpr(root, blist, args)
+        if settings.ENGINE == 'stack':
+            return self.machine.run(root.c_node, blist, args)
+        return root.c_node.evaluate(blist, args)
+
+    def walk_fexpr(self, root, blist: BaseList, args: NaturalList, strict: bool = False) -> Natural:
+        # the original tree-walking evaluator, kept to compare against the compiled engine
+        tree = root
+        if not strict and tree.lazy:
+            return Natural(lambda args=args.copy() : self.walk_fexpr(root, blist, args, strict=True))
+        if isinstance(tree, syntax.Leaf):
             bnxt = None
-            if tree.fexprlist() is not None:
+            if tree.bases is not None:
                 bnxt = BaseList([], None)
-                bnxt.args = tree.fexprlist().getTypedRuleContexts(RFPLParser.FexprContext)
+                bnxt.args = tree.bases
                 for bexpr in bnxt.args:
                     if bexpr.c_ftype.nbase > 0:
                         bnxt.prev = blist
                         break
             syment = tree.c_syment
             return self.cache.call_and_cache(syment, bnxt, args)
-        elif isinstance(tree, RFPLParser.BracketContext):
-            return self.interpret_fexpr(blist.args[tree.c_number], blist.prev, args)
-        elif isinstance(tree, RFPLParser.IdentityContext):
-            return args[tree.c_number]
-        elif isinstance(tree, RFPLParser.ConstantContext):
+        elif isinstance(tree, syntax.Bracket):
+            return self.walk_fexpr(blist.args[tree.number], blist.prev, args)
+        elif isinstance(tree, syntax.Identity):
+            return args[tree.number]
+        elif isinstance(tree, syntax.Constant):
             return tree.c_natural
-        elif isinstance(tree, RFPLParser.BuiltinCnContext):
-            f, *gs = tree.fexprlist().getTypedRuleContexts(RFPLParser.FexprContext)
+        elif isinstance(tree, syntax.Cn):
+            f, gs = tree.h, tree.gs
             fargs = []
             for g in gs:
-                gres = self.interpret_fexpr(g, blist, args)
+                gres = self.walk_fexpr(g, blist, args)
                 fargs.append(gres)
-            identityRest = int(num.getText()) if (num := tree.identityRest().Number()) is not None else None
+            identityRest = tree.rest
             if identityRest is not None:
                 for i in range(identityRest, len(args.content)):
                     fargs.append(args.content[i])
             fargs = NaturalList(fargs)
-            return self.interpret_fexpr(f, blist, fargs)
-        elif isinstance(tree, RFPLParser.BuiltinPrContext):
-            f = tree.fexpr(0)
-            g = tree.fexpr(1)
+            return self.walk_fexpr(f, blist, fargs)
+        elif isinstance(tree, syntax.Pr):
+            f = tree.h
+            g = tree.g
             n = int(args[0])
             args = args.drop(1)
-            cur = self.interpret_fexpr(f, blist, args)
+            cur = self.walk_fexpr(f, blist, args)
             args = NaturalList([Natural(None), Natural(None)]) + args
             for i in range(n):
+                if Budget.local.active is not None:
+                    Budget.local.active.step()
                 args[0] = cur
                 args[1] = Natural(i)
-                cur = self.interpret_fexpr(g, blist, args)
+                cur = self.walk_fexpr(g, blist, args)
             return cur
-        elif isinstance(tree, RFPLParser.BuiltinMnContext):
-            f = tree.fexpr()
-            args = NaturalList([Natural(0)]) + args
-            result = self.interpret_fexpr(f, blist, args)
-            while result.is_defined() and not result.is_zero():
-                args[0] = args[0].succ()
-                result = self.interpret_fexpr(f, blist, args)
-            if not result.is_defined():
-                return Natural(None)
-            return args[0]
+        elif isinstance(tree, syntax.Mn):
+            f = tree.h
+            fargs = NaturalList([Natural(None)]) + args
+            def probe(cand):
+                fargs[0] = Natural(cand)
+                return self.walk_fexpr(f, blist, fargs)
+            return self.mn_search.run(root, blist, args, probe)
         else:
             raise Exception(f'Unknown tree type {type(tree)}')
 
-    def interpret_nexpr(self, tree):
-        if not isinstance(tree, RFPLParser.NexprContext):
+    def interpret_nexpr(self, tree: syntax.Nexpr):
+        if isinstance(tree, syntax.Literal):
+            return Natural.interpret(tree)
+        if not isinstance(tree, syntax.Call):
             raise Exception('Tree must represent a nexpr, got {}'.format(type(tree)))
-        if tree.natural() is not None:
-            return Natural.interpret(tree.natural())
-        fexpr: RFPLParser.FexprContext = tree.fexpr()
-        nexprlist: RFPLParser.NexprlistContext = tree.nexprlist()
+        fexpr = tree.fexpr
         args = []
-        for nexpr in nexprlist.getTypedRuleContexts(RFPLParser.NexprContext):
+        for nexpr in tree.args:
             args.append(self.interpret_nexpr(nexpr))
         ftype = self.preprocess(fexpr)
         if ftype.nbase > 0:
@@ -299,21 +286,26 @@ class Interpreter:
             ))
         if self.has_error:
             return Natural(None)
+        self.compiler.compile(fexpr)
         args = NaturalList(args)
+        if settings.ENGINE == 'stack':
+            self.machine.reset_stats()
+            result = self.interpret_fexpr(fexpr, None, args)
+            debug(f'stack engine: {self.machine.stats()}')
+            return result
         return self.interpret_fexpr(fexpr, None, args)
 
-    def preprocess(self, root) -> FunctionType:
+    def preprocess(self, root: syntax.Fexpr) -> FunctionType:
         # to have consistent variable names, we will call the current tree as f
         ftype = FunctionType()
 
-        tree = root.getChild(0)
-        if isinstance(tree, RFPLParser.FexprleafContext):
+        tree = root
+        if isinstance(tree, syntax.Leaf):
             # assume f = g[gb0, gb1, ...]
             gbase = []
-            if tree.fexprlist() is not None:
-                fexprlist: RFPLParser.FexprlistContext = tree.fexprlist()
-                gbase += fexprlist.getTypedRuleContexts(RFPLParser.FexprContext)
-            symb = tree.Symbol().getText()
+            if tree.bases is not None:
+                gbase += tree.bases
+            symb = tree.symbol.text
             syment = self.symbol_table.search(symb)
             if syment is None:
                 self.add_message(Message.error_context(f'Function {symb} is not defined', tree))
@@ -325,7 +317,7 @@ class Interpreter:
                     tree,
                 ))
                 return ftype
-            tree.c_syment = syment  # custom attribute added to the tree
+            tree.c_syment = syment
             ftype.narg = max(ftype.narg, gtype.narg)
             for gi, gb in enumerate(gbase):
                 gbtype = self.preprocess(gb)
@@ -348,29 +340,27 @@ class Interpreter:
                 for fj in gbtype.max_narg_b:
                     dict_min_eq(ftype.max_narg_b, fj, gbtype.max_narg_b[fj])
 
-        elif isinstance(tree, RFPLParser.BracketContext):
-            ix = int(tree.Number().getText())
-            tree.c_number = ix
+        elif isinstance(tree, syntax.Bracket):
+            ix = tree.number
             ftype.relative_narg_b[ix] = 0
             ftype.nbase = ix + 1
 
-        elif isinstance(tree, RFPLParser.IdentityContext):
-            ix = int(tree.Number().getText())
-            tree.c_number = ix
+        elif isinstance(tree, syntax.Identity):
+            ix = tree.number
             ftype.narg = ix + 1
 
-        elif isinstance(tree, RFPLParser.ConstantContext):
-            tree.c_natural = Natural.interpret(tree.natural())
+        elif isinstance(tree, syntax.Constant):
+            tree.c_natural = Natural.interpret(tree.literal)
 
-        elif isinstance(tree, RFPLParser.BuiltinCnContext):
+        elif isinstance(tree, syntax.Cn):
             # assume f = Cn[h, g0, g1, ...]
-            h, *gs = tree.fexprlist().getTypedRuleContexts(RFPLParser.FexprContext)
+            h, gs = tree.h, tree.gs
             htype = self.preprocess(h)
             for fj in htype.max_narg_b:
                 ftype.max_narg_b[fj] = htype.max_narg_b[fj]
             ftype.nbase = htype.nbase
 
-            identityRest = int(num.getText()) if (num := tree.identityRest().Number()) is not None else None
+            identityRest = tree.rest
 
             ngs = len(gs)
             if identityRest is None:
@@ -400,10 +390,10 @@ class Interpreter:
                 for fj in gtype.max_narg_b:
                     dict_min_eq(ftype.max_narg_b, fj, gtype.max_narg_b[fj])
             
-        elif isinstance(tree, RFPLParser.BuiltinPrContext):
+        elif isinstance(tree, syntax.Pr):
             # assume f = Pr[h, g]
-            h = tree.fexpr(0)
-            g = tree.fexpr(1)
+            h = tree.h
+            g = tree.g
             htype = self.preprocess(h)
             ftype.narg = htype.narg + 1
             ftype.nbase = htype.nbase
@@ -420,9 +410,9 @@ class Interpreter:
             for fj in gtype.max_narg_b:
                 dict_min_eq(ftype.max_narg_b, fj, gtype.max_narg_b[fj])
 
-        elif isinstance(tree, RFPLParser.BuiltinMnContext):
+        elif isinstance(tree, syntax.Mn):
             # assume f = Mn[h]
-            h = tree.fexpr()
+            h = tree.h
             htype = self.preprocess(h)
             ftype.narg = max(ftype.narg, htype.narg - 1)
             ftype.nbase = htype.nbase
@@ -437,103 +427,127 @@ class Interpreter:
         root.c_ftype = ftype
         return ftype
     
-    def interpret(self, line: str) -> bool:
+    def interpret(self, line: str, statement: syntax.Statement = None) -> bool:
+        # statement is line already parsed (see load_rfpl_module)
         self.has_error = False
 
-        input_stream = InputStream(line)
-        lexer = RFPLLexer(input_stream)
-        lexer.removeErrorListeners()
-        lexer.addErrorListener(ReportErrorListener(self))
-
-        token_stream = CommonTokenStream(lexer)
-
-        parser = RFPLParser(token_stream)
-        parser.removeErrorListeners()
-        parser.addErrorListener(ReportErrorListener(self))
-
-        tree = parser.singleline()
-        if self.has_error:
+        if statement is None:
+            try:
+                statement = syntax.Statement(line, tree=syntax.parse(line))
+            except ParseError as exc:
+                statement = syntax.Statement(line, error=exc)
+        if statement.error is not None:
+            self.add_message(Message.error_context(statement.error.message, statement.error))
             return False
 
-        tree = tree.line()
+        tree = statement.tree
         if tree is None:
-            return True, None
-        elif tree.define() is not None:
-            tree = tree.define()
-            symb = tree.Symbol().getText()
-            fexpr = tree.fexpr()
-            ftype = self.preprocess(fexpr)
-            if self.has_error:
-                return False
+            return True
+        elif isinstance(tree, syntax.Define):
+            symb = tree.symbol.text
+            fexpr = tree.fexpr
+            if statement.link is not None and rfplc.link(fexpr, statement.link, self.symbol_table.search):
+                ftype = fexpr.c_ftype
+            else:
+                ftype = self.preprocess(fexpr)
+                if self.has_error:
+                    return False
+            self.compiler.compile(fexpr)
             msg = Message.info(f'Function {symb} added')
             syment = self.symbol_table.search(symb)
             if syment is not None:
                 if syment.builtin:
                     self.add_message(Message.error_context(
                         f'Cannot redefine a builtin function {symb}',
-                        tree.Symbol()
+                        tree.symbol
                     ))
                     return False
                 msg.message = f'Function {symb} redefined'
-            self.symbol_table.add(
+            syment = self.symbol_table.add(
                 symbol=symb,
                 call=lambda blist, args, fexpr=fexpr: self.interpret_fexpr(fexpr, blist, args),
                 ftype=ftype,
+                fexpr=fexpr,
             )
+            if settings.RECOGNIZE and (native := self.recognizer.recognize(syment)) is not None:
+                debug(f'Function {symb} recognized as {native}, using a native implementation')
+            self.parallel.register(syment)
             self.add_message(msg)
+            if not self.loading:
+                self.history.append(line)
             return True
-        elif tree.examine() is not None:
-            tree = tree.examine()
-            result = self.interpret_nexpr(tree.nexpr())
+        elif isinstance(tree, syntax.Examine):
+            result = self.interpret_nexpr(tree.nexpr)
             if self.has_error:
                 return False
             self.add_message(Message.natural(result))
             return True
-        elif tree.pragma() is not None:
-            tree = tree.pragma()
-            if tree.load() is not None:
-                tree = tree.load()
-                return self.load_module(tree.module().getText())
-            else:
-                raise Exception(f'Unknown pragma {tree.getText()}')
+        elif isinstance(tree, syntax.Load):
+            ok = self.load_module(tree.module)
+            if ok and not self.loading:
+                self.history.append(line)
+            return ok
         else:
             raise Exception(f'Unknown tree type {tree.getText()}')
         
     def parsable(self, text: str):
-        input_stream = InputStream(text)
-        lexer = RFPLLexer(input_stream)
-        stream = CommonTokenStream(lexer)
-        parser = RFPLParser(stream)
-        error_listener = QuietErrorListener()
-        lexer.removeErrorListeners()
-        lexer.addErrorListener(error_listener)
-        parser.removeErrorListeners()
-        parser.addErrorListener(error_listener)
-        tree = parser.singleline()
-        return not error_listener.has_unexpected_eof, tree
+        # whether text is complete (it may still have errors), and its line if it parses
+        try:
+            return True, syntax.parse(text)
+        except ParseError as exc:
+            return not exc.at_eof, None
     
-    def load_rfpl_module(self, path: Path) -> bool:
+    def load_rfpl_module(self, path: Path, hsh: str = None) -> bool:
         try:
             file = open(path, 'r')
         except OSError as e:
             self.add_message(Message.error(f'Unable to open "{path}": ' + e.strerror))
             return False
+        saved = pristine = None
+        if settings.MODULE_CACHE:
+            if hsh is None:
+                hsh = self.file_hash(path)
+            saved = rfplc.read(path, hsh)
+            if saved is not None and not self.fresh(saved['dependencies']):
+                saved = None
         myTempLayerKey = self.symbol_table.add_temp_layer()
         ok = True
-        with file:
-            lines = file.readlines()
-            cmd = ''
-            for line in lines:
-                cmd += line.strip() + ' '
-                if not self.parsable(cmd)[0]:
-                    continue
-                cmdok, _ = self.report(cmd, clear=False)
+        self.loading += 1
+        # the modules loaded by this one, their hashes by name
+        dependencies = {}
+        self.dependencies.append(dependencies)
+        try:
+            with file:
+                if saved is not None:
+                    statements = saved['statements']
+                else:
+                    statements = list(syntax.statements(file))
+                    if settings.MODULE_CACHE:
+                        # before preprocess and compile set up the trees
+                        pristine = rfplc.dumps(statements)
+            for statement in statements:
+                cmdok, _ = self.report(statement.text, clear=False, statement=statement)
                 if not cmdok:
                     ok = False
-                cmd = ''
-        self.symbol_table.clear_temp_layer(myTempLayerKey)
+        finally:
+            # also when a budget stops the loading
+            self.loading -= 1
+            self.dependencies.pop()
+            self.symbol_table.clear_temp_layer(myTempLayerKey)
+        if ok and saved is None and settings.MODULE_CACHE and pristine is not None:
+            links = [rfplc.record(statement.tree.fexpr) if isinstance(statement.tree, syntax.Define) else None
+                     for statement in statements]
+            rfplc.write(path, hsh, dependencies, pristine, links)
         return ok
 
+    def fresh(self, dependencies: dict[str, str]) -> bool:
+        # whether the modules a cached module loaded are the same
+        for module, hsh in dependencies.items():
+            path = self.find_module(module)
+            if path is None or self.file_hash(path) != hsh:
+                return False
+        return True
+
     def load_rfpy_module(self, path: Path) -> bool:
         loader = SourceFileLoader(path.stem, str(path))
         spec = importlib.util.spec_from_file_location(path.stem, path, loader=loader)
@@ -568,32 +582,54 @@ class Interpreter:
                 hasher.update(chunk)
         return hasher.hexdigest()
 
-    def load_module(self, module: str) -> bool:
+    def find_module(self, module: str) -> Optional[Path]:
         for path in (Path('.'), LIB_PATH):
             for part in module.split('.'):
                 path = path / part
             if (modpath := path.with_suffix('.rfpy')).is_file() or (modpath := path.with_suffix('.py')).is_file():
-                hsh = self.file_hash(modpath)
-                if hsh in self.hash_loaded:
-                    return True
-                if ret := self.load_rfpy_module(modpath):
-                    self.hash_loaded.add(hsh)
-                return ret
+                return modpath
             if (modpath := path.with_suffix('.rfpl')).is_file() or (modpath := path).is_file():
-                hsh = self.file_hash(modpath)
-                if hsh in self.hash_loaded:
-                    return True
-                if ret := self.load_rfpl_module(modpath):
-                    self.hash_loaded.add(hsh)
-                return ret
-        self.add_message(Message.error(f'Unable to find "{module}"'))
-        return False
-
-    def report(self, line: str, clear: bool = True) -> tuple[bool, list[Message]]:
+                return modpath
+        return None
+
+    def load_module(self, module: str) -> bool:
+        modpath = self.find_module(module)
+        if modpath is None:
+            self.add_message(Message.error(f'Unable to find "{module}"'))
+            return False
+        hsh = self.file_hash(modpath)
+        for dependencies in self.dependencies:
+            dependencies[module] = hsh
+        if hsh in self.hash_loaded:
+            return True
+        if modpath.suffix in ('.rfpy', '.py'):
+            ret = self.load_rfpy_module(modpath)
+        else:
+            ret = self.load_rfpl_module(modpath, hsh)
+        if ret:
+            self.hash_loaded.add(hsh)
+        return ret
+
+    def report(self, line: str, clear: bool = True, budget: Budget = None,
+               statement: syntax.Statement = None) -> tuple[bool, list[Message]]:
+        # budget limits the evaluation (see budget.py), nested reports keep the active one
         line = line.strip()
         ok = False
+        # the messages of this line, a module keeps adding to the same list
+        first = len(self.messages)
+        if settings.METRICS is not None and not self.loading:
+            before = self.metrics()
+            start = time.perf_counter()
+        previous = Budget.local.active
+        if budget is not None:
+            Budget.local.active = budget
         try:
-            ok = self.interpret(line)
+            ok = self.interpret(line, statement)
+        except BudgetExceeded as exc:
+            if budget is None:
+                # a nested report (of a loaded module), the outer one reports it
+                raise
+            self.messages.append(Message.limit(exc))
         except KeyboardInterrupt:
             self.messages.append(Message(
                 typ=MessageType.EXCEPTION,
@@ -604,10 +640,75 @@ class Interpreter:
                 typ=MessageType.EXCEPTION,
                 message=traceback.format_exc().strip()
             ))
-        for msg in self.messages:
+        finally:
+            Budget.local.active = previous
+        for msg in self.messages[first:]:
             msg.add_context(line)
+        if settings.METRICS is not None and not self.loading:
+            metrics.dump({
+                'line': line,
+                'ok': ok,
+                'seconds': time.perf_counter() - start,
+                **metrics.difference(self.metrics(), before),
+            }, settings.METRICS)
         if clear:
             result = self.messages.copy()
             self.messages = []
             return ok, result
         return ok, self.messages
+
+    def metrics(self) -> dict:
+        # a snapshot of the counters (see metrics.py), the keys in metrics.COUNTS
+        # count events since the last reset_metrics, the others are sizes
+        return {
+            'naturals': counters.naturals,
+            'forced': counters.forced,
+            'prime_growths': counters.prime_growths,
+            'base_calls': counters.base_calls,
+            'to_int': conversions.to_int,
+            'to_list': conversions.to_list,
+            'int_hits': conversions.int_hits,
+            'list_hits': conversions.list_hits,
+            'cache_hits': self.cache.hits,
+            'cache_misses': self.cache.misses,
+            'cache_evictions': self.cache.evictions,
+            'cache_skipped': self.cache.skipped,
+            'cache_entries': len(self.cache),
+            'interned': len(interned),
+            'primes': len(primes.table),
+        }
+
+    def reset_metrics(self):
+        counters.reset()
+        conversions.reset()
+        self.cache.reset_stats()
+
+    def call_many(self, symbol: str, calls: Iterable, budget: Budget = None,
+                  workers: int = None) -> Iterator[Natural]:
+        # the results of symbol on each tuple of arguments (Naturals, ints, None or lists
+        # of them), in order; the calls share the cache and the budget. With workers, the
+        # calls are spread over that many processes (see batch.py) and the budget is not used.
+        syment = self.symbol_table.search(symbol)
+        if syment is None:
+            raise Exception(f'Function {symbol} is not defined')
+        if syment.ftype.nbase > 0:
+            raise Exception(f'Function {symbol} should not need any bases')
+        if workers is not None:
+            return batch.call_pool(self.history.copy(), symbol, calls, workers)
+        return self.call_each(syment, calls, budget)
+
+    def call_each(self, syment: SymbolEntry, calls: Iterable, budget: Budget) -> Iterator[Natural]:
+        for call in calls:
+            args = NaturalList([batch.natural(arg) for arg in call])
+            if syment.ftype.narg > len(args):
+                raise Exception(f'Function {syment.symbol} expects {syment.ftype.narg} arguments but got {len(args)}')
+            # the budget is active only while a call runs, not while the caller has the result
+            previous = Budget.local.active
+            if budget is not None:
+                Budget.local.active = budget
+            try:
+                result = self.cache.call_and_cache(syment, None, args)
+                result.normalize()
+            finally:
+                Budget.local.active = previous
+            yield result
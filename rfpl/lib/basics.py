@@ -5,19 +5,19 @@ from rfpl.natural import Natural, NaturalList
 from rfpl.rfpy import RFPYModule, define
 
 class Basics(RFPYModule):
-    @define(narg=2)
+    @define(narg=2, strict=(1, 0))
     def Add(self, args):
         return args[1] + args[0]
 
-    @define(narg=2)
+    @define(narg=2, strict=(1, 0))
     def Sub(self, args):
         return args[1] - args[0]
 
-    @define(narg=2)
+    @define(narg=2, strict=(1, 0))
     def Mul(self, args):
         return args[1] * args[0]
 
-    @define(narg=2)
+    @define(narg=2, strict=(1, 0))
     def Pow(self, args):
         return args[1] ** args[0]
 
@@ -37,28 +37,25 @@ class Basics(RFPYModule):
             return Natural(0)
         return args[2].set_entry(args[0], args[1])
 
-    @define(narg=1)
+    @define(narg=1, strict=(0,))
     def Int(self, args):
         if not args[0].is_defined():
             return Natural(None)
-        result = args[0].copy()
-        result.simplify()
-        return result
+        return args[0].simplify()
 
-    @define(narg=1)
+    @define(narg=1, strict=(0,))
     def List(self, args):
         if not args[0].is_defined():
             return Natural(None)
-        result = args[0].copy()
-        if not result.is_zero():
-            result.factor()
-        return result
+        if args[0].is_zero():
+            return args[0]
+        return args[0].factor()
 
-    @define(narg=2)
+    @define(narg=2, strict=(0, 1))
     def Mod(self, args):
         return args[0] % args[1]
     
-    @define(narg=1)
+    @define(narg=1, strict=(0,))
     def IsZero(self, args):
         if not args[0].is_defined():
             return Natural(None)
@@ -66,7 +63,7 @@ class Basics(RFPYModule):
             return Natural(1)
         return Natural(0)
     
-    @define(narg=1)
+    @define(narg=1, strict=(0,))
     def IsOne(self, args):
         if not args[0].is_defined():
             return Natural(None)
@@ -74,7 +71,7 @@ class Basics(RFPYModule):
             return Natural(1)
         return Natural(0)
     
-    @define(narg=2)
+    @define(narg=2, strict=(0, 1))
     def Equal(self, args):
         if not args[0].is_defined() or not args[1].is_defined():
             return Natural(None)
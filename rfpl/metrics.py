@@ -0,0 +1,52 @@
+import json
+
+# Counters of the hot paths: plain ints bumped in place where the work happens,
+# cheap enough to stay on. They are process wide, like the conversions of
+# natural.py; Interpreter.metrics() takes a snapshot of both together with the
+# sizes of the interpreter's caches.
+#
+# With settings.METRICS set, Interpreter.report writes the cost of each line
+# (the counts it added and the sizes after it) as one line of JSON.
+
+# the keys of a snapshot that count events, the others are sizes
+COUNTS = (
+    'naturals', 'forced', 'prime_growths', 'base_calls',
+    'to_int', 'to_list', 'int_hits', 'list_hits',
+    'cache_hits', 'cache_misses', 'cache_evictions', 'cache_skipped',
+)
+
+
+class Counters:
+    __slots__ = ('naturals', 'forced', 'prime_growths', 'base_calls')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # Naturals allocated (the shared small ints and interned lists are not)
+        self.naturals = 0
+        # thunks of lazy values forced by Natural.normalize
+        self.forced = 0
+        # times the prime table grew
+        self.prime_growths = 0
+        # bases called back from Python modules (see rfpy.py)
+        self.base_calls = 0
+
+
+counters = Counters()
+
+
+def difference(after: dict, before: dict) -> dict:
+    # the counts between two snapshots, and the sizes of the later one
+    return {key: value - before[key] if key in COUNTS else value for key, value in after.items()}
+
+
+def dump(record: dict, target):
+    # target is a path to append to or a file open for writing
+    line = json.dumps(record) + '\n'
+    if hasattr(target, 'write'):
+        target.write(line)
+        target.flush()
+        return
+    with open(target, 'a') as file:
+        file.write(line)
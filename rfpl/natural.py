@@ -1,40 +1,118 @@
-import hashlib
+import itertools
+import math
+import weakref
 from collections.abc import Callable
 from typing import Union
 
-from .RFPLParser import RFPLParser
+from .budget import Budget
+from .metrics import counters
+from .primes import BLOCK, get_prime, prime_block, product
+from .vector import Vector
+from . import syntax
 
-primes = [2, 3, 5, 7, 11, 13]
 
-def get_prime(i):
-    if i < len(primes):
-        return primes[i]
-    cur = primes[-1] + 2
-    while len(primes) <= i:
-        isprime = True
-        for div in primes:
-            if div * div > cur:
-                break
-            if cur % div == 0:
-                isprime = False
-                break
-        if isprime:
-            primes.append(cur)
-        cur += 2
-    return primes[i]
+def remove_factor(num: int, factor: int) -> tuple[int, int]:
+    # num divided by the largest power of factor dividing it (factor divides num), and its
+    # exponent; squaring the factor takes a logarithmic number of divisions
+    if num % (factor * factor):
+        return num // factor, 1
+    num, cnt = remove_factor(num, factor * factor)
+    if num % factor == 0:
+        return num // factor, 2 * cnt + 1
+    return num, 2 * cnt
+
+
+class Conversions:
+    # how often Naturals were converted between the int and list forms, and how
+    # often a conversion was saved by a cached view
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.to_int = 0
+        self.to_list = 0
+        self.int_hits = 0
+        self.list_hits = 0
+
+    def stats(self) -> str:
+        return (f'{self.to_int} to int ({self.int_hits} cached), '
+                f'{self.to_list} to list ({self.list_hits} cached)')
+
+
+conversions = Conversions()
+
+
+# Lists are hash-consed: building a list equal in form to a living one returns
+# that one, keyed by the key of its vector of entries (see vector.py), so two
+# living lists have the same key exactly when they have the same form (a key
+# outlives its list only as a key that matches nothing). Small ints and
+# Undefined are shared as well.
+interned: weakref.WeakValueDictionary[tuple, 'Natural'] = weakref.WeakValueDictionary()
+SMALL = 256
+small = []
+undefined = None
 
 
 class Natural:
-    __slots__ = ('__natural',)
+    # The value is an int, a vector of entries (the exponents of the primes), a
+    # thunk or None (undefined); its form shows in the output and in key().
+    # Naturals are immutable once they are not a thunk: simplify and factor
+    # return new values, copy returns the same one, and the other form of the
+    # value is cached once computed (__int for lists and __list for ints).
+    __slots__ = ('__natural', '__int', '__list', '__key', '__weakref__')
 
-    def __init__(self, natural: Union[int, list['Natural'], Callable[[], 'Natural']]):
-        if isinstance(natural, int) and natural < 0:
-            raise Exception(f'Cannot initialize natural with negative number {natural}')
+    def __new__(cls, natural: Union[int, list['Natural'], Vector, Callable[[], 'Natural']]):
+        key = None
+        if isinstance(natural, int):
+            if natural < 0:
+                raise Exception(f'Cannot initialize natural with negative number {natural}')
+            if natural < len(small):
+                return small[natural]
+        elif natural is None:
+            if undefined is not None:
+                return undefined
+        elif isinstance(natural, (list, Vector)):
+            if isinstance(natural, list):
+                natural = Vector.build(natural)
+            key = natural.key()
+            if key is not None and (found := interned.get(key)) is not None:
+                return found
+        if Budget.local.active is not None:
+            Budget.local.active.allocate(natural)
+        counters.naturals += 1
+        self = object.__new__(cls)
         self.__natural = natural
+        self.__int = None
+        self.__list = None
+        self.__key = None
+        if key is not None:
+            self.__key = ('l', *key)
+            interned[key] = self
+        return self
+
+    def __reduce__(self):
+        self.normalize()
+        if isinstance(self.__natural, Vector):
+            return (Natural, (list(self.__natural),))
+        return (Natural, (self.__natural,))
 
     def normalize(self):
         while callable(self.__natural):
-            self.__natural = self.__natural().__natural
+            counters.forced += 1
+            self.fill(self.__natural())
+
+    def pending(self):
+        # the thunk of a lazy value that is not forced yet, if any
+        if callable(self.__natural):
+            return self.__natural
+        return None
+
+    def fill(self, natural: 'Natural'):
+        # resolve a pending value with the result of its thunk
+        self.__natural = natural.__natural
+        self.__int = natural.__int
+        self.__list = natural.__list
+        self.__key = natural.__key
     
     def is_defined(self):
         self.normalize()
@@ -55,80 +133,138 @@ class Natural:
             return -1
         if isinstance(self.__natural, int):
             return self.__natural
-        num = 1
-        for i, ent in enumerate(self.__natural):
-            num *= get_prime(i) ** int(ent)
-        return num
+        if self.__int is not None:
+            conversions.int_hits += 1
+            return self.__int
+        conversions.to_int += 1
+        self.__int = self.multiply()
+        return self.__int
+
+    def multiply(self):
+        powers = []
+        nbits = 0
+        for i, exp in enumerate(self.__natural.ints()):
+            if exp:
+                prime = get_prime(i)
+                nbits += prime.bit_length() * exp
+                if Budget.local.active is not None:
+                    Budget.local.active.bits(nbits)
+                powers.append(prime ** exp)
+        return product(powers)
     
-    def simplify(self):
-        self.__natural = int(self)
+    def simplify(self) -> 'Natural':
+        # the value in the int form
+        self.normalize()
+        if not isinstance(self.__natural, Vector):
+            return self
+        result = Natural(int(self))
+        result.__list = self.__natural
+        return result
+
+    def factor(self) -> 'Natural':
+        # the value in the list form
+        self.normalize()
+        if isinstance(self.__natural, Vector):
+            return self
+        result = Natural(self.entries())
+        result.__int = self.__natural
+        return result
 
-    def factor(self):
-        if isinstance(self.__natural, list):
-            return
+    def entries(self) -> Vector:
+        # the list form, without changing the form of self
+        self.normalize()
+        if isinstance(self.__natural, Vector):
+            return self.__natural
+        if self.__list is not None:
+            conversions.list_hits += 1
+            return self.__list
         if self.is_zero() or not self.is_defined():
             raise Exception('Zero or undefined cannot be factored')
+        conversions.to_list += 1
+        self.__list = self.factorization()
+        return self.__list
+
+    def factorization(self):
         cur = self.__natural
-        self.__natural = []
-        pi = 0
+        # the value is replaced only at the end, a budget may stop the loop
+        natural = []
+        block = 0
         while cur > 1:
-            cnt = 0
-            while cur % get_prime(pi) == 0:
-                cur //= get_prime(pi)
-                cnt += 1
-            self.__natural.append(Natural(cnt))
-            pi += 1
+            # the big cur is only touched a few times per block of primes: its
+            # part made of the block's primes is split off with gcds against
+            # the block product (and its squares), and only that part is
+            # divided prime by prime
+            if Budget.local.active is not None:
+                Budget.local.active.step(BLOCK)
+            primes, root = prime_block(block)
+            block += 1
+            common = math.gcd(cur, root)
+            if common == 1:
+                natural.extend(Natural(0) for _ in primes)
+                continue
+            exps = {}
+            if common in primes:
+                # a single prime of the block divides cur
+                cur, exps[common] = remove_factor(cur, common)
+            else:
+                smooth = 1
+                while common > 1:
+                    cur //= common
+                    smooth *= common
+                    common = math.gcd(cur, common * common)
+                for prime in primes:
+                    if smooth % prime == 0:
+                        smooth, exps[prime] = remove_factor(smooth, prime)
+                        if smooth == 1:
+                            break
+            last = max(exps) if cur == 1 else primes[-1]
+            for prime in primes:
+                natural.append(Natural(exps.get(prime, 0)))
+                if prime == last:
+                    break
+        return Vector.build(natural)
     
     def copy(self):
-        if not self.is_defined():
-            return Natural(None)
-        if isinstance(self.__natural, int):
-            return Natural(self.__natural)
-        natural = []
-        for nat in self.__natural:
-            natural.append(nat.copy())
-        return Natural(natural)
+        # values are immutable, a copy is only forced
+        self.normalize()
+        return self
     
-    def trim(self):
-        if not self.is_defined():
-            return
-        if not isinstance(self.__natural, list):
-            return
-        while len(self.__natural) > 0 and self.__natural[-1].is_zero():
-            self.__natural.pop()
+    def trim(self) -> 'Natural':
+        # the list form without trailing zeros
+        if not self.is_defined() or not isinstance(self.__natural, Vector):
+            return self
+        entries = trimmed(self.__natural)
+        if entries is self.__natural:
+            return self
+        return Natural(entries)
 
     def get_entry(self, ind: 'Natural'):
         if not self.is_defined() or not ind.is_defined():
             return Natural(None)
         ind = int(ind)
-        self.factor()
-        if ind >= len(self.__natural):
+        entries = self.entries()
+        if ind >= len(entries):
             return Natural(0)
-        return self.__natural[ind]
+        return entries[ind]
         
     def set_entry(self, ind: 'Natural', nat: 'Natural'):
         if not self.is_defined() or not ind.is_defined():
             return Natural(None)
-        self.factor()
-        result = self.copy()
+        entries = self.entries()
         ind = int(ind)
-        while len(result.__natural) <= ind:
-            result.__natural.append(Natural(0))
-        result.__natural[ind] = nat
-        result.trim()
-        return result
+        if ind < len(entries):
+            entries = entries.set(ind, nat)
+        elif not nat.is_zero():
+            while len(entries) < ind:
+                entries = entries.append(Natural(0))
+            entries = entries.append(nat)
+        return Natural(trimmed(entries))
     
     @staticmethod
-    def interpret(tree: RFPLParser.NaturalContext):
-        if tree.Number() is not None:
-            return Natural(int(tree.Number().getText()))
-        if tree.naturallist() is not None:
-            naturallist = tree.naturallist()
-            nats = []
-            for subtr in naturallist.getTypedRuleContexts(RFPLParser.NaturalContext):
-                nats.append(Natural.interpret(subtr))
-            return Natural(nats)
-        return Natural(None)
+    def interpret(tree: syntax.Literal):
+        if isinstance(tree.value, list):
+            return Natural([Natural.interpret(subtr) for subtr in tree.value])
+        return Natural(tree.value)
     
     def succ(self):
         if not self.is_defined():
@@ -150,12 +286,14 @@ class Natural:
             return Natural(None)
         if isinstance(self.__natural, int) or isinstance(other.__natural, int):
             return Natural(int(self) * int(other))
-        a = self.__natural.copy()
-        b = other.__natural.copy()
+        a, b = self.__natural, other.__natural
         if len(b) < len(a):
             a, b = b, a
-        for i in range(len(a)):
-            b[i] = b[i] + a[i]
+        if 2 * len(a) >= len(b) and (sums := a.added(b)) is not None:
+            return Natural(sums)
+        # the exponents of the shorter list are added into the longer one
+        for i, x in enumerate(a):
+            b = b.set(i, b[i] + x)
         return Natural(b)
 
     def __pow__(self, other: 'Natural'):
@@ -167,7 +305,11 @@ class Natural:
             return Natural(self.__natural)
         if isinstance(self.__natural, int):
             p = int(other)
+            if Budget.local.active is not None:
+                Budget.local.active.bits(self.__natural.bit_length() * p)
             return Natural(self.__natural ** p)
+        if (products := self.__natural.scaled(int(other))) is not None:
+            return Natural(products)
         return Natural(list(x * other for x in self.__natural))
 
     def __mod__(self, other: 'Natural'):
@@ -181,10 +323,17 @@ class Natural:
         if not self.is_defined() or not other.is_defined():
             # two undefineds are not equal
             return False
-        if isinstance(self.__natural, list) and isinstance(other.__natural, list):
-            self.trim()
-            other.trim()
-            return self.__natural == other.__natural
+        if self is other:
+            return True
+        if isinstance(self.__natural, Vector) and isinstance(other.__natural, Vector):
+            if self.__key is not None and self.__key == other.__key:
+                return True
+            # the same exponents, missing ones are zero
+            a, b = self.__natural, other.__natural
+            if len(a) < len(b):
+                a, b = b, a
+            return (all(x == y for x, y in zip(a, b))
+                    and all(x.is_zero() for x in itertools.islice(a, len(b), None)))
         return int(self) == int(other)
     
     def __repr__(self):
@@ -207,9 +356,37 @@ class Natural:
             subreps.append(ent.__str__())
         return '<{}>'.format(', '.join(subreps))
 
-    def weird_hash(self):
-        # TODO: needs to be changed
-        return hashlib.md5(str(self).encode()).hexdigest()
+    def key(self):
+        # a hashable key of the exact structure (representation included) of the value,
+        # or None if some part of it is a lazy value that is not forced yet
+        if callable(self.__natural):
+            return None
+        if self.__natural is None:
+            return '_'
+        if isinstance(self.__natural, int):
+            return self.__natural
+        if self.__key is None:
+            # a list that had lazy entries when it was built
+            if (key := self.__natural.key()) is None:
+                return None
+            if (found := interned.get(key)) is None:
+                self.__key = ('l', *key)
+                interned[key] = self
+            else:
+                self.__key = found.__key
+        return self.__key
+
+
+def trimmed(entries: Vector) -> Vector:
+    # entries without the trailing zeros
+    end = len(entries)
+    while end > 0 and entries[end - 1].is_zero():
+        end -= 1
+    return entries.truncate(end)
+
+
+small.extend(Natural(i) for i in range(SMALL))
+undefined = Natural(None)
 
 
 class NaturalList:
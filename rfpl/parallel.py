@@ -0,0 +1,116 @@
+import time
+
+from .budget import Budget
+from .compiler import CnNode, ConstantNode, IdentityNode, LazyNode, LeafNode, MnNode, Node, PrNode
+from . import batch, settings
+
+# Parallel evaluation of the arguments of Cn, opt-in with settings.PARALLEL_WORKERS.
+#
+# Each Cn in the body of a defined function is registered under an id, the ix
+# of the function and its position in the body. The workers of the pool (see
+# batch.py) replay the same definitions, so the same id finds the same Cn there.
+#
+# The cost of an argument g_i is estimated by the time its last evaluation took.
+# When at least two arguments cost more than settings.PARALLEL_THRESHOLD seconds,
+# all but the first of them are sent to the pool and the rest are evaluated
+# here in the meantime. Arguments that are lazy (their thunk stays a thunk),
+# need the bases of the caller, or are a plain !i or #n never leave the
+# process, and neither does anything while a Budget is active or while the
+# arguments of the call are not all forced.
+
+
+class Branches:
+    # the parallel state of a Cn node
+    __slots__ = ('pool', 'id', 'remote', 'costs')
+
+    def __init__(self, pool: 'ParallelPool', id: tuple, remote: list[bool]):
+        self.pool = pool
+        self.id = id
+        # which arguments may be sent to the pool
+        self.remote = remote
+        # seconds the last evaluation of each argument took
+        self.costs = [0.0] * len(remote)
+
+
+def children(node: Node) -> list[Node]:
+    if isinstance(node, LazyNode):
+        return [node.inner]
+    if isinstance(node, LeafNode):
+        return [base.c_node for base in node.bases or []]
+    if isinstance(node, CnNode):
+        return [node.h, *node.gs]
+    if isinstance(node, PrNode):
+        return [node.h, node.g]
+    if isinstance(node, MnNode):
+        return [node.h]
+    return []
+
+
+def remote(g: Node) -> bool:
+    return (not isinstance(g, (LazyNode, IdentityNode, ConstantNode))
+            and g.root.c_ftype.nbase == 0)
+
+
+class ParallelPool:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.nodes: dict[tuple, CnNode] = {}
+        self.executor = None
+        # the length of the history the workers replayed
+        self.replayed = 0
+
+    def register(self, syment):
+        # gives ids to the Cn nodes in the body of a new definition
+        stack = [syment.fexpr.c_node]
+        count = 0
+        while stack:
+            node = stack.pop()
+            if isinstance(node, CnNode):
+                node_id = (syment.ix, count)
+                count += 1
+                self.nodes[node_id] = node
+                flags = [remote(g) for g in node.gs]
+                if sum(flags) >= 2:
+                    node.parallel = Branches(self, node_id, flags)
+            stack.extend(reversed(children(node)))
+
+    def start(self):
+        history = self.interpreter.history
+        if self.executor is not None and self.replayed != len(history):
+            # the workers do not know the newer definitions
+            self.shutdown()
+        if self.executor is None:
+            self.executor = batch.start_pool(history.copy(), settings.PARALLEL_WORKERS)
+            self.replayed = len(history)
+        return self.executor
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def arguments(self, node: CnNode, blist, args, evaluate) -> list:
+        # the values of the arguments of node, evaluate(g, blist, args) evaluates one here
+        branches = node.parallel
+        heavy = []
+        if (Budget.local.active is None and not self.interpreter.loading
+                and all(arg.key() is not None for arg in args.content)):
+            heavy = [i for i, cost in enumerate(branches.costs)
+                     if branches.remote[i] and cost >= settings.PARALLEL_THRESHOLD]
+        futures = {}
+        if len(heavy) >= 2:
+            executor = self.start()
+            content = tuple(args.content)
+            for i in heavy[1:]:
+                futures[i] = executor.submit(batch.branch_in_worker, branches.id, i, content)
+        fargs = []
+        for i, g in enumerate(node.gs):
+            if i in futures:
+                fargs.append(None)
+                continue
+            start = time.perf_counter()
+            fargs.append(evaluate(g, blist, args))
+            branches.costs[i] = time.perf_counter() - start
+        for i, future in futures.items():
+            fargs[i] = future.result()
+        return fargs
@@ -0,0 +1,149 @@
+import argparse
+import math
+import mmap
+import sys
+from array import array
+from itertools import compress
+from pathlib import Path
+
+from .metrics import counters
+from . import settings
+
+# The table of primes behind the Gödel encoding of lists. It is grown with a
+# segmented sieve of Eratosthenes, at least doubling the sieved range each time,
+# and kept in an array('Q') (8 bytes a prime).
+#
+# A table can be saved to a file and memory-mapped back (settings.PRIME_TABLE is
+# mapped the first time the table has to grow); the mapped primes are copied
+# into memory only if the table has to grow past them. Files hold a header and
+# the primes in native byte order:
+#
+#   python -m rfpl.primes [-n COUNT] FILE
+
+MAGIC = b'RFPLPRM\x01'
+SEGMENT = 1 << 20
+
+
+class PrimeTable:
+    def __init__(self):
+        self.primes = array('Q', [2, 3, 5, 7, 11, 13])
+        # every prime below limit is in the table
+        self.limit = 14
+        self.mapped = None
+        self.tried_setting = False
+
+    def __len__(self):
+        return len(self.primes)
+
+    def __getitem__(self, i: int) -> int:
+        if i >= len(self.primes):
+            self.grow(i + 1)
+        return self.primes[i]
+
+    def grow(self, count: int):
+        # make the table hold at least count primes
+        counters.prime_growths += 1
+        if not self.tried_setting:
+            self.tried_setting = True
+            if settings.PRIME_TABLE is not None and Path(settings.PRIME_TABLE).is_file():
+                self.load(settings.PRIME_TABLE)
+                if len(self.primes) >= count:
+                    return
+        if self.mapped is not None:
+            mapped = self.primes
+            self.primes = array('Q', mapped)
+            mapped.release()
+            self.mapped.close()
+            self.mapped = None
+        target = max(2 * self.limit, upper_bound(count))
+        while len(self.primes) < count:
+            hi = min(target, self.limit + SEGMENT, self.limit * self.limit)
+            self.sieve(self.limit, hi)
+            if self.limit >= target:
+                target *= 2
+
+    def sieve(self, lo: int, hi: int):
+        # adds the primes in [lo, hi), needs every prime below sqrt(hi) to be known
+        segment = bytearray([1]) * (hi - lo)
+        for p in self.primes:
+            if p * p >= hi:
+                break
+            start = max(p * p, (lo + p - 1) // p * p)
+            segment[start - lo::p] = bytes(len(range(start, hi, p)))
+        self.primes.extend(compress(range(lo, hi), segment))
+        self.limit = hi
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(MAGIC)
+            file.write(self.limit.to_bytes(8, sys.byteorder))
+            file.write(self.primes)
+
+    def load(self, path):
+        with open(path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(MAGIC)] != MAGIC:
+            mapped.close()
+            raise Exception(f'{path} is not a prime table')
+        limit = int.from_bytes(mapped[8:16], sys.byteorder)
+        if limit <= self.limit:
+            mapped.close()
+            return
+        self.mapped = mapped
+        self.primes = memoryview(mapped)[16:].cast('Q')
+        self.limit = limit
+
+
+def upper_bound(count: int) -> int:
+    # a bound on the count-th prime (Rosser), so the sieve rarely needs a second round
+    if count < 6:
+        return 14
+    return int(count * (math.log(count) + math.log(math.log(count)))) + 1
+
+
+table = PrimeTable()
+
+
+def get_prime(i: int) -> int:
+    primes = table.primes
+    if i < len(primes):
+        return primes[i]
+    return table[i]
+
+
+# products of consecutive blocks of BLOCK primes, for Natural.factor
+BLOCK = 256
+blocks: list[tuple[list[int], int]] = []
+
+
+def prime_block(b: int) -> tuple[list[int], int]:
+    # the primes of block b and their product
+    while len(blocks) <= b:
+        start = len(blocks) * BLOCK
+        get_prime(start + BLOCK - 1)
+        primes = list(table.primes[start:start + BLOCK])
+        blocks.append((primes, product(primes)))
+    return blocks[b]
+
+
+def product(nums: list[int]) -> int:
+    # multiplies balanced pairs, so the big multiplications have operands of similar size
+    if not nums:
+        return 1
+    while len(nums) > 1:
+        nums = [nums[i] * nums[i + 1] if i + 1 < len(nums) else nums[i] for i in range(0, len(nums), 2)]
+    return nums[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m rfpl.primes', description='Precompute a table of primes')
+    parser.add_argument('file')
+    parser.add_argument('-n', '--count', type=int, default=1000000, help='number of primes (default: %(default)s)')
+    args = parser.parse_args()
+    table.grow(args.count)
+    table.save(args.file)
+    print(f'saved {len(table)} primes below {table.limit} to {args.file}')
+
+
+if __name__ == '__main__':
+    main()
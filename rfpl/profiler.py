@@ -0,0 +1,195 @@
+import time
+from collections import defaultdict
+
+from .compiler import (BracketNode, CnNode, ConstantNode, IdentityNode, LazyNode,
+                       LeafNode, MnNode, Node, PrNode)
+from .parallel import children
+from . import settings
+
+# A deterministic profiler of the compiled engine. While a profiler runs, the
+# evaluate methods of the node classes are replaced (on the classes, for every
+# interpreter) by versions that time each evaluation; stopping it puts the
+# originals back, so a program that is not profiled runs exactly as before.
+#
+# Every node is a span of the source. For each span it counts the calls, the
+# inclusive time and the self time (without the spans evaluated below it); the
+# iterations of a Pr are the evaluations of its step and the probes of a Mn the
+# evaluations of its predicate. The calls of a symbol are the evaluations of
+# the leaves that name it. Lazy arguments are timed where they are forced.
+#
+# The collapsed stacks (symbol;symbol;... microseconds, one per line) are what
+# flamegraph.pl and speedscope read.
+
+NODES = (LazyNode, LeafNode, BracketNode, IdentityNode, ConstantNode, CnNode, PrNode, MnNode)
+# the spans in the table, the others are too small to be interesting
+SPANS = (LeafNode, CnNode, PrNode, MnNode)
+
+# the running profiler, if any
+active: 'Profiler' = None
+
+
+class Record:
+    __slots__ = ('calls', 'total', 'own')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.own = 0.0
+
+
+class Profiler:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.originals = {}
+        self.records: dict[Node, Record] = {}
+        # the time of the running evaluations spent in the spans below them
+        self.below: list[float] = []
+        # collapsed stacks: the path of symbols of the running evaluations, as
+        # ids into paths (path id -> (parent id, symbol)), and the self time of each
+        self.stack: list[int] = [0]
+        self.paths: list[tuple] = [(None, None)]
+        self.path_ids: dict[tuple, int] = {}
+        self.times: dict[int, float] = defaultdict(float)
+        # the definition each node belongs to, and the next ix of the symbol table then
+        self.owners: dict[Node, str] = {}
+        self.owned = -1
+
+    def reset(self):
+        # in place, the timed methods of a running profiler hold on to these
+        self.records.clear()
+        del self.paths[1:]
+        self.path_ids.clear()
+        self.times.clear()
+
+    @property
+    def running(self) -> bool:
+        return active is self
+
+    def start(self):
+        global active
+        if settings.ENGINE != 'compile':
+            raise ValueError(f'The profiler needs the compile engine, not {settings.ENGINE}')
+        if active is not None:
+            active.stop()
+        for cls in NODES:
+            self.originals[cls] = cls.__dict__['evaluate']
+            cls.evaluate = self.timed(self.originals[cls])
+        active = self
+
+    def stop(self):
+        global active
+        if active is not self:
+            return
+        for cls, evaluate in self.originals.items():
+            cls.evaluate = evaluate
+        self.originals = {}
+        active = None
+
+    def timed(self, evaluate):
+        records = self.records
+        below = self.below
+        stack = self.stack
+        path_ids = self.path_ids
+        times = self.times
+        clock = time.perf_counter
+
+        def timed_evaluate(node, blist, args):
+            if isinstance(node, LeafNode):
+                key = (stack[-1], node.syment.symbol)
+                if (path := path_ids.get(key)) is None:
+                    path = path_ids[key] = len(self.paths)
+                    self.paths.append(key)
+            else:
+                path = stack[-1]
+            stack.append(path)
+            below.append(0.0)
+            start = clock()
+            try:
+                return evaluate(node, blist, args)
+            finally:
+                elapsed = clock() - start
+                own = elapsed - below.pop()
+                stack.pop()
+                if below:
+                    below[-1] += elapsed
+                if (record := records.get(node)) is None:
+                    record = records[node] = Record()
+                record.calls += 1
+                record.total += elapsed
+                record.own += own
+                times[path] += own
+        return timed_evaluate
+
+    def owner(self, node: Node) -> str:
+        table = self.interpreter.symbol_table
+        if self.owned != table.next_ix:
+            self.owned = table.next_ix
+            for syment in table.table:
+                if syment.fexpr is None or syment.fexpr.c_node is None:
+                    continue
+                stack = [syment.fexpr.c_node]
+                while stack:
+                    top = stack.pop()
+                    self.owners[top] = syment.symbol
+                    stack.extend(children(top))
+        return self.owners.get(node, '-')
+
+    def calls(self, node: Node) -> int:
+        record = self.records.get(node)
+        return record.calls if record is not None else 0
+
+    def symbols(self) -> list[tuple[str, Record]]:
+        # (symbol, record) by self time
+        totals = {}
+        for node, record in self.records.items():
+            if not isinstance(node, LeafNode):
+                continue
+            total = totals.setdefault(node.syment.ix, (node.syment.symbol, Record()))[1]
+            total.calls += record.calls
+            total.total += record.total
+            total.own += record.own
+        return sorted(totals.values(), key=lambda item : -item[1].own)
+
+    def spans(self) -> list[tuple[Node, Record]]:
+        # (node, record) by self time
+        spans = [(node, record) for node, record in self.records.items() if isinstance(node, SPANS)]
+        return sorted(spans, key=lambda item : -item[1].own)
+
+    def describe(self, node: Node) -> str:
+        text = node.root.getText()
+        if len(text) > 40:
+            text = text[:37] + '...'
+        where = f'{self.owner(node)}:{node.root.start}'
+        if isinstance(node, PrNode):
+            text += f' ({self.calls(node.g)} iterations)'
+        elif isinstance(node, MnNode):
+            text += f' ({self.calls(node.h)} probes)'
+        return f'{where:16} {text}'
+
+    def report(self, limit: int = 20) -> str:
+        lines = [f'{"symbol":24} {"calls":>10} {"total ms":>12} {"self ms":>12}']
+        for symbol, record in self.symbols()[:limit]:
+            lines.append(f'{symbol:24} {record.calls:10} {record.total * 1e3:12.3f} {record.own * 1e3:12.3f}')
+        lines.append('')
+        lines.append(f'{"span":57} {"calls":>10} {"total ms":>12} {"self ms":>12}')
+        for node, record in self.spans()[:limit]:
+            lines.append(f'{self.describe(node):57} {record.calls:10} '
+                         f'{record.total * 1e3:12.3f} {record.own * 1e3:12.3f}')
+        return '\n'.join(lines)
+
+    def collapsed(self) -> list[str]:
+        lines = []
+        for path, seconds in self.times.items():
+            frames = []
+            while path:
+                path, symbol = self.paths[path]
+                frames.append(symbol)
+            name = ';'.join(reversed(frames)) or '-'
+            if (micros := round(seconds * 1e6)) > 0:
+                lines.append(f'{name} {micros}')
+        return lines
+
+    def save(self, path: str):
+        with open(path, 'w') as file:
+            for line in self.collapsed():
+                file.write(line + '\n')
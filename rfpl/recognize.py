@@ -0,0 +1,234 @@
+import itertools
+
+from .budget import Budget
+from .compiler import CnNode, ConstantNode, IdentityNode, LeafNode, Node, PrNode
+from .natural import Natural, NaturalList
+from .symbol import SymbolEntry
+
+# Recognizes definitions of the usual primitive recursive shapes and replaces
+# their calls with native operations on Naturals. The native versions follow
+# the evaluation of Pr exactly, including its corner cases (an undefined counter
+# runs zero iterations, the base case is returned as is, ...), and every
+# substitution is checked against the definition on sample inputs before it is
+# used.
+#
+#   Pr[b, Cn[S, !0]]           b + n             (add when b is !0)
+#   Pr[b, !k] / Pr[b, #c]      projection steps  (pred is Pr[#0, !1], sign is Pr[#0, #1])
+#   Pr[b, Cn[g, e0, e1, ...]]  n applications of a recognized g, where every ei is
+#                              !0, !1, another argument or a constant
+#                              (mul, pow and monus are such iterations)
+#
+# where b is an argument or a constant. Iterations of add, mul and pred skip the
+# remaining steps with a closed form as soon as the accumulator reaches a value
+# on which the step is plain arithmetic.
+
+SAMPLES = ['0', '1', '2', '3', '<1>', '<0, 1>', '<>', '_']
+MAX_NARG = 3
+
+
+def is_leaf(node: Node, symbol: str = None):
+    return (isinstance(node, LeafNode) and node.bases is None
+            and (symbol is None or node.syment.symbol == symbol))
+
+
+def is_identity(node: Node, number: int = None):
+    return isinstance(node, IdentityNode) and (number is None or node.number == number)
+
+
+def is_constant(node: Node, value: int = None):
+    return isinstance(node, ConstantNode) and (value is None or node.natural.key() == value)
+
+
+def base_case(node: Node):
+    # the value of the base case of Pr from the arguments of Pr (counter included)
+    if is_identity(node):
+        number = node.number + 1
+        return lambda args : args[number]
+    if is_constant(node):
+        natural = node.natural
+        return lambda args : natural
+    return None
+
+
+class Recognizer:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+
+    def recognize(self, syment: SymbolEntry):
+        # returns a description of the native operation, or None
+        if syment.fexpr is None or syment.ftype.nbase > 0 or syment.ftype.narg > MAX_NARG:
+            return None
+        node = syment.fexpr.c_node
+        if not isinstance(node, PrNode) or (base := base_case(node.h)) is None:
+            return None
+        g = node.g
+        if isinstance(g, CnNode) and g.rest is None and is_leaf(g.h, 'S') and len(g.gs) == 1 and is_identity(g.gs[0], 0):
+            native, call = self.succ(base)
+            if is_identity(node.h, 0):
+                native = 'add'
+        elif is_identity(g) or is_constant(g):
+            native, call = self.project(base, g)
+            if is_constant(node.h, 0) and is_identity(g, 1):
+                native = 'pred'
+            elif is_constant(node.h, 0) and is_constant(g, 1):
+                native = 'sign'
+        elif (isinstance(g, CnNode) and g.rest is None and is_leaf(g.h) and g.h.syment.native is not None
+              and all(is_identity(e) or is_constant(e) for e in g.gs)):
+            native, call = self.iterate(base, g.h.syment, g.gs)
+            step = g.h.syment.native
+            acc_and_arg = len(g.gs) == 2 and any(is_identity(e, 0) for e in g.gs) and any(is_identity(e, 2) for e in g.gs)
+            if step == 'add' and is_constant(node.h, 0) and acc_and_arg:
+                native = 'mul'
+            elif step == 'mul' and is_constant(node.h, 1) and acc_and_arg:
+                native = 'pow'
+            elif step == 'pred' and is_identity(node.h, 0) and len(g.gs) == 1 and is_identity(g.gs[0], 0):
+                native = 'monus'
+        else:
+            return None
+        if not self.verify(syment, call):
+            return None
+        syment.call = call
+        syment.native = native
+        return native
+
+    def verify(self, syment: SymbolEntry, call):
+        # the samples are small, so the check runs outside the budget of the definition
+        previous, Budget.local.active = Budget.local.active, None
+        try:
+            return self.check(syment, call)
+        finally:
+            Budget.local.active = previous
+
+    def check(self, syment: SymbolEntry, call):
+        node = syment.fexpr.c_node
+        for sample in itertools.product(SAMPLES, repeat=max(1, syment.ftype.narg)):
+            args = [self.sample(text) for text in sample]
+            try:
+                expect = node.evaluate(None, NaturalList(list(args)))
+                got = call(None, NaturalList(list(args)))
+            except Exception:
+                return False
+            if expect.key() != got.key():
+                return False
+        return True
+
+    def sample(self, text: str):
+        if text == '_':
+            return Natural(None)
+        if text.startswith('<'):
+            return Natural([Natural(int(x)) for x in text[1:-1].split(',') if x.strip()])
+        return Natural(int(text))
+
+    def succ(self, base):
+        def call(_blist, args):
+            n = int(args[0])
+            cur = base(args)
+            if n <= 0 or not cur.is_defined():
+                return cur
+            return Natural(int(cur) + n)
+        return 'b + n', call
+
+    def project(self, base, g: Node):
+        if is_constant(g):
+            natural = g.natural
+            step = lambda n, args : natural
+        elif g.number == 0:
+            step = None
+        elif g.number == 1:
+            step = lambda n, args : Natural(n - 1)
+        else:
+            number = g.number - 1
+            step = lambda n, args : args[number]
+
+        def call(_blist, args):
+            n = int(args[0])
+            if n <= 0 or step is None:
+                return base(args)
+            return step(n, args)
+        return 'projection', call
+
+    def iterate(self, base, gent: SymbolEntry, gs: list[Node]):
+        gcall = gent.call
+        # argument of the step: ('acc',), ('ctr',) or ('arg', index in the arguments of Pr)
+        spec = []
+        for e in gs:
+            if is_constant(e):
+                spec.append(('const', e.natural))
+            elif e.number == 0:
+                spec.append(('acc',))
+            elif e.number == 1:
+                spec.append(('ctr',))
+            else:
+                spec.append(('arg', e.number - 1))
+        uses_counter = any(s[0] == 'ctr' for s in spec)
+        skip = None
+        if len(spec) == 2 and sorted(s[0] for s in spec) in (['acc', 'arg'], ['acc', 'const']):
+            skip = {'add': self.skip_add, 'mul': self.skip_mul}.get(gent.native)
+        elif len(spec) == 1 and spec[0][0] == 'acc' and gent.native == 'pred':
+            skip = self.skip_pred
+
+        def call(_blist, args):
+            n = int(args[0])
+            cur = base(args)
+            if n <= 0:
+                return cur
+            fixed = []
+            other = None
+            for s in spec:
+                if s[0] == 'const':
+                    fixed.append(other := s[1])
+                elif s[0] == 'arg':
+                    fixed.append(other := args[s[1]])
+                else:
+                    fixed.append(None)
+            for i in range(n):
+                # one step of the budget per iteration, as in the loop of Pr; this
+                # is also where a cancelled token stops it
+                if Budget.local.active is not None:
+                    Budget.local.active.step()
+                fargs = []
+                for s, val in zip(spec, fixed):
+                    if s[0] == 'acc':
+                        fargs.append(cur)
+                    elif s[0] == 'ctr':
+                        fargs.append(Natural(i))
+                    else:
+                        fargs.append(val)
+                nxt = gcall(None, NaturalList(fargs))
+                remaining = n - i - 1
+                if remaining == 0:
+                    return nxt
+                if skip is not None and (result := skip(nxt, other, remaining)) is not None:
+                    return result
+                if not uses_counter and (key := nxt.key()) is not None and key == cur.key():
+                    # the step has reached a fixed point
+                    return nxt
+                cur = nxt
+            return cur
+        return f'iteration of {gent.symbol}', call
+
+    # Closed forms for the remaining steps of an iteration, once both the
+    # accumulator and the other operand are in the range where the step is
+    # plain arithmetic on ints. Lazy values are left alone, since the loop
+    # might never force them.
+
+    def known(self, *nats: Natural):
+        return all(nat.pending() is None and nat.is_defined() for nat in nats)
+
+    def skip_add(self, cur: Natural, other: Natural, remaining: int):
+        if self.known(cur, other) and int(cur) >= 1 and int(other) >= 1:
+            return Natural(int(cur) + remaining * int(other))
+        return None
+
+    def skip_mul(self, cur: Natural, other: Natural, remaining: int):
+        if self.known(cur, other) and int(cur) >= 2 and int(other) >= 2:
+            if Budget.local.active is not None:
+                # before the power, a single big power can take longer than any budget
+                Budget.local.active.bits(int(cur).bit_length() + int(other).bit_length() * remaining)
+            return Natural(int(cur) * int(other) ** remaining)
+        return None
+
+    def skip_pred(self, cur: Natural, other: Natural, remaining: int):
+        if self.known(cur):
+            return Natural(max(int(cur) - remaining, 0))
+        return None
@@ -0,0 +1,152 @@
+import hashlib
+import os
+import pickle
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import Optional
+
+from .natural import Natural
+from .symbol import FunctionType
+from . import syntax
+
+# The compiled module cache: loading an .rfpl module saves its parsed commands,
+# and the types preprocess gave to the definitions, to __pycache__/<name>.rfplc
+# next to it. The next load of the same source (by its sha256) with the same
+# version of rfpl (the hash of its sources where it is not installed) and the
+# same modules behind its loads (transitively, by their hashes) skips parsing
+# and type checking.
+#
+# The types of a definition depend on the types of the functions it calls, so
+# each definition also keeps these (its bindings); when one of them has another
+# type at load time (say, it was redefined by the user), that definition is
+# preprocessed as usual.
+
+FORMAT = 1
+# (FORMAT, version of rfpl), once it is known
+VERSION = None
+
+
+def current_version() -> tuple:
+    global VERSION
+    if VERSION is None:
+        try:
+            VERSION = FORMAT, version('rfpl')
+        except PackageNotFoundError:
+            # a checkout that is not installed, whose code changes without a version
+            VERSION = FORMAT, sources_hash()
+    return VERSION
+
+
+def sources_hash() -> str:
+    hasher = hashlib.new('sha256')
+    for path in sorted(Path(__file__).parent.rglob('*.py')):
+        hasher.update(str(path.relative_to(Path(__file__).parent)).encode())
+        hasher.update(path.read_bytes())
+    return hasher.hexdigest()
+
+
+def cache_path(source: Path) -> Path:
+    return source.parent / '__pycache__' / (source.stem + '.rfplc')
+
+
+class Link:
+    # the types of the nodes of a definition, and the types of the functions of
+    # its leaves, both in preorder
+    __slots__ = ('types', 'bindings')
+
+    def __init__(self, types: list[FunctionType], bindings: list[FunctionType]):
+        self.types = types
+        self.bindings = bindings
+
+
+def preorder(root: syntax.Fexpr):
+    stack = [root]
+    while stack:
+        tree = stack.pop()
+        yield tree
+        if isinstance(tree, syntax.Leaf):
+            children = tree.bases or []
+        elif isinstance(tree, syntax.Cn):
+            children = [tree.h, *tree.gs]
+        elif isinstance(tree, syntax.Pr):
+            children = [tree.h, tree.g]
+        elif isinstance(tree, syntax.Mn):
+            children = [tree.h]
+        else:
+            children = []
+        stack.extend(reversed(children))
+
+
+def record(root: syntax.Fexpr) -> Link:
+    # expects a tree that passed preprocess without errors
+    types = []
+    bindings = []
+    for tree in preorder(root):
+        types.append(tree.c_ftype)
+        if isinstance(tree, syntax.Leaf):
+            bindings.append(tree.c_syment.ftype)
+    return Link(types, bindings)
+
+
+def link(root: syntax.Fexpr, saved: Link, search) -> bool:
+    # sets up root as preprocess would, False if a binding changed
+    types = iter(saved.types)
+    bindings = iter(saved.bindings)
+    for tree in preorder(root):
+        tree.c_ftype = next(types)
+        if isinstance(tree, syntax.Leaf):
+            syment = search(tree.symbol.text)
+            if syment is None or syment.ftype != next(bindings):
+                return False
+            tree.c_syment = syment
+        elif isinstance(tree, syntax.Constant):
+            tree.c_natural = Natural.interpret(tree.literal)
+    return True
+
+
+def read(source: Path, source_hash: str) -> Optional[dict]:
+    # the cached module of source, None when there is none or it is stale; the
+    # caller checks the dependencies
+    try:
+        with open(cache_path(source), 'rb') as file:
+            saved = pickle.load(file)
+        if saved['version'] != current_version() or saved['source'] != source_hash:
+            return None
+        statements = pickle.loads(saved['statements'])
+    except Exception:
+        # missing, unreadable or written by an incompatible rfpl
+        return None
+    for statement, saved_link in zip(statements, saved['links']):
+        statement.link = saved_link
+    saved['statements'] = statements
+    return saved
+
+
+def dumps(statements: list[syntax.Statement]) -> Optional[bytes]:
+    try:
+        return pickle.dumps(statements, pickle.HIGHEST_PROTOCOL)
+    except RecursionError:
+        # pickle recurses into the trees, a deeply nested module is not cached
+        return None
+
+
+def write(source: Path, source_hash: str, dependencies: dict[str, str],
+          statements: bytes, links: list[Optional[Link]]):
+    # statements is the pickle of the commands taken before they were interpreted
+    path = cache_path(source)
+    saved = {
+        'version': current_version(),
+        'source': source_hash,
+        'dependencies': dependencies,
+        'statements': statements,
+        'links': links,
+    }
+    try:
+        path.parent.mkdir(exist_ok=True)
+        temp = path.with_name(f'{path.name}.{os.getpid()}')
+        with open(temp, 'wb') as file:
+            pickle.dump(saved, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+    except OSError:
+        # a read-only library is loaded as usual
+        pass
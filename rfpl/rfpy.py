@@ -1,6 +1,7 @@
 from dataclasses import dataclass
 from collections.abc import Callable
 
+from .metrics import counters
 from .natural import NaturalList
 from .symbol import BaseList, FunctionType, SymbolEntry
 
@@ -10,6 +11,7 @@ class ExportInfo:
     name: str
     narg: int
     nbase: int = 0
+    strict: tuple[int, ...] = ()
 
 
 class RFPYModule:
@@ -29,15 +31,17 @@ class RFPYModule:
                 symbols.append(SymbolEntry(
                     symbol=exp.name,
                     call=call,
-                    ftype=FunctionType(narg=exp.narg, nbase=exp.nbase)
+                    ftype=FunctionType(narg=exp.narg, nbase=exp.nbase),
+                    strict=exp.strict,
                 ))
         return symbols
     
     def call_base(self, blist: BaseList, ix: int, args: NaturalList):
+        counters.base_calls += 1
         return self.interpreter.interpret_fexpr(blist.args[ix], blist.prev, args)
 
 
-def define(*, narg, name=None, nbase=0):
+def define(*, narg, name=None, nbase=0, strict=()):
     def decorator(func: Callable):
         nonlocal name
         name = name or func.__name__
@@ -45,6 +49,7 @@ def define(*, narg, name=None, nbase=0):
             name=name,
             narg=narg,
             nbase=nbase,
+            strict=strict,
         )
         return func
     return decorator
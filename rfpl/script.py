@@ -0,0 +1,47 @@
+import json
+import sys
+from typing import Iterable, TextIO
+
+from .interpreter import Interpreter, Message, MessageType
+from . import settings, syntax
+
+# Runs scripts without the interactive session (and without importing
+# prompt_toolkit): the commands are read as the lines of a module are (see
+# syntax.statements), so the standard input is taken a command at a time, and
+# each goes through Interpreter.report. The messages are written as the session
+# prints them, without colors, or as one line of JSON per command:
+#
+#   rfpl run FILE
+#   rfpl [--json] - < FILE
+
+
+def text(msg: Message) -> list[str]:
+    if msg.typ == MessageType.NATURAL:
+        return [f' = {msg.natural}']
+    if msg.typ == MessageType.INFO:
+        return [f' . {msg.message}'] if settings.VERBOSE >= 1 else []
+    if msg.typ == MessageType.ERROR:
+        return [f' ! ERROR: {msg.message}'] + [' ' * 7 + ctx for ctx in msg.context or []]
+    if msg.typ == MessageType.EXCEPTION:
+        return [f' * EXCEPTION: {msg.message}']
+    return [f' ! LIMIT: {msg.message}']
+
+
+def run(intr: Interpreter, lines: Iterable[str], out: TextIO = sys.stdout, as_json: bool = False) -> bool:
+    # whether every command was ok, the later commands run after one that was not
+    allok = True
+    for statement in syntax.statements(lines):
+        ok, messages = intr.report(statement.text, statement=statement)
+        allok = allok and ok
+        if as_json:
+            out.write(json.dumps({
+                'line': statement.text,
+                'ok': ok,
+                'messages': [msg.asdict() for msg in messages],
+            }) + '\n')
+        else:
+            for msg in messages:
+                for line in text(msg):
+                    out.write(line + '\n')
+        out.flush()
+    return allok
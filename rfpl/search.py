@@ -0,0 +1,141 @@
+import time
+from collections import OrderedDict
+
+from .budget import Budget
+from .natural import Natural, NaturalList
+from .symbol import BaseList
+from . import settings
+
+# The search of Mn[h], shared by all engines. A search is a generator that yields
+# the candidates to try (ints) and is sent the forced value of h on each of them;
+# its return value is the result of Mn. The engines differ only in how they
+# evaluate h.
+#
+# A search is bounded by settings.MN_LIMIT candidates and settings.MN_TIMEOUT
+# seconds. When it runs out it returns Undefined and leaves an INFO message;
+# it also remembers how far it got, so evaluating the same Mn on the same
+# arguments again resumes there instead of starting over.
+#
+# With settings.MN_MONOTONE the predicate is assumed to be monotone (nonzero
+# below the root, zero from the root on) and the root is found by probing
+# 0, 1, 3, 7, ... and then bisecting, in a logarithmic number of candidates.
+
+
+class MnSearch:
+    PROGRESS_SIZE = 1000
+
+    def __init__(self, info):
+        # info(message) reports a diagnostic
+        self.info = info
+        # (root of Mn, monotone, argument keys) -> the least candidate that is not
+        # known to be nonzero; the bound of a bisection is not one for a linear search
+        self.progress: OrderedDict[tuple, int] = OrderedDict()
+
+    def clear(self):
+        self.progress.clear()
+
+    def key(self, root, blist: BaseList, args: NaturalList):
+        # like the cache, searches that depend on bases or lazy values are not resumed
+        if blist is not None and len(blist.args):
+            return None
+        key = []
+        for arg in args.content:
+            if (argkey := arg.key()) is None:
+                return None
+            key.append(argkey)
+        return (root, settings.MN_MONOTONE, tuple(key))
+
+    def search(self, root, blist: BaseList, args: NaturalList):
+        key = self.key(root, blist, args)
+        lo = self.progress.pop(key, 0) if key is not None else 0
+        budget = SearchBudget()
+        if settings.MN_MONOTONE:
+            return (yield from self.monotone(root, key, lo, budget))
+        return (yield from self.linear(root, key, lo, budget))
+
+    def linear(self, root, key, lo: int, budget: 'SearchBudget'):
+        while True:
+            if budget.spent():
+                return self.give_up(root, key, lo, budget)
+            result = yield lo
+            if not result.is_defined():
+                return Natural(None)
+            if result.is_zero():
+                return Natural(lo)
+            lo += 1
+
+    def monotone(self, root, key, lo: int, budget: 'SearchBudget'):
+        # every candidate below lo is nonzero
+        hi = None
+        step = 1
+        while hi is None:
+            if budget.spent():
+                return self.give_up(root, key, lo, budget)
+            cand = lo + step - 1
+            result = yield cand
+            if not result.is_defined():
+                return Natural(None)
+            if result.is_zero():
+                hi = cand
+            else:
+                lo = cand + 1
+                step *= 2
+        # the root is in [lo, hi]
+        while lo < hi:
+            if budget.spent():
+                return self.give_up(root, key, lo, budget)
+            mid = (lo + hi) // 2
+            result = yield mid
+            if not result.is_defined():
+                return Natural(None)
+            if result.is_zero():
+                hi = mid
+            else:
+                lo = mid + 1
+        return Natural(hi)
+
+    def give_up(self, root, key, lo: int, budget: 'SearchBudget'):
+        if key is not None:
+            self.progress[key] = lo
+            if len(self.progress) > self.PROGRESS_SIZE:
+                self.progress.popitem(last=False)
+        self.info(
+            f'Mn search in {root.getText()} gave up after {budget.tried} candidates '
+            f'({budget.reason()}), no root below {lo}; the result is undefined'
+        )
+        return Natural(None)
+
+    def run(self, root, blist: BaseList, args: NaturalList, probe) -> Natural:
+        # drives a search with probe(candidate) -> value of h
+        search = self.search(root, blist, args)
+        try:
+            cand = next(search)
+            while True:
+                cand = search.send(probe(cand))
+        except StopIteration as stop:
+            return stop.value
+
+
+class SearchBudget:
+    def __init__(self):
+        self.tried = 0
+        self.limit = settings.MN_LIMIT
+        self.deadline = None
+        if settings.MN_TIMEOUT is not None:
+            self.deadline = time.monotonic() + settings.MN_TIMEOUT
+
+    def spent(self):
+        if self.limit is not None and self.tried >= self.limit:
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        self.tried += 1
+        if Budget.local.active is not None:
+            Budget.local.active.step()
+        return False
+
+    def reason(self):
+        if self.limit is not None and self.tried >= self.limit:
+            return f'limit of {self.limit} candidates'
+        return f'timeout of {settings.MN_TIMEOUT}s'
+
@@ -0,0 +1,305 @@
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from typing import BinaryIO, Optional, Union
+
+from .budget import Budget, BudgetExceeded, CancelToken
+from .interpreter import Interpreter, Message
+from . import syntax
+
+# A long running interpreter answering JSON-RPC 2.0 requests, one JSON object a
+# line, on its standard input and output or on every connection to a Unix socket:
+#
+#   rfpl serve [--preload MODULE ...] [--socket PATH]
+#
+# The methods take their params by name:
+#   report(line)           any command, as the interactive session takes it
+#   define(line)           report, for a line that defines a function
+#   evaluate(line)         report, for a line that evaluates an expression
+#   load(module)
+#   call(symbol, args)     symbol on args: ints, null (undefined) and lists of them
+#   open()                 a new session, its id
+#   close(session)
+# Each answers {ok, messages}, the messages as Message.asdict gives them (open
+# answers {session}). All of them but open and close take an optional session,
+# and an optional budget {steps, naturals, bits, seconds} (see budget.py) for
+# the request alone.
+#
+# Every connection has its own copy of the interpreter with the preloaded
+# modules, and every session is a copy of the interpreter of its connection
+# when it was opened. Where fork is available both are forked processes, which
+# share what the interpreter had loaded copy on write; elsewhere (no Unix
+# sockets either) a session makes a new interpreter and replays the history.
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+FORK = hasattr(os, 'fork')
+BUDGET = ('steps', 'naturals', 'bits', 'seconds')
+# the lines each method takes
+KINDS = {'define': syntax.Define, 'evaluate': syntax.Examine, 'load': syntax.Load}
+
+
+class RequestError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+def check(params: dict, name: str, typ: type, optional: bool = False):
+    value = params.get(name)
+    if value is None and optional:
+        return None
+    if not isinstance(value, typ):
+        raise RequestError(INVALID_PARAMS, f'Expected {typ.__name__} {name}')
+    return value
+
+
+def argument(value):
+    # an argument of call as batch.natural takes it
+    if isinstance(value, list):
+        return [argument(ent) for ent in value]
+    if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+        raise RequestError(INVALID_PARAMS, f'Arguments are naturals, null or lists, not {json.dumps(value)}')
+    return value
+
+
+class ForkedSession:
+    # a child process with a copy of the interpreter, answering the requests
+    # written to it on a socket
+    def __init__(self, handler: 'Handler'):
+        ours, theirs = socket.socketpair()
+        # what was buffered would be written twice
+        sys.stdout.flush()
+        self.pid = os.fork()
+        if self.pid == 0:
+            ours.close()
+            # the child must not keep the other sessions from seeing their ends close
+            for session in handler.sessions.values():
+                session.detach()
+            handler.sessions = {}
+            try:
+                with theirs, theirs.makefile('rb') as rfile, theirs.makefile('wb') as wfile:
+                    handler.serve(rfile, wfile)
+            finally:
+                os._exit(0)
+        theirs.close()
+        self.sock = ours
+        self.rfile = ours.makefile('rb')
+        self.wfile = ours.makefile('wb')
+
+    def answer(self, request: dict) -> Optional[dict]:
+        self.wfile.write(json.dumps(request).encode() + b'\n')
+        self.wfile.flush()
+        if 'id' not in request:
+            return None
+        line = self.rfile.readline()
+        if not line:
+            raise RequestError(INTERNAL_ERROR, 'The session ended')
+        return json.loads(line)
+
+    def detach(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.sock.close()
+
+    def close(self):
+        self.detach()
+        os.waitpid(self.pid, 0)
+
+
+class ReplayedSession:
+    # a new interpreter in this process, with the history of the original
+    def __init__(self, handler: 'Handler'):
+        intr = Interpreter()
+        for line in handler.intr.history:
+            intr.report(line)
+        self.handler = Handler(intr)
+
+    def answer(self, request: dict) -> Optional[dict]:
+        return self.handler.answer(request)
+
+    def close(self):
+        pass
+
+
+class Handler:
+    # the requests of one connection, on one interpreter
+    def __init__(self, intr: Interpreter):
+        self.intr = intr
+        self.sessions: dict[int, Union[ForkedSession, ReplayedSession]] = {}
+        self.next_session = 1
+
+    def serve(self, rfile: BinaryIO, wfile: BinaryIO):
+        try:
+            for line in rfile:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError as exc:
+                    response = self.error(None, RequestError(PARSE_ERROR, str(exc)))
+                else:
+                    response = self.answer(request)
+                if response is not None:
+                    wfile.write(json.dumps(response).encode() + b'\n')
+                    wfile.flush()
+        finally:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
+    def error(self, ident, exc: RequestError) -> dict:
+        return {'jsonrpc': '2.0', 'id': ident, 'error': {'code': exc.code, 'message': str(exc)}}
+
+    def answer(self, request) -> Optional[dict]:
+        # the response to request, None for a notification
+        if not isinstance(request, dict):
+            return self.error(None, RequestError(INVALID_REQUEST, 'Expected an object'))
+        ident = request.get('id')
+        try:
+            method = request.get('method')
+            params = request.get('params', {})
+            if not isinstance(method, str):
+                raise RequestError(INVALID_REQUEST, 'Expected a method')
+            if not isinstance(params, dict):
+                raise RequestError(INVALID_PARAMS, 'Expected params by name')
+            if params.get('session') is not None and method != 'close':
+                params = dict(params)
+                session = self.session(params.pop('session'))
+                return session.answer({**request, 'params': params})
+            result = self.dispatch(method, params)
+        except RequestError as exc:
+            return self.error(ident, exc)
+        except Exception as exc:
+            return self.error(ident, RequestError(INTERNAL_ERROR, f'{type(exc).__name__}: {exc}'))
+        if 'id' not in request:
+            return None
+        return {'jsonrpc': '2.0', 'id': ident, 'result': result}
+
+    def session(self, ident) -> Union[ForkedSession, ReplayedSession]:
+        session = self.sessions.get(ident) if isinstance(ident, int) else None
+        if session is None:
+            raise RequestError(INVALID_PARAMS, f'No session {json.dumps(ident)}')
+        return session
+
+    def dispatch(self, method: str, params: dict) -> dict:
+        if method == 'open':
+            ident = self.next_session
+            self.next_session += 1
+            self.sessions[ident] = ForkedSession(self) if FORK else ReplayedSession(self)
+            return {'session': ident}
+        if method == 'close':
+            self.session(params.get('session'))
+            self.sessions.pop(params['session']).close()
+            return {}
+        if method in ('report', 'define', 'evaluate'):
+            line = check(params, 'line', str)
+            return self.report(line, params, method)
+        if method == 'load':
+            module = check(params, 'module', str)
+            return self.report(f'load {module}', params, method)
+        if method == 'call':
+            symbol = check(params, 'symbol', str)
+            args = argument(check(params, 'args', list))
+            return self.call(symbol, args, params)
+        raise RequestError(METHOD_NOT_FOUND, f'No method {method}')
+
+    def budget(self, params: dict) -> tuple[Optional[Budget], Optional[threading.Timer]]:
+        # the budget of a request, and the timer that cancels it after its seconds
+        spec = check(params, 'budget', dict, optional=True)
+        if spec is None:
+            return None, None
+        for name, value in spec.items():
+            if name not in BUDGET:
+                raise RequestError(INVALID_PARAMS, f'No budget of {name}, there are {", ".join(BUDGET)}')
+            if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0):
+                raise RequestError(INVALID_PARAMS, f'Expected a budget of {name} that is not negative')
+        timer = None
+        token = None
+        if spec.get('seconds') is not None:
+            token = CancelToken()
+            timer = threading.Timer(spec['seconds'], token.cancel)
+        budget = Budget(steps=spec.get('steps'), naturals=spec.get('naturals'), bits=spec.get('bits'), token=token)
+        return budget, timer
+
+    def report(self, line: str, params: dict, method: str) -> dict:
+        try:
+            statement = syntax.Statement(line, tree=syntax.parse(line))
+        except syntax.ParseError as exc:
+            statement = syntax.Statement(line, error=exc)
+        kind = KINDS.get(method)
+        if kind is not None and statement.tree is not None and not isinstance(statement.tree, kind):
+            raise RequestError(INVALID_PARAMS, f'Expected a line to {method}, not "{line}"')
+        budget, timer = self.budget(params)
+        if timer is not None:
+            timer.start()
+        try:
+            ok, messages = self.intr.report(line, budget=budget, statement=statement)
+        finally:
+            if timer is not None:
+                timer.cancel()
+        return {'ok': ok, 'messages': [msg.asdict() for msg in messages]}
+
+    def call(self, symbol: str, args: list, params: dict) -> dict:
+        budget, timer = self.budget(params)
+        if timer is not None:
+            timer.start()
+        try:
+            result = next(self.intr.call_many(symbol, [args], budget))
+            result.normalize()
+            messages = [Message.natural(result)]
+            ok = True
+        except BudgetExceeded as exc:
+            messages = [Message.limit(exc)]
+            ok = False
+        except Exception as exc:
+            messages = [Message.error(str(exc))]
+            ok = False
+        finally:
+            if timer is not None:
+                timer.cancel()
+        return {'ok': ok, 'messages': [msg.asdict() for msg in messages]}
+
+
+class UnixServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def preload(intr: Interpreter, modules: list[str]):
+    for module in modules:
+        ok, messages = intr.report(f'load {module}')
+        if not ok:
+            raise Exception(f'Unable to load {module}: {[msg.message for msg in messages]}')
+
+
+def serve(intr: Interpreter, path: str = None):
+    # on the standard input and output, or on the Unix socket at path
+    if path is None:
+        Handler(intr).serve(sys.stdin.buffer, sys.stdout.buffer)
+        return
+    if not FORK:
+        raise Exception('Serving on a Unix socket needs fork')
+
+    class Connection(socketserver.StreamRequestHandler):
+        def handle(self):
+            Handler(intr).serve(self.rfile, self.wfile)
+
+    if os.path.exists(path):
+        os.unlink(path)
+    # remove the socket when terminated as well, but not from the forked processes
+    pid = os.getpid()
+    signal.signal(signal.SIGTERM, lambda *_ : sys.exit(0))
+    with UnixServer(path, Connection) as server:
+        try:
+            server.serve_forever()
+        finally:
+            if os.getpid() == pid:
+                os.unlink(path)
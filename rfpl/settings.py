@@ -3,4 +3,40 @@
 # 2 = debug information
 VERBOSE = 1
 
-CACHE = False
+# memoize calls of rfpl functions (see cache.py)
+CACHE = True
+CACHE_SIZE = 100000
+CACHE_FUNCTION_SIZE = 10000
+
+# replace definitions of recognized arithmetic with native operations (see recognize.py)
+RECOGNIZE = True
+
+# budget of a single Mn search: the number of candidates and the seconds it may
+# take (None for no bound); when it runs out, Mn is undefined (see search.py)
+MN_LIMIT = None
+MN_TIMEOUT = None
+# assume the predicates of Mn are monotone and search them by bisection
+MN_MONOTONE = False
+
+# evaluate the expensive arguments of Cn on this many worker processes (None
+# for off), an argument is expensive when its last evaluation took more than
+# PARALLEL_THRESHOLD seconds (see parallel.py)
+PARALLEL_WORKERS = None
+PARALLEL_THRESHOLD = 0.05
+
+# save loaded .rfpl modules parsed and type checked to __pycache__/<name>.rfplc,
+# and load them from there while their sources do not change (see rfplc.py)
+MODULE_CACHE = True
+
+# a file (a path or an open file) to write the metrics of each line given to
+# Interpreter.report to, as one line of JSON (see metrics.py); None for off
+METRICS = None
+
+# a prime table saved by `python -m rfpl.primes`, mapped when more primes are needed
+PRIME_TABLE = None
+
+# 'compile' evaluates the compiled node trees (see compiler.py)
+# 'walk' re-walks the parse trees, kept for comparison
+# 'stack' evaluates the compiled node trees on an explicit stack (see stackeval.py),
+#   so deep programs do not depend on the Python recursion limit
+ENGINE = 'compile'
@@ -0,0 +1,218 @@
+import sys
+
+from .budget import Budget
+from .compiler import (BracketNode, CnNode, ConstantNode, IdentityNode, LazyNode,
+                       LeafNode, MnNode, Node, PrNode)
+from .natural import Natural, NaturalList
+from .symbol import BaseList
+from . import settings
+
+# An evaluator for compiled nodes that keeps its work on an explicit stack of
+# generator frames instead of the Python call stack. A frame yields either a
+# sub-frame to evaluate (and receives its value back), a Natural that is already
+# known, or a Tail that replaces the frame itself. The Python stack depth stays
+# constant no matter how deep the RFPL program goes; only Python builtins (rfpy
+# functions) that force their arguments or call their bases nest a new run.
+
+
+class Tail:
+    __slots__ = ('frame',)
+
+    def __init__(self, frame):
+        self.frame = frame
+
+
+class Thunk:
+    # the stack machine's version of a lazy value; the machine forces it on its
+    # own stack, anyone else forces it through Natural.normalize
+    __slots__ = ('machine', 'node', 'blist', 'args')
+
+    def __init__(self, machine: 'StackMachine', node: Node, blist: BaseList, args: NaturalList):
+        self.machine = machine
+        self.node = node
+        self.blist = blist
+        self.args = args
+
+    def __call__(self):
+        return self.machine.run(self.node, self.blist, self.args)
+
+
+class StackMachine:
+    SAMPLE_EVERY = 1024
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.frames = {
+            LazyNode: self.lazy,
+            LeafNode: self.leaf,
+            BracketNode: self.bracket,
+            IdentityNode: self.identity,
+            ConstantNode: self.constant,
+            CnNode: self.cn,
+            PrNode: self.pr,
+            MnNode: self.mn,
+        }
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.peak_depth = 0
+        self.pushes = 0
+        self.sampled_bytes = 0
+        self.samples = 0
+
+    def frame_bytes(self):
+        # average size of a frame (generator object and its Python frame)
+        if not self.samples:
+            return 0
+        return self.sampled_bytes // self.samples
+
+    def stats(self) -> str:
+        return f'peak depth {self.peak_depth} frames, ~{self.frame_bytes()} bytes/frame'
+
+    def frame(self, node: Node, blist: BaseList, args: NaturalList):
+        return self.frames[type(node)](node, blist, args)
+
+    def run(self, node: Node, blist: BaseList, args: NaturalList) -> Natural:
+        value = self.frame(node, blist, args)
+        if isinstance(value, Natural):
+            return value
+        stack = [value]
+        value = None
+        while stack:
+            try:
+                req = stack[-1].send(value)
+            except StopIteration as stop:
+                stack.pop()
+                value = stop.value
+                continue
+            if isinstance(req, Tail):
+                req = req.frame
+                if isinstance(req, Natural):
+                    stack.pop()
+                    value = req
+                    continue
+                stack[-1] = req
+                value = None
+                continue
+            if isinstance(req, Natural):
+                value = req
+                continue
+            stack.append(req)
+            value = None
+            self.pushes += 1
+            if len(stack) > self.peak_depth:
+                self.peak_depth = len(stack)
+            if self.pushes % self.SAMPLE_EVERY == 0:
+                self.sampled_bytes += sys.getsizeof(req) + sys.getsizeof(req.gi_frame)
+                self.samples += 1
+        return value
+
+    def force(self, nat: Natural):
+        while (thunk := nat.pending()) is not None:
+            if isinstance(thunk, Thunk):
+                nat.fill((yield self.frame(thunk.node, thunk.blist, thunk.args)))
+            else:
+                nat.normalize()
+        return nat
+
+    def lazy(self, node: LazyNode, blist, args):
+        return Natural(Thunk(self, node.inner, blist, args.copy()))
+
+    def identity(self, node: IdentityNode, blist, args):
+        return args[node.number]
+
+    def constant(self, node: ConstantNode, blist, args):
+        return node.natural
+
+    def bracket(self, node: BracketNode, blist, args):
+        return self.frame(blist.args[node.number].c_node, blist.prev, args)
+
+    def leaf(self, node: LeafNode, blist, args):
+        syment = node.syment
+        bnxt = None
+        if node.bases is not None:
+            bnxt = BaseList(node.bases, blist if node.chained else None)
+        if syment.fexpr is not None and syment.native is None:
+            if Budget.local.active is not None:
+                Budget.local.active.step()
+            key, result = self.interpreter.cache.lookup(syment, bnxt, args)
+            if result is not None:
+                return result
+            if key is not None:
+                return self.cached_call(syment, bnxt, args, key)
+            return self.frame(syment.fexpr.c_node, bnxt, args)
+        if syment.strict:
+            return self.strict_call(syment, bnxt, args)
+        return syment.call(bnxt, args)
+
+    def cached_call(self, syment, bnxt, args, key):
+        result = yield self.frame(syment.fexpr.c_node, bnxt, args)
+        self.interpreter.cache.store(key, result, args)
+        return result
+
+    def strict_call(self, syment, bnxt, args):
+        # force the arguments here, so the builtin does not force them recursively;
+        # in its order and only up to an undefined one, as the builtin would
+        for i in syment.strict:
+            if i >= len(args):
+                break
+            if args[i].pending() is not None:
+                yield self.force(args[i])
+            if not args[i].is_defined():
+                break
+        return syment.call(bnxt, args)
+
+    def cn(self, node: CnNode, blist, args):
+        if node.parallel is not None and settings.PARALLEL_WORKERS:
+            # the arguments that stay in the process nest a run each
+            fargs = node.parallel.pool.arguments(node, blist, args, self.run)
+        else:
+            fargs = []
+            for g in node.gs:
+                fargs.append((yield self.frame(g, blist, args)))
+        if node.rest is not None:
+            fargs.extend(args.content[node.rest:])
+        yield Tail(self.frame(node.h, blist, NaturalList(fargs)))
+
+    def pr(self, node: PrNode, blist, args):
+        g = node.g
+        if args[0].pending() is not None:
+            yield self.force(args[0])
+        n = int(args[0])
+        args = args.drop(1)
+        cur = yield self.frame(node.h, blist, args)
+        args = NaturalList([Natural(None), Natural(None)]) + args
+        step = node.step
+        if step is not None and n > 1:
+            values = []
+            for inv in step.invariants:
+                values.append((yield self.frame(inv, blist, args)))
+            skipped = step.skip(cur, n - 1, values)
+            if skipped is not None:
+                args[0] = skipped
+                args[1] = Natural(n - 1)
+                yield Tail(self.frame(g, blist, args))
+        for i in range(n):
+            if Budget.local.active is not None:
+                Budget.local.active.step()
+            args[0] = cur
+            args[1] = Natural(i)
+            prv, cur = cur, (yield self.frame(g, blist, args))
+            if step is not None and (key := cur.key()) is not None and key == prv.key():
+                break
+        return cur
+
+    def mn(self, node: MnNode, blist, args):
+        h = node.h
+        search = node.search.search(node.root, blist, args)
+        hargs = NaturalList([Natural(None)]) + args
+        try:
+            cand = next(search)
+            while True:
+                hargs[0] = Natural(cand)
+                result = yield self.frame(h, blist, hargs)
+                if result.pending() is not None:
+                    yield self.force(result)
+                cand = search.send(result)
+        except StopIteration as stop:
+            return stop.value
@@ -4,11 +4,11 @@ from dataclasses import dataclass, field
 from collections.abc import Callable
 
 from .natural import Natural, NaturalList
-from .RFPLParser import RFPLParser
+from .syntax import Fexpr
 
 @dataclass
 class BaseList:
-    args: list[RFPLParser.FexprContext]
+    args: list[Fexpr]
     prev: 'BaseList' = None
 
 
@@ -34,4 +34,11 @@ class SymbolEntry:
     builtin: bool = False
     ix: int = -1
     ftype: FunctionType = field(default_factory=FunctionType)
+    # the body of a function defined in rfpl, None for python functions
+    fexpr: Fexpr = None
+    # a strict python function forces the arguments at these indices, in this
+    # order, and returns Undefined at the first one that is undefined
+    strict: tuple[int, ...] = ()
+    # the native operation that replaced the call of an rfpl function (see recognize.py)
+    native: str = None
 
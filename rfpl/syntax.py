@@ -0,0 +1,474 @@
+import re
+from collections.abc import Iterable, Iterator
+from typing import Optional, Union
+
+# A lexer and a recursive descent parser for RFPL.g4, without the antlr4
+# runtime. Lines parse into a small tree of the classes below; every node
+# knows the character span it came from (start and stop, inclusive, like the
+# tokens of ANTLR) for the error messages, and its text without whitespace.
+#
+# The first syntax error stops the parse with a ParseError at the offending
+# token. ParseError.at_eof tells an incomplete line from a wrong one.
+
+# the token types, named after the lexer rules of the grammar; the literal
+# tokens of the parser rules are their own type
+LAZY = 'Lazy'
+NUMBER = 'Number'
+SYMBOL = 'Symbol'
+COMMENT = 'Comment'
+WHITESPACE = 'Whitespace'
+UNKNOWN = 'Unknown'
+EOF = 'EOF'
+
+KEYWORDS = {'load', 'Cn', 'Pr', 'Mn', '_'}
+PATTERN = re.compile(r'''
+    (?P<Whitespace>[ \t\r\n]+)
+  | (?P<Comment>;[^\n]*)
+  | (?P<Number>[0-9]+)
+  | (?P<Symbol>[-a-zA-Z_][-a-zA-Z0-9_]*)
+  | (?P<Literal>\.\.|[.=,\[\]!#@()<>~])
+  | (?P<Unknown>.)
+''', re.VERBOSE | re.DOTALL)
+
+
+class Token:
+    __slots__ = ('type', 'text', 'start', 'stop')
+
+    def __init__(self, type: str, text: str, start: int, stop: int):
+        self.type = type
+        self.text = text
+        self.start = start
+        self.stop = stop
+
+    def __repr__(self):
+        return f'Token({self.type}, {self.text!r}, {self.start})'
+
+    def __reduce__(self):
+        # pickled by the module cache (see rfplc.py), faster than the slots
+        return Token, (self.type, self.text, self.start, self.stop)
+
+
+def scan(text: str, hidden: bool = False, offset: int = 0) -> Iterator[Token]:
+    # the tokens of text, without EOF, at positions shifted by offset; with
+    # hidden, whitespace and comments are kept (for highlighting)
+    for match in PATTERN.finditer(text):
+        kind = match.lastgroup
+        word = match.group()
+        if kind in (WHITESPACE, COMMENT) and not hidden:
+            continue
+        if kind == 'Literal':
+            kind = LAZY if word == '~' else word
+        elif kind == SYMBOL and word in KEYWORDS:
+            kind = word
+        yield Token(kind, word, match.start() + offset, match.end() - 1 + offset)
+
+
+def end_of(length: int) -> Token:
+    return Token(EOF, '<EOF>', length, length - 1)
+
+
+def tokenize(text: str, hidden: bool = False) -> list[Token]:
+    tokens = list(scan(text, hidden))
+    tokens.append(end_of(len(text)))
+    return tokens
+
+
+class ParseError(Exception):
+    def __init__(self, message: str, token: Token):
+        super().__init__(message)
+        self.message = message
+        self.token = token
+        self.start = token.start
+        self.stop = token.stop
+        self.at_eof = token.type == EOF
+
+
+class Syntax:
+    __slots__ = ('tokens', 'first', 'last')
+
+    def __init__(self, tokens: list[Token], first: int, last: int):
+        # the node spans tokens[first..last]
+        self.tokens = tokens
+        self.first = first
+        self.last = last
+
+    @property
+    def start(self) -> int:
+        return self.tokens[self.first].start
+
+    @property
+    def stop(self) -> int:
+        return self.tokens[self.last].stop
+
+    def getText(self) -> str:
+        return ''.join(tok.text for tok in self.tokens[self.first:self.last + 1])
+
+
+class Fexpr(Syntax):
+    # c_ftype is set by Interpreter.preprocess, c_node by Compiler.compile
+    __slots__ = ('lazy', 'c_ftype', 'c_node')
+
+    def __init__(self, tokens, first, last, lazy: bool = False):
+        super().__init__(tokens, first, last)
+        self.lazy = lazy
+        self.c_ftype = None
+        self.c_node = None
+
+
+class Leaf(Fexpr):
+    __slots__ = ('symbol', 'bases', 'c_syment')
+
+    def __init__(self, tokens, first, last, lazy, symbol: Token, bases: Optional[list[Fexpr]]):
+        super().__init__(tokens, first, last, lazy)
+        self.symbol = symbol
+        self.bases = bases
+        self.c_syment = None
+
+
+class Cn(Fexpr):
+    __slots__ = ('h', 'gs', 'rest')
+
+    def __init__(self, tokens, first, last, lazy, h: Fexpr, gs: list[Fexpr], rest: Optional[int]):
+        super().__init__(tokens, first, last, lazy)
+        self.h = h
+        self.gs = gs
+        # Cn[h, g0, ..., !rest..] passes the arguments from rest on after the gs
+        self.rest = rest
+
+
+class Pr(Fexpr):
+    __slots__ = ('h', 'g')
+
+    def __init__(self, tokens, first, last, lazy, h: Fexpr, g: Fexpr):
+        super().__init__(tokens, first, last, lazy)
+        self.h = h
+        self.g = g
+
+
+class Mn(Fexpr):
+    __slots__ = ('h',)
+
+    def __init__(self, tokens, first, last, lazy, h: Fexpr):
+        super().__init__(tokens, first, last, lazy)
+        self.h = h
+
+
+class Identity(Fexpr):
+    __slots__ = ('number',)
+
+    def __init__(self, tokens, first, last, number: int):
+        super().__init__(tokens, first, last)
+        self.number = number
+
+
+class Constant(Fexpr):
+    __slots__ = ('literal', 'c_natural')
+
+    def __init__(self, tokens, first, last, literal: 'Literal'):
+        super().__init__(tokens, first, last)
+        self.literal = literal
+        self.c_natural = None
+
+
+class Bracket(Fexpr):
+    __slots__ = ('number',)
+
+    def __init__(self, tokens, first, last, lazy, number: int):
+        super().__init__(tokens, first, last, lazy)
+        self.number = number
+
+
+class Literal(Syntax):
+    # a natural written out: an int, None for _, or a list of Literals
+    __slots__ = ('value',)
+
+    def __init__(self, tokens, first, last, value: Union[int, None, list['Literal']]):
+        super().__init__(tokens, first, last)
+        self.value = value
+
+
+class Call(Syntax):
+    __slots__ = ('fexpr', 'args')
+
+    def __init__(self, tokens, first, last, fexpr: Fexpr, args: list['Nexpr']):
+        super().__init__(tokens, first, last)
+        self.fexpr = fexpr
+        self.args = args
+
+
+Nexpr = Union[Call, Literal]
+
+
+class Define(Syntax):
+    __slots__ = ('symbol', 'fexpr')
+
+    def __init__(self, tokens, first, last, symbol: Token, fexpr: Fexpr):
+        super().__init__(tokens, first, last)
+        self.symbol = symbol
+        self.fexpr = fexpr
+
+
+class Examine(Syntax):
+    __slots__ = ('nexpr',)
+
+    def __init__(self, tokens, first, last, nexpr: Nexpr):
+        super().__init__(tokens, first, last)
+        self.nexpr = nexpr
+
+
+class Load(Syntax):
+    __slots__ = ('module',)
+
+    def __init__(self, tokens, first, last, module: str):
+        super().__init__(tokens, first, last)
+        self.module = module
+
+
+Line = Union[Define, Examine, Load]
+
+FEXPR_START = (SYMBOL, LAZY, 'Cn', 'Pr', 'Mn', '!', '#', '@')
+NATURAL_START = (NUMBER, '<', '_')
+
+
+def expecting(types) -> str:
+    names = [t if t in (NUMBER, SYMBOL, LAZY, EOF) else f"'{t}'" for t in types]
+    if len(names) == 1:
+        return names[0]
+    return '{' + ', '.join(names) + '}'
+
+
+class Parser:
+    def __init__(self, tokens: list[Token]):
+        # tokens ends with EOF
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self, ahead: int = 0) -> Token:
+        return self.tokens[min(self.pos + ahead, len(self.tokens) - 1)]
+
+    def at(self, *types) -> bool:
+        return self.peek().type in types
+
+    def error(self, types):
+        tok = self.peek()
+        raise ParseError(f"mismatched input '{tok.text}' expecting {expecting(types)}", tok)
+
+    def more(self) -> bool:
+        # whether a list of fexprs goes on after a ','; as with ANTLR, a ','
+        # followed by something else (or by the !n.. of Cn) ends the list, so
+        # an error is reported at the ',' (but a line ending in it is incomplete)
+        if not self.at(','):
+            return False
+        after = self.peek(1).type
+        if after == '!':
+            return self.peek(2).type in (NUMBER, EOF) and self.peek(3).type != '..'
+        return after in FEXPR_START or after == EOF
+
+    def expect(self, *types) -> Token:
+        if not self.at(*types):
+            self.error(types)
+        tok = self.peek()
+        self.pos += 1
+        return tok
+
+    def singleline(self) -> Optional[Line]:
+        if self.at(EOF):
+            return None
+        line = self.line()
+        self.expect(EOF)
+        return line
+
+    def line(self) -> Line:
+        first = self.pos
+        if self.at('load'):
+            self.pos += 1
+            module = [self.expect(SYMBOL).text]
+            while self.at('.'):
+                self.pos += 1
+                module.append(self.expect(SYMBOL).text)
+            return Load(self.tokens, first, self.pos - 1, '.'.join(module))
+        if self.at(SYMBOL) and self.peek(1).type == '=':
+            symbol = self.expect(SYMBOL)
+            self.pos += 1
+            fexpr = self.fexpr()
+            return Define(self.tokens, first, self.pos - 1, symbol, fexpr)
+        if self.at(*FEXPR_START, *NATURAL_START):
+            nexpr = self.nexpr()
+            return Examine(self.tokens, first, self.pos - 1, nexpr)
+        self.error(('load', *FEXPR_START, *NATURAL_START))
+
+    def fexpr(self) -> Fexpr:
+        first = self.pos
+        lazy = self.at(LAZY)
+        if lazy:
+            self.pos += 1
+            if not self.at(SYMBOL, 'Cn', 'Pr', 'Mn', '@'):
+                self.error((SYMBOL, 'Cn', 'Pr', 'Mn', '@'))
+        tok = self.peek()
+        if tok.type == SYMBOL:
+            self.pos += 1
+            bases = None
+            if self.at('['):
+                self.pos += 1
+                bases = self.fexprlist()
+                self.expect(']')
+            return Leaf(self.tokens, first, self.pos - 1, lazy, tok, bases)
+        if tok.type == 'Cn':
+            self.pos += 1
+            self.expect('[')
+            h = self.fexpr()
+            gs = []
+            rest = None
+            while self.more():
+                self.pos += 1
+                gs.append(self.fexpr())
+            if self.at(','):
+                self.pos += 1
+                self.expect('!')
+                rest = int(self.expect(NUMBER).text)
+                self.expect('..')
+            self.expect(']')
+            return Cn(self.tokens, first, self.pos - 1, lazy, h, gs, rest)
+        if tok.type == 'Pr':
+            self.pos += 1
+            self.expect('[')
+            h = self.fexpr()
+            self.expect(',')
+            g = self.fexpr()
+            self.expect(']')
+            return Pr(self.tokens, first, self.pos - 1, lazy, h, g)
+        if tok.type == 'Mn':
+            self.pos += 1
+            self.expect('[')
+            h = self.fexpr()
+            self.expect(']')
+            return Mn(self.tokens, first, self.pos - 1, lazy, h)
+        if tok.type == '@':
+            self.pos += 1
+            number = int(self.expect(NUMBER).text)
+            return Bracket(self.tokens, first, self.pos - 1, lazy, number)
+        if tok.type == '!':
+            self.pos += 1
+            number = int(self.expect(NUMBER).text)
+            return Identity(self.tokens, first, self.pos - 1, number)
+        if tok.type == '#':
+            self.pos += 1
+            literal = self.natural()
+            return Constant(self.tokens, first, self.pos - 1, literal)
+        self.error(FEXPR_START)
+
+    def fexprlist(self) -> list[Fexpr]:
+        fexprs = [self.fexpr()]
+        while self.more():
+            self.pos += 1
+            fexprs.append(self.fexpr())
+        return fexprs
+
+    def nexpr(self) -> Nexpr:
+        if self.at(*NATURAL_START):
+            return self.natural()
+        first = self.pos
+        fexpr = self.fexpr()
+        self.expect('(')
+        args = []
+        if not self.at(')'):
+            args.append(self.nexpr())
+            while self.at(','):
+                self.pos += 1
+                args.append(self.nexpr())
+        self.expect(')')
+        return Call(self.tokens, first, self.pos - 1, fexpr, args)
+
+    def natural(self) -> Literal:
+        first = self.pos
+        tok = self.expect(*NATURAL_START)
+        if tok.type == NUMBER:
+            return Literal(self.tokens, first, first, int(tok.text))
+        if tok.type == '_':
+            return Literal(self.tokens, first, first, None)
+        entries = []
+        if not self.at('>'):
+            entries.append(self.natural())
+            while self.at(','):
+                self.pos += 1
+                entries.append(self.natural())
+        self.expect('>')
+        return Literal(self.tokens, first, self.pos - 1, entries)
+
+
+def parse(text: str) -> Optional[Line]:
+    # the line in text, None for an empty line; raises ParseError
+    return Parser(tokenize(text)).singleline()
+
+
+class Statement:
+    # a command of a module: its lines without comments joined by spaces, and
+    # either its line or the error that stopped its parse
+    __slots__ = ('text', 'tree', 'error', 'link')
+
+    def __init__(self, text: str, tree: Optional[Line] = None, error: Optional[ParseError] = None):
+        self.text = text
+        self.tree = tree
+        self.error = error
+        # the saved types of a definition loaded from the module cache (see rfplc.py)
+        self.link = None
+
+
+OPENING = {'[', '(', '<'}
+CLOSING = {']', ')', '>'}
+# a line ending in one of these never ends a command
+CONTINUING = {'=', ',', '.', '..', LAZY, '!', '#', '@', 'load', 'Cn', 'Pr', 'Mn'}
+
+
+def statements(lines: Iterable[str]) -> Iterator[Statement]:
+    # the commands of a module, a command taking as many lines as it needs to
+    # parse. Each line is tokenized once, and a command is only parsed at the
+    # end of a line outside of all brackets, so loading takes linear time
+    # (as long as commands are not split outside of brackets after a symbol)
+    pieces = []
+    tokens = []
+    length = 0
+    depth = 0
+    for line in lines:
+        line = line.strip()
+        offset = length + 1 if pieces else 0
+        first = len(tokens)
+        for tok in scan(line, hidden=True, offset=offset):
+            if tok.type == COMMENT:
+                # the text of a command leaves out the comments, which would run
+                # to its end once its lines are joined
+                line = line[:tok.start - offset].rstrip()
+                break
+            if tok.type != WHITESPACE:
+                tokens.append(tok)
+        if len(tokens) == first and not pieces:
+            # nothing but whitespace and comments
+            continue
+        pieces.append(line)
+        length = offset + len(line)
+        for tok in tokens[first:]:
+            if tok.type in OPENING:
+                depth += 1
+            elif tok.type in CLOSING and depth > 0:
+                depth -= 1
+        if depth > 0 or tokens[-1].type in CONTINUING:
+            continue
+        tokens.append(end_of(length))
+        try:
+            statement = Statement(' '.join(pieces), tree=Parser(tokens).singleline())
+        except ParseError as exc:
+            if exc.at_eof:
+                tokens.pop()
+                continue
+            statement = Statement(' '.join(pieces), error=exc)
+        yield statement
+        pieces = []
+        tokens = []
+        length = 0
+    if pieces:
+        # the module ends in the middle of a command
+        tokens.append(end_of(length))
+        try:
+            yield Statement(' '.join(pieces), tree=Parser(tokens).singleline())
+        except ParseError as exc:
+            yield Statement(' '.join(pieces), error=exc)
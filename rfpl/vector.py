@@ -0,0 +1,322 @@
+import itertools
+import operator
+import weakref
+from array import array
+from typing import Optional, Union
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The entries of a list Natural, as a persistent vector: a trie of WIDTH-ary
+# nodes whose leaves hold the entries. Vectors never change; set, append and
+# truncate copy the path to the changed leaf and share everything else, so
+# they take O(log n).
+#
+# Nodes are hash-consed like the Naturals: a node with the same items as a
+# living node is that node, and it carries a serial. The serial of the root is
+# then a key of the whole vector computed in O(log n) for every new version. A
+# node with a lazy entry that is not forced yet has no serial until it is.
+#
+# A leaf whose entries are all ints below 2**63 holds them unboxed in an
+# array('q'), 8 bytes an entry, and boxes them into Naturals when they are
+# read. Leaves are compacted whenever they are made, and go back to a tuple of
+# Naturals only when a list or a thunk is put in them.
+#
+# Mul and Pow of whole lists run on the flat arrays of the exponents, with
+# numpy if it is installed. When a result might not fit in int64 they return
+# None and Natural falls back to adding the entries one by one.
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+LIMIT = 1 << 63
+
+nodes: weakref.WeakValueDictionary[tuple, 'Node'] = weakref.WeakValueDictionary()
+serials = itertools.count()
+
+
+class Node:
+    __slots__ = ('items', 'serial', '__weakref__')
+
+    def __init__(self, items: Union[tuple, array]):
+        # the entries in a leaf (shift 0), the child nodes otherwise
+        self.items = items
+        self.serial = None
+
+
+def unboxed(item) -> Optional[int]:
+    # the entry as an int for a compact leaf, if it can be one
+    num = item.key()
+    if type(num) is int and num < LIMIT:
+        return num
+    return None
+
+
+def box(num: int):
+    return natural.Natural(num)
+
+
+def boxed(items: Union[tuple, array]) -> tuple:
+    if type(items) is array:
+        return tuple(map(box, items))
+    return items
+
+
+def compact(items: tuple) -> Optional[array]:
+    nums = array('q')
+    for item in items:
+        if (num := unboxed(item)) is None:
+            return None
+        nums.append(num)
+    return nums
+
+
+def content_key(shift: int, items: Union[tuple, array]):
+    if type(items) is array:
+        # no boxed leaf is all ints, so no boxed leaf has this key
+        return (0, items.tobytes())
+    key = [shift]
+    for item in items:
+        item_key = item.key() if shift == 0 else serial(item, shift - BITS)
+        if item_key is None:
+            return None
+        key.append(item_key)
+    return tuple(key)
+
+
+def serial(node: Node, shift: int):
+    if node.serial is None:
+        if (key := content_key(shift, node.items)) is None:
+            return None
+        if (found := nodes.get(key)) is None:
+            node.serial = next(serials)
+            nodes[key] = node
+        else:
+            node.serial = found.serial
+    return node.serial
+
+
+def make(shift: int, items: Union[tuple, array]) -> Node:
+    if shift == 0 and type(items) is not array and (nums := compact(items)) is not None:
+        items = nums
+    key = content_key(shift, items)
+    if key is not None and (found := nodes.get(key)) is not None:
+        return found
+    node = Node(items)
+    if key is not None:
+        node.serial = next(serials)
+        nodes[key] = node
+    return node
+
+
+def path(shift: int, item) -> Node:
+    # a branch holding only item, down to the leaves
+    node = make(0, (item,))
+    for level in range(BITS, shift + 1, BITS):
+        node = make(level, (node,))
+    return node
+
+
+class Vector:
+    __slots__ = ('size', 'shift', 'root')
+
+    def __init__(self, size: int, shift: int, root: Node):
+        self.size = size
+        self.shift = shift
+        self.root = root
+
+    @staticmethod
+    def build(items: Union[list, array]) -> 'Vector':
+        # from a list of Naturals, or an array('q') of ints
+        if not items:
+            return EMPTY
+        if type(items) is array:
+            level = [make(0, items[i:i + WIDTH]) for i in range(0, len(items), WIDTH)]
+        else:
+            level = [make(0, tuple(items[i:i + WIDTH])) for i in range(0, len(items), WIDTH)]
+        shift = 0
+        while len(level) > 1:
+            shift += BITS
+            level = [make(shift, tuple(level[i:i + WIDTH])) for i in range(0, len(level), WIDTH)]
+        return Vector(len(items), shift, level[0])
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for items in self.leaves():
+            if type(items) is array:
+                yield from map(box, items)
+            else:
+                yield from items
+
+    def leaves(self):
+        # the items of the leaves, in order
+        if self.size:
+            yield from self.walk(self.root, self.shift)
+
+    def walk(self, node: Node, shift: int):
+        if shift == 0:
+            yield node.items
+        else:
+            for child in node.items:
+                yield from self.walk(child, shift - BITS)
+
+    def ints(self):
+        # int(entry) for each entry, compact leaves need no boxing
+        for items in self.leaves():
+            if type(items) is array:
+                yield from items
+            else:
+                yield from map(int, items)
+
+    def flat(self) -> Optional[array]:
+        # all the entries in one array('q'), if every leaf is compact
+        nums = array('q')
+        for items in self.leaves():
+            if type(items) is not array:
+                return None
+            nums.extend(items)
+        return nums
+
+    def added(self, other: 'Vector') -> Optional['Vector']:
+        # the entrywise sum, other is at least as long
+        a, b = self.flat(), other.flat()
+        if a is None or b is None or (sums := add_ints(a, b)) is None:
+            return None
+        return Vector.build(sums)
+
+    def scaled(self, k: int) -> Optional['Vector']:
+        # every entry times k
+        if (a := self.flat()) is None or (products := scale_ints(a, k)) is None:
+            return None
+        return Vector.build(products)
+
+    def __getitem__(self, i: int):
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        node = self.root
+        for shift in range(self.shift, 0, -BITS):
+            node = node.items[(i >> shift) & MASK]
+        item = node.items[i & MASK]
+        if type(node.items) is array:
+            return box(item)
+        return item
+
+    def last(self):
+        return self[self.size - 1]
+
+    def key(self):
+        # the same for two living vectors exactly when they hold entries of the same keys
+        if not self.size:
+            return (0, None)
+        if (root := serial(self.root, self.shift)) is None:
+            return None
+        return (self.size, root)
+
+    def set(self, i: int, item) -> 'Vector':
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        return Vector(self.size, self.shift, self.assoc(self.root, self.shift, i, item))
+
+    def assoc(self, node: Node, shift: int, i: int, item) -> Node:
+        if shift == 0:
+            if type(node.items) is array and (num := unboxed(item)) is not None:
+                items = array('q', node.items)
+                items[i & MASK] = num
+                return make(0, items)
+            items = list(boxed(node.items))
+            items[i & MASK] = item
+        else:
+            items = list(node.items)
+            ix = (i >> shift) & MASK
+            items[ix] = self.assoc(items[ix], shift - BITS, i, item)
+        return make(shift, tuple(items))
+
+    def append(self, item) -> 'Vector':
+        if not self.size:
+            return Vector(1, 0, make(0, (item,)))
+        if self.size == WIDTH << self.shift:
+            # the trie is full, it grows a level
+            shift = self.shift + BITS
+            return Vector(self.size + 1, shift, make(shift, (self.root, path(self.shift, item))))
+        return Vector(self.size + 1, self.shift, self.push(self.root, self.shift, self.size, item))
+
+    def push(self, node: Node, shift: int, i: int, item) -> Node:
+        if shift == 0:
+            if type(node.items) is array and (num := unboxed(item)) is not None:
+                return make(0, node.items + array('q', (num,)))
+            return make(0, boxed(node.items) + (item,))
+        ix = (i >> shift) & MASK
+        if ix < len(node.items):
+            items = node.items[:ix] + (self.push(node.items[ix], shift - BITS, i, item),)
+        else:
+            items = node.items + (path(shift - BITS, item),)
+        return make(shift, items)
+
+    def truncate(self, size: int) -> 'Vector':
+        # the first size entries
+        if size >= self.size:
+            return self
+        if size <= 0:
+            return EMPTY
+        root, shift = self.root, self.shift
+        while shift > 0 and size <= WIDTH << (shift - BITS):
+            root, shift = root.items[0], shift - BITS
+        return Vector(size, shift, self.prefix(root, shift, size))
+
+    def prefix(self, node: Node, shift: int, size: int) -> Node:
+        if shift == 0:
+            return node if size == len(node.items) else make(0, node.items[:size])
+        width = 1 << shift
+        count = (size + width - 1) >> shift
+        last = self.prefix(node.items[count - 1], shift - BITS, size - (count - 1) * width)
+        if count == len(node.items) and last is node.items[-1]:
+            return node
+        return make(shift, node.items[:count - 1] + (last,))
+
+
+EMPTY = Vector(0, 0, None)
+
+
+def add_ints(a: array, b: array) -> Optional[array]:
+    if not a:
+        return b
+    if numpy is not None:
+        x, y = numpy.frombuffer(a, numpy.int64), numpy.frombuffer(b, numpy.int64)
+        if int(x.max()) + int(y.max()) >= LIMIT:
+            return None
+        sums = y.copy()
+        sums[:len(x)] += x
+        return array('q', sums.tobytes())
+    if max(a) + max(b) >= LIMIT:
+        return None
+    sums = array('q', map(operator.add, a, b))
+    sums.extend(b[len(a):])
+    return sums
+
+
+def scale_ints(a: array, k: int) -> Optional[array]:
+    if not a:
+        return a
+    if numpy is not None:
+        x = numpy.frombuffer(a, numpy.int64)
+        top = int(x.max())
+        if top == 0:
+            return a
+        if top * k >= LIMIT:
+            return None
+        return array('q', (x * k).tobytes())
+    top = max(a)
+    if top == 0:
+        return a
+    if top * k >= LIMIT:
+        return None
+    return array('q', [x * k for x in a])
+
+# natural imports this module
+from . import natural
@@ -3,11 +3,22 @@
 # edge tests are also useful, RFPL is changing rapidly and it would be
 # tedious to manage tests.
 
+import gc
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
 import unittest
+from pathlib import Path
 from typing import Union
 
+from rfpl import primes, rfplc, script, server, settings
+from rfpl.budget import Budget, BudgetExceeded, CancelToken
+from rfpl.compiler import LeafNode, MnNode, PrNode
 from rfpl.interpreter import Interpreter, Message, MessageType
-from rfpl.natural import Natural
+from rfpl.natural import Natural, conversions
 
 class GeneralTestCase(unittest.TestCase):
     def setUp(self):
@@ -41,6 +52,360 @@ class GeneralTestCase(unittest.TestCase):
         self.assertOk('mul = Pr[#0, Cn[add, !0, !2]]')
         self.assertReturns('mul(3, 2)', 6)
     
+    def test_cache(self):
+        self.assertOk('add = Cn[Pr[!0, Cn[S, !0]], !0, !1]')
+        self.assertReturns('add(2, <1>)', 4)
+        self.assertReturns('add(0, <1>)', [1])
+        self.assertReturns('add(2, <1>)', 4)
+        self.assertGreaterEqual(self.intr.cache.hits, 1)
+        self.assertReturns('add(_, 3)', 3)
+
+    def test_recognize(self):
+        self.assertOk('add = Pr[!0, Cn[S, !0]]')
+        self.assertOk('mul = Pr[#0, Cn[add, !2, !0]]')
+        self.assertOk('pow = Pr[#1, Cn[mul, !0, !2]]')
+        self.assertOk('sub1 = Pr[#0, !1]')
+        self.assertOk('sub = Pr[!0, Cn[sub1, !0]]')
+        for symbol in ('add', 'mul', 'pow', 'sub'):
+            self.assertIsNotNone(self.intr.symbol_table.search(symbol).native, symbol)
+        self.assertReturns('mul(1000, 1000)', 1000000)
+        self.assertReturns('mul(0, ~mul(_, 1))', 0)
+        self.assertReturns('pow(3, <1>)', 8)
+        self.assertReturns('sub(100000, 10)', 0)
+        self.assertReturns('mul(1, <0, 1>)', [0, 1])
+
+    def test_affine(self):
+        self.assertOk('add = Pr[!0, Cn[S, !0]]')
+        self.assertOk('mul = Pr[#0, Cn[add, !2, !0]]')
+        self.assertOk('twice = Pr[!0, Cn[S, Cn[S, !0]]]')
+        self.assertReturns('twice(10000, 3)', 20003)
+        self.assertReturns('twice(10000, <0, 1>)', 20003)
+        self.assertOk('geom = Pr[!0, Cn[add, Cn[mul, !0, #3], #1]]')
+        self.assertReturns('geom(5, 1)', 364)
+        self.assertOk('keep = Pr[!1, Cn[add, !0, !2]]')
+        self.assertReturns('keep(3, 5, <1>)', 17)
+
+    def test_mn(self):
+        self.assertOk('load basics')
+        self.assertOk('sqrt = Mn[Cn[Sub, Cn[Mul, Cn[S, !0], Cn[S, !0]], Cn[S, !1]]]')
+        self.assertReturns('sqrt(99)', 9)
+        self.assertOk('never = Mn[#1]')
+        limit, monotone = settings.MN_LIMIT, settings.MN_MONOTONE
+        try:
+            settings.MN_LIMIT = 1000
+            messages = self.assertOk('never()')
+            self.assertTrue(any(msg.typ == MessageType.INFO and 'gave up' in msg.message for msg in messages))
+            self.assertFalse(messages[-1].natural.is_defined())
+            self.assertFalse(self.assertOk('sqrt(3000000)')[-1].natural.is_defined())
+            # the second search resumes where the first gave up
+            self.assertReturns('sqrt(3000000)', 1732)
+            settings.MN_MONOTONE = True
+            self.assertReturns('sqrt(1000000000000)', 1000000)
+            self.assertReturns('sqrt(0)', 0)
+            # where a bisection gave up is not where a linear search resumes
+            self.assertOk('five = Mn[Cn[Sub, Cn[Equal, !0, #5], #1]]')
+            settings.MN_LIMIT = 3
+            self.assertFalse(self.assertOk('five()')[-1].natural.is_defined())
+            settings.MN_LIMIT, settings.MN_MONOTONE = 1000, False
+            self.assertReturns('five()', 5)
+        finally:
+            settings.MN_LIMIT, settings.MN_MONOTONE = limit, monotone
+
+    def assertLimit(self, line: str, budget: Budget) -> Message:
+        ok, messages = self.intr.report(line, budget=budget)
+        self.assertFalse(ok)
+        self.assertEqual(messages[-1].typ, MessageType.LIMIT, f'"{line}" was not limited')
+        return messages[-1]
+
+    def test_budget(self):
+        self.assertOk('load basics')
+        self.assertOk('never = Mn[#1]')
+        msg = self.assertLimit('never()', Budget(steps=1000))
+        self.assertGreater(msg.usage['steps'], 1000)
+        self.assertLimit('Pow(1000000000, 2)', Budget(bits=1000000))
+        # the closed forms of recognized and affine loops check the size before computing it
+        self.assertOk('add = Pr[!0, Cn[S, !0]]')
+        self.assertOk('mul = Pr[#0, Cn[add, !2, !0]]')
+        self.assertOk('pow = Pr[#1, Cn[mul, !0, !2]]')
+        self.assertLimit('pow(30000000, 3)', Budget(bits=1000))
+        self.assertOk('geom = Pr[!0, Cn[add, Cn[mul, !0, #3], #1]]')
+        self.assertLimit('geom(30000000, 1)', Budget(bits=1000))
+        # and the loops of recognized definitions count their steps
+        self.assertOk('tri = Pr[#0, Cn[add, !0, !1]]')
+        self.assertIsNotNone(self.intr.symbol_table.search('tri').native)
+        self.assertLimit('tri(1000000)', Budget(steps=100))
+        self.assertLimit('never()', Budget(naturals=1000))
+        token = CancelToken()
+        threading.Timer(0.1, token.cancel).start()
+        msg = self.assertLimit('never()', Budget(token=token))
+        self.assertEqual(msg.message, 'Evaluation cancelled')
+        self.assertReturns('Pow(10, 2)', 1024)
+
+    def test_budget_threads(self):
+        # each thread evaluates against its own budget
+        results = {}
+        def run(steps: int):
+            intr = Interpreter()
+            intr.report('never = Mn[#1]')
+            results[steps] = intr.report('never()', budget=Budget(steps=steps))[1][-1]
+        threads = [threading.Thread(target=run, args=(steps,)) for steps in (20000, 40000)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for steps, msg in results.items():
+            self.assertEqual(msg.typ, MessageType.LIMIT)
+            self.assertEqual(msg.message, f'Evaluation exceeded its budget of {steps} steps')
+            self.assertEqual(msg.usage['steps'], steps + 1)
+        self.assertIsNone(Budget.local.active)
+
+    def test_primes(self):
+        table = primes.PrimeTable()
+        self.assertEqual([table[i] for i in range(10)], [2, 3, 5, 7, 11, 13, 17, 19, 23, 29])
+        self.assertEqual(table[9999], 104729)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'primes.bin')
+            table.save(path)
+            loaded = primes.PrimeTable()
+            loaded.load(path)
+            self.assertEqual(len(loaded), len(table))
+            self.assertEqual(loaded[9999], 104729)
+            # growing past the file copies the mapped primes
+            self.assertEqual(loaded[len(table)], table[len(table)])
+            self.assertIsNone(loaded.mapped)
+
+    def test_conversions(self):
+        self.assertOk('load basics')
+        self.assertOk('f = Cn[Add, Cn[Get, #1, !0], Cn[Add, Cn[Mod, !0, #7], Cn[Mod, !0, #5]]]')
+        # the interpreters of earlier tests may still hold an interned <1, 2, 3>
+        gc.collect()
+        conversions.reset()
+        self.assertReturns('f(<1, 2, 3>)', 5)
+        self.assertEqual(conversions.to_int, 1)
+        self.assertGreaterEqual(conversions.int_hits, 1)
+        # list access does not change the form of an int
+        self.assertOk('y = #12')
+        self.assertReturns('Cn[Get, #0, y]()', 2)
+        self.assertEqual(self.intr.symbol_table.search('y').fexpr.c_node.natural.key(), 12)
+
+    def test_metrics(self):
+        self.assertOk('load basics')
+        self.intr.reset_metrics()
+        self.assertReturns('Cn[Int, !0](<1, 0, 1>)', 10)
+        snapshot = self.intr.metrics()
+        self.assertEqual(snapshot['to_int'], 1)
+        self.assertGreaterEqual(snapshot['naturals'], 1)
+        self.assertReturns('Cn[Add, !0, !1](~Cn[S, !0](2), 3)', 6)
+        if settings.ENGINE != 'stack':
+            # the stack machine forces lazy values on its own stack
+            self.assertEqual(self.intr.metrics()['forced'], snapshot['forced'] + 1)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metrics.jsonl')
+            settings.METRICS = path
+            try:
+                self.assertOk('load logic')
+                self.assertReturns('Cn[Int, !0](<1, 0, 1>)', 10)
+            finally:
+                settings.METRICS = None
+            with open(path) as file:
+                records = [json.loads(line) for line in file]
+        # the lines of the loaded module are not written on their own
+        self.assertEqual([record['line'] for record in records], ['load logic', 'Cn[Int, !0](<1, 0, 1>)'])
+        self.assertEqual(records[1]['to_int'], 1)
+        self.assertGreaterEqual(records[1]['primes'], 3)
+
+    def test_script(self):
+        out = io.StringIO()
+        lines = ['load basics', 'f = Cn[Add,', '  !0, #2]', '; a comment', 'f(3)', 'g = Cn[h, !0]', 'f(~f(1))']
+        self.assertFalse(script.run(self.intr, lines, out, as_json=True))
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([record['ok'] for record in records], [True, True, True, False, True])
+        self.assertEqual(records[2]['messages'], [{'type': 'natural', 'natural': '5'}])
+        self.assertEqual(records[3]['messages'][0]['context'][1], '       ^')
+        out = io.StringIO()
+        self.assertTrue(script.run(self.intr, ['f(<1>)'], out))
+        self.assertEqual(out.getvalue(), ' = 4\n')
+        # the history keeps commands without their comments, for sessions and workers to replay
+        self.assertTrue(script.run(self.intr, ['h = Cn[f, ; two more', '  !0]  ; than !0'], out))
+        self.assertEqual(self.intr.history[-1], 'h = Cn[f, !0]')
+        session = server.ReplayedSession(server.Handler(self.intr))
+        response = session.answer({'jsonrpc': '2.0', 'id': 1, 'method': 'call', 'params': {'symbol': 'h', 'args': [1]}})
+        self.assertEqual(response['result']['messages'], [{'type': 'natural', 'natural': '3'}])
+
+    def test_server(self):
+        handler = server.Handler(self.intr)
+        def request(method, **params):
+            response = handler.answer({'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params})
+            return response.get('result', response.get('error'))
+        self.assertEqual(request('define', line='f = Cn[S, !0]')['ok'], True)
+        session = request('open')['session']
+        self.assertTrue(request('define', line='g = Cn[f, f]', session=session)['ok'])
+        self.assertEqual(request('call', symbol='g', args=[3], session=session)['messages'],
+                         [{'type': 'natural', 'natural': '5'}])
+        self.assertFalse(request('evaluate', line='g(3)')['ok'])
+        self.assertEqual(request('close', session=session), {})
+        self.assertEqual(request('evaluate', line='f(1)', session=session)['code'], server.INVALID_PARAMS)
+        result = request('evaluate', line='Mn[#1]()', budget={'steps': 100})
+        self.assertEqual(result['messages'][0]['type'], 'limit')
+        self.assertEqual(request('define', line='f(1)')['code'], server.INVALID_PARAMS)
+        self.assertEqual(request('nope')['code'], server.METHOD_NOT_FOUND)
+
+    def test_intern(self):
+        self.assertIs(self.Natural([0, [1]]), self.Natural([0, [1]]))
+        a, b = self.Natural([2, 1]), self.Natural([2, 1, 0])
+        self.assertEqual(a.key(), self.Natural([2, 1]).key())
+        self.assertNotEqual(a.key(), b.key())
+        self.assertTrue(self.Natural([2, 1]) == self.Natural([2, 1, 0]))
+        self.assertTrue(self.Natural([[1]]) == self.Natural([2]))
+        self.assertOk('load basics')
+        self.assertReturns('Cn[Int, !0](<2, 1>)', 12)
+        self.assertReturns('Cn[List, Cn[Int, !0]](<2, 1>)', [2, 1])
+        self.assertEqual(str(self.Natural([2, 1])), '<2, 1>')
+
+    def test_vector(self):
+        # lists long enough for the entries to span several levels of the trie
+        model, nat = [], self.Natural([])
+        for i in (0, 31, 32, 1023, 1024, 1500, 40):
+            nat = nat.set_entry(Natural(i), Natural(i + 1))
+            model.extend([0] * (i + 1 - len(model)))
+            model[i] = i + 1
+            self.assertTrue(nat == self.Natural(model))
+        self.assertIs(nat, self.Natural(model))
+        self.assertEqual([int(nat.get_entry(Natural(i))) for i in (40, 1500, 1501)], [41, 1501, 0])
+        self.assertTrue(nat.set_entry(Natural(1500), Natural(0)) == self.Natural(model[:1025]))
+        self.assertIs(nat.set_entry(Natural(1500), Natural(0)), self.Natural(model[:1025]))
+        # a list entry and a big int unpack the compact leaf, putting ints back packs it again
+        boxed = nat.set_entry(Natural(40), self.Natural([1, 2])).set_entry(Natural(41), Natural(1 << 70))
+        self.assertEqual(str(boxed.get_entry(Natural(40))), '<1, 2>')
+        self.assertEqual(int(boxed.get_entry(Natural(41))), 1 << 70)
+        self.assertIs(boxed.set_entry(Natural(40), Natural(41)).set_entry(Natural(41), Natural(0)), nat)
+        # Mul and Pow of whole lists, overflowing int64 on the last entry
+        big = self.Natural([1] * 39 + [1 << 62])
+        self.assertEqual(list((big * big).entries().ints()), [2] * 39 + [1 << 63])
+        self.assertTrue(big ** Natural(2) == big * big)
+        self.assertTrue(nat ** Natural(2) == nat * nat)
+        self.assertOk('load stack')
+        self.assertOk('xs = Pr[empty, Cn[append, !0, !1]]')
+        self.assertReturns('map[S](xs(100))', [100] + list(range(1, 101)))
+
+    def test_call_many(self):
+        self.assertOk('load basics')
+        self.assertOk('add = Pr[!0, Cn[S, !0]]')
+        calls = [(n, n + 1) for n in range(50)] + [(2, [1]), (None, 1)]
+        expect = [2 * n + 1 for n in range(50)] + [4, 1]
+        self.assertEqual([int(res) for res in self.intr.call_many('add', calls)], expect)
+        self.assertEqual([int(res) for res in self.intr.call_many('add', calls, workers=2)], expect)
+        self.assertOk('never = Mn[#1]')
+        with self.assertRaises(BudgetExceeded):
+            list(self.intr.call_many('never', [()], budget=Budget(steps=100)))
+
+    def test_parallel(self):
+        self.assertOk('load basics')
+        self.assertOk('spin = Pr[!0, Cn[Mod, Cn[Add, Cn[Mul, !0, !0], #1], #1000003]]')
+        self.assertOk('both = Cn[Add, Cn[spin, !0, #2], Cn[spin, !0, #3], ~Cn[spin, !0, #_]]')
+        saved = settings.PARALLEL_WORKERS, settings.PARALLEL_THRESHOLD
+        try:
+            expect = [int(res) for res in self.intr.call_many('both', [(300,), (301,)])]
+            self.intr.cache.clear()
+            settings.PARALLEL_WORKERS, settings.PARALLEL_THRESHOLD = 2, 0
+            # the first call measures the arguments, the next ones send them to the workers
+            for n in (300, 300, 301):
+                self.assertReturns(f'both({n})', expect[n - 300])
+            self.assertEqual(self.intr.parallel.executor is not None, settings.ENGINE != 'walk')
+        finally:
+            settings.PARALLEL_WORKERS, settings.PARALLEL_THRESHOLD = saved
+            self.intr.parallel.shutdown()
+
+    def test_syntax(self):
+        self.assertOk('add = Pr[!0, Cn[S, !0]]')
+        self.assertReturns('Cn[~add, !1, #<1>, !0..](3, 2)', 4)
+        self.assertReturns('#<2, <>, _>()', [2, [], None])
+        ok, messages = self.intr.report('f = Cn[S, !0, x]]')
+        self.assertFalse(ok)
+        self.assertEqual((messages[0].start, messages[0].stop), (16, 16))
+        ok, messages = self.intr.report('f = if[!0, 1]')
+        self.assertEqual((messages[0].start, messages[0].stop), (9, 9))
+        self.assertFalse(self.intr.parsable('f = Cn[S,')[0])
+        self.assertTrue(self.intr.parsable('f = Cn[S, ]')[0])
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'mod.rfpl')
+            with open(path, 'w') as file:
+                file.write('; add(x, y)\nadd =\n  Pr[!0, ; y\n     Cn[S, !0]]\n\ntwo = #2\nbad = Cn[add,\n  !0, 1]\n')
+            self.assertFalse(self.intr.load_rfpl_module(Path(path)))
+            messages, self.intr.messages = self.intr.messages, []
+            self.assertEqual(messages[-1].context, ['bad = Cn[add, !0, 1]', ' ' * 18 + '^'])
+        self.assertReturns('add(two(), 3)', 5)
+
+    def test_symbol_table(self):
+        table = self.intr.symbol_table
+        self.assertOk('one = #1')
+        self.assertOk('_t = #2')
+        key = table.add_temp_layer()
+        self.assertOk('_t = #3')
+        self.assertOk('one = Cn[S, _t]')
+        self.assertReturns('one()', 4)
+        table.clear_temp_layer(key)
+        # the module's _t is gone, the one it shadowed is back
+        self.assertReturns('_t()', 2)
+        self.assertReturns('one()', 4)
+        self.assertEqual([ent.symbol for ent in table.table], ['S', 'one', '_t', 'one'])
+
+    def test_module_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'twice.rfpl'
+            path.write_text('twice = Cn[f, Cn[f, !0]]\n')
+            self.assertOk('f = Cn[S, !0]')
+            self.assertTrue(self.intr.load_rfpl_module(path))
+            self.assertTrue((Path(tmp) / '__pycache__' / 'twice.rfplc').is_file())
+            self.assertReturns('twice(3)', 5)
+            # a warm load, f has the same type
+            self.intr = Interpreter()
+            self.assertOk('f = Pr[#1, Cn[S, !0]]')
+            self.assertTrue(self.intr.load_rfpl_module(path))
+            self.assertReturns('twice(3)', 5)
+            # f needs another argument now, so twice does not type check
+            self.intr = Interpreter()
+            self.assertOk('f = Cn[S, !1]')
+            self.assertFalse(self.intr.load_rfpl_module(path))
+            # a cache saved by other code of rfpl is stale, installed or not
+            self.assertIsNotNone(rfplc.current_version()[1])
+            hsh = self.intr.file_hash(path)
+            self.assertIsNotNone(rfplc.read(path, hsh))
+            saved, rfplc.VERSION = rfplc.VERSION, (rfplc.FORMAT, 'other')
+            try:
+                self.assertIsNone(rfplc.read(path, hsh))
+            finally:
+                rfplc.VERSION = saved
+
+    def test_profiler(self):
+        profiler = self.intr.profiler
+        if settings.ENGINE != 'compile':
+            self.assertRaises(ValueError, profiler.start)
+            return
+        evaluate = LeafNode.evaluate
+        self.assertOk('load basics')
+        self.assertOk('sqrt = Mn[Cn[Sub, Cn[Mul, Cn[S, !0], Cn[S, !0]], Cn[S, !1]]]')
+        self.assertOk('sqrts = Pr[#0, Cn[Add, !0, Cn[sqrt, !1]]]')
+        profiler.start()
+        try:
+            self.assertReturns('sqrt(99)', 9)
+            self.assertReturns('sqrts(5)', 5)
+        finally:
+            profiler.stop()
+        self.assertIs(LeafNode.evaluate, evaluate)
+        calls = {symbol: record.calls for symbol, record in profiler.symbols()}
+        self.assertEqual(calls, {'S': 60, 'Mul': 20, 'Sub': 20, 'sqrt': 6, 'Add': 5, 'sqrts': 1})
+        spans = [node for node, _ in profiler.spans()]
+        pr = next(node for node in spans if isinstance(node, PrNode))
+        mn = next(node for node in spans if isinstance(node, MnNode))
+        self.assertEqual((profiler.calls(pr.g), profiler.calls(mn.h)), (5, 20))
+        stacks = {line.rsplit(' ', 1)[0] for line in profiler.collapsed()}
+        self.assertLessEqual({'sqrt', 'sqrt;Mul', 'sqrts;sqrt;Mul'}, stacks)
+        profiler.reset()
+        self.assertEqual(profiler.symbols(), [])
+
     def test_factor(self):
         self.assertOk('load inflist')
         self.assertReturns('factor(100, 1023)', [3, [3, 1], [11, 1], [31, 1]])
@@ -52,6 +417,10 @@ class GeneralTestCase(unittest.TestCase):
         self.assertOk('load logic')
         self.assertReturns('if[#1, !0, #_](10)', 10)
         self.assertReturns('if[#0, #_, !1](_, 11)', 11)
+        # a builtin is undefined at its first undefined argument, the rest is never forced
+        self.assertOk('load basics')
+        for line in ('Cn[Add, ~Mn[#1], #_]()', 'Cn[Mod, #_, ~Mn[#1]]()'):
+            self.assertFalse(self.assertOk(line)[-1].natural.is_defined(), line)
 
     def test_stack(self):
         self.assertOk('load stack')
@@ -63,5 +432,36 @@ class GeneralTestCase(unittest.TestCase):
         self.assertReturns('filter[even](a())', [2, 2, 0])
 
 
+class WalkerTestCase(GeneralTestCase):
+    # same tests, evaluated by the tree walker instead of the compiled nodes
+    def setUp(self):
+        super().setUp()
+        self.engine = settings.ENGINE
+        settings.ENGINE = 'walk'
+
+    def tearDown(self):
+        settings.ENGINE = self.engine
+
+
+class StackTestCase(GeneralTestCase):
+    # same tests, evaluated on the explicit stack of the stack machine
+    def setUp(self):
+        super().setUp()
+        self.engine = settings.ENGINE
+        settings.ENGINE = 'stack'
+
+    def tearDown(self):
+        settings.ENGINE = self.engine
+
+    def test_deep(self):
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(500)
+        try:
+            self.assertOk('chain = Pr[#0, ~Cn[S, !0]]')
+            self.assertReturns('chain(20000)', 20000)
+        finally:
+            sys.setrecursionlimit(limit)
+
+
 if __name__ == '__main__':
     unittest.main()